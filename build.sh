@@ -5,4 +5,7 @@ echo "=== Starting Build ==="
 pip install -r requirements.txt
 python manage.py collectstatic --noinput
 python manage.py migrate
+if [ -n "$SQLITE_REPLICA" ]; then
+    python manage.py refresh_replica
+fi
 echo "=== Build Complete ==="
\ No newline at end of file
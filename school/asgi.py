@@ -5,6 +5,20 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+The dashboard and report views (teacher_dashboard, student_dashboard,
+my_grades, my_attendance, course_attendance) are async, so under ASGI a
+worker keeps serving other requests while they wait on the database or a
+slow client. Serve it with uvicorn, one process:
+
+    uvicorn school.asgi:application --host 0.0.0.0 --port 8000
+
+or with gunicorn managing several uvicorn workers:
+
+    gunicorn school.asgi:application -k uvicorn_worker.UvicornWorker
+
+The WSGI entry point (school.wsgi) keeps working; async views then run in a
+per-request event loop and still gather their independent reads.
 """
 
 import os
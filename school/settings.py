@@ -61,6 +61,8 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # Must come after SecurityMiddleware
+    'students.middleware.MetricsMiddleware',
+    'students.middleware.QueryBudgetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -101,13 +103,53 @@ WSGI_APPLICATION = 'school.wsgi.application'
 
 # Database configuration for Render (PostgreSQL) and local development (SQLite)
 # Always use SQLite on Render too
+#
+# Production profile: WAL lets readers run while one writer commits, writers
+# wait up to `timeout` seconds for the lock instead of failing with
+# "database is locked", and BEGIN IMMEDIATE takes the write lock when a
+# transaction starts, so two writers never deadlock upgrading read locks.
+# Connections are kept for CONN_MAX_AGE seconds instead of one per request.
+SQLITE_PRAGMAS = [
+    'PRAGMA journal_mode=WAL',
+    # with WAL, NORMAL only risks the last commits on power loss, not corruption
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-20000',     # 20 MB page cache per connection
+    'PRAGMA mmap_size=134217728',   # 128 MB
+]
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': int(os.environ.get('CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'timeout': 20,
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': ';'.join(SQLITE_PRAGMAS),
+        },
     }
 }
 
+# Optional read replica: a copy of the database refreshed with
+# `manage.py refresh_replica` (e.g. from cron). Views marked with
+# students.routers.replica_reads read from it; everything else, and every
+# write, uses 'default'. Replica data is as old as its last refresh.
+SQLITE_REPLICA = os.environ.get('SQLITE_REPLICA')
+if SQLITE_REPLICA:
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': SQLITE_REPLICA,
+        'CONN_MAX_AGE': int(os.environ.get('REPLICA_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'timeout': 20,
+            'init_command': ';'.join(['PRAGMA query_only=ON', *SQLITE_PRAGMAS[2:]]),
+        },
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_ROUTERS = ['students.routers.ReplicaRouter']
+
 # Remove the if/else PostgreSQL logic completely
 
 
@@ -155,8 +197,18 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
-# WhiteNoise configuration for static files
-STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+# Stylesheets live in students/static/students/css/. collectstatic gives
+# every file a content-hashed name plus .gz and .br (Brotli) copies, and
+# WhiteNoise serves hashed names with a far-future, immutable Cache-Control
+# and picks the compressed copy the browser accepts.
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage',
+    },
+}
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -168,6 +220,87 @@ LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'role_redirect'
 LOGOUT_REDIRECT_URL = 'login'
 
+# Per-view query budgets (by URL name), checked by QueryBudgetMiddleware.
+# Counts include the user lookup; the session and the user's permissions
+# come from the cache (a user's first request after a cache flush reads the
+# session row and permission tables, and can go over). Views with an ETag
+# validator (students/conditional.py) spend one more query on it, which a 304
+# answer then saves the rest of. Over budget logs a warning; the test suite
+# turns on QUERY_BUDGET_RAISE so it fails instead.
+QUERY_BUDGETS = {
+    'role_redirect': 1,
+    'student_list': 4,
+    'student_detail': 4,
+    'teacher_dashboard': 4,
+    'student_dashboard': 4,
+    'roster_attendance': 12,
+    'attendance_list': 2,
+    'my_attendance': 4,
+    'course_attendance': 4,
+    'grade_grid': 12,
+    'my_grades': 4,
+    'grade_list': 5,
+    'autocomplete': 3,
+    'job_status': 2,
+}
+QUERY_REPEAT_THRESHOLD = 5
+QUERY_BUDGET_RAISE = False
+
+# Request metrics served at /metrics/. Set METRICS_DIR to a directory shared
+# by all gunicorn workers so one scrape adds up every worker.
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_FLUSH_INTERVAL = 1.0
+
+# Background jobs (see students/jobs.py), run by `manage.py run_jobs`.
+# Retries wait JOB_RETRY_BACKOFF seconds, doubling each attempt up to
+# JOB_RETRY_BACKOFF_MAX. A job whose worker stops renewing its JOB_LEASE
+# (seconds) is queued again.
+JOB_MAX_ATTEMPTS = 3
+JOB_RETRY_BACKOFF = 30
+JOB_RETRY_BACKOFF_MAX = 60 * 60
+JOB_LEASE = 5 * 60
+JOB_PROGRESS_INTERVAL = 1.0
+JOB_OUTPUT_DIR = os.environ.get('JOB_OUTPUT_DIR', MEDIA_ROOT / 'jobs')
+
+# Cache for rendered fragments (see students/caching.py), picked with
+# CACHE_BACKEND:
+#   locmem - per process; fine for one worker and for tests (default)
+#   file   - a directory shared by all gunicorn workers on one machine,
+#            CACHE_DIR (default when CACHE_DIR is set)
+#   redis  - any Redis-compatible server (Redis, Valkey, KeyDB...) at
+#            CACHE_URL; needs the `redis` package
+# With locmem, a version bump in one worker is not seen by the others.
+CACHE_DIR = os.environ.get('CACHE_DIR')
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'file' if CACHE_DIR else 'locmem')
+CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': CACHE_DIR or BASE_DIR / 'cache',
+    },
+    'redis': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('CACHE_URL', 'redis://127.0.0.1:6379/0'),
+    },
+}
+CACHES = {'default': CACHE_BACKENDS[CACHE_BACKEND]}
+
+# Async views run independent reads on separate threads and connections at
+# once (students/concurrency.py). Off, they run one after another. Only turn
+# it on when serving ASGI (school/asgi.py): under WSGI every request to an
+# async view gets a new event loop and executor, and each of its threads opens
+# (and keeps) a fresh database connection, which costs more than it saves.
+ASYNC_PARALLEL_QUERIES = os.environ.get('ASYNC_PARALLEL_QUERIES', 'False') == 'True'
+
+# Sessions are read from the cache and written through to the database, so
+# a cache miss or restart falls back to the django_session row.
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+# Permission sets are cached across requests (students/backends.py)
+AUTHENTICATION_BACKENDS = ['students.backends.CachedModelBackend']
+
 # Custom user model
 AUTH_USER_MODEL = 'students.CustomerUser'
 
@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import Student,Course,Department,CustomerUser,Exam,Grade,Attendance,Teacher
+from .models import Student,Course,Department,CustomerUser,Exam,Grade,Attendance,Teacher,Gradebook,AttendanceSummary,CourseAttendanceDay,Job
 # Register your models here.
 admin.site.register(Student)
 admin.site.register(Course)
@@ -9,4 +9,8 @@ admin.site.register(Attendance)
 admin.site.register(CustomerUser, UserAdmin)
 admin.site.register(Exam)
 admin.site.register(Grade)
-admin.site.register(Teacher)
\ No newline at end of file
+admin.site.register(Teacher)
+admin.site.register(Gradebook)
+admin.site.register(AttendanceSummary)
+admin.site.register(CourseAttendanceDay)
+admin.site.register(Job)
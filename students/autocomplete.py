@@ -0,0 +1,54 @@
+from .models import Exam, Student
+
+# -------------------------------
+# Autocomplete
+# -------------------------------
+# Form pickers ask for a handful of matches as the teacher types instead of
+# rendering every row as an <option>. Student names are matched by prefix on
+# the casefolded name_key index, as a range scan that stops after LIMIT rows,
+# and only students enrolled in the teacher's courses are returned.
+
+LIMIT = 20
+
+
+def enrolled_students(teacher, course=None):
+    enrollments = Student.courses.through.objects.filter(course__teacher=teacher)
+    if course is not None:
+        enrollments = enrollments.filter(course_id=course)
+    return Student.objects.filter(pk__in=enrollments.values('student_id'))
+
+
+def teacher_exams(teacher, course=None):
+    exams = Exam.objects.filter(course__teacher=teacher)
+    if course is not None:
+        exams = exams.filter(course_id=course)
+    return exams
+
+
+def match_students(teacher, q, course=None):
+    prefix = q.strip().casefold()
+    rows = enrolled_students(teacher, course)
+    if prefix:
+        # [prefix, prefix + U+10FFFF) covers every name starting with prefix
+        rows = rows.filter(name_key__gte=prefix, name_key__lt=prefix + '\U0010ffff')
+    return rows.order_by('name_key', 'id')
+
+
+def students(teacher, q, course=None, limit=LIMIT):
+    rows = match_students(teacher, q, course).values_list('pk', 'name')[:limit]
+    return [{'id': pk, 'text': name} for pk, name in rows]
+
+
+def exams(teacher, q, course=None, limit=LIMIT):
+    rows = teacher_exams(teacher, course).filter(name__istartswith=q.strip())
+    rows = rows.order_by('name', 'id').values_list('pk', 'name', 'course__course_name', 'max_score')[:limit]
+    return [
+        {'id': pk, 'text': f'{name} - {course_name}', 'max_score': max_score}
+        for pk, name, course_name, max_score in rows
+    ]
+
+
+SOURCES = {
+    'students': students,
+    'exams': exams,
+}
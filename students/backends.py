@@ -0,0 +1,28 @@
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+from . import caching
+
+# -------------------------------
+# Cached permissions
+# -------------------------------
+# ModelBackend loads a user's permissions from the permission and group
+# tables once per request. This backend keeps the set in the cache across
+# requests, under the user's 'permissions' version, which signals.py bumps
+# when the user's groups or permissions, a group's permissions, or the
+# superuser flag change.
+
+
+class CachedModelBackend(ModelBackend):
+    def get_all_permissions(self, user_obj, obj=None):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return set()
+        if not hasattr(user_obj, '_perm_cache'):
+            version = caching.versions(('permissions', user_obj.pk), ('permissions', 'all'))
+            key = caching.make_key('permissions', version, user_obj.pk)
+            perms = cache.get(key)
+            if perms is None:
+                perms = super().get_all_permissions(user_obj)
+                cache.set(key, perms, caching.CACHE_TIMEOUT)
+            user_obj._perm_cache = perms
+        return user_obj._perm_cache
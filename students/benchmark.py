@@ -0,0 +1,185 @@
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import URLPattern, reverse
+
+from . import jobs, urls
+from .middleware import QueryRecorder
+from .models import Course, Student, Teacher
+
+# -------------------------------
+# View benchmarks
+# -------------------------------
+# One recipe per URL name in students/urls.py: which seeded account requests
+# it, and how to build its URL. Routes without a recipe are reported so new
+# views do not silently go unmeasured. Routes in POSTS are posted that form
+# data instead of fetched.
+
+ROUTES = {
+    'signup': ('anonymous', {}, ''),
+    'role_redirect': ('teacher', {}, ''),
+    'student_list': ('admin', {}, ''),
+    'student_create': ('admin', {}, ''),
+    'student_update': ('admin', {'pk': 'student'}, ''),
+    'student_delete': ('admin', {'pk': 'student'}, ''),
+    'student_add_course': ('admin', {'pk': 'student'}, ''),
+    'student_detail': ('admin', {'pk': 'student'}, ''),
+    'teacher_dashboard': ('teacher', {}, ''),
+    'student_dashboard': ('student', {}, ''),
+    'mark_attendance': ('teacher', {}, ''),
+    'roster_attendance': ('teacher', {}, '?course={course}'),
+    'attendance_list': ('teacher', {}, ''),
+    'my_attendance': ('student', {}, ''),
+    'course_attendance': ('teacher', {'pk': 'course'}, ''),
+    'add_grade': ('teacher', {}, ''),
+    'grade_grid': ('teacher', {}, '?course={course}'),
+    'my_grades': ('student', {}, ''),
+    'grade_list': ('teacher', {}, ''),
+    'autocomplete': ('teacher', {'kind': 'students'}, '?q=a&course={course}'),
+    'export_data': ('teacher', {'kind': 'attendance'}, '?course={course}'),
+    'export_job': ('teacher', {'kind': 'attendance'}, ''),
+    'job_status': ('teacher', {'pk': 'job'}, ''),
+    'job_download': ('teacher', {'pk': 'job'}, ''),
+    'metrics': ('admin', {}, ''),
+}
+POSTS = {
+    'export_job': {'format': 'csv', 'course': '{course}'},
+}
+
+
+def url_names():
+    names = [pattern.name for pattern in urls.urlpatterns
+             if isinstance(pattern, URLPattern) and pattern.name]
+    return list(dict.fromkeys(names))
+
+
+class Sample:
+    # the seeded rows the recipes point at: a busy teacher, one of their
+    # courses, an enrolled student with a login, an admin account, and a
+    # finished export job of the teacher's
+    def __init__(self):
+        from django.contrib.auth import get_user_model
+        User = get_user_model()
+
+        self.student = (Student.objects.filter(user__isnull=False, courses__isnull=False)
+                        .select_related('user').order_by('pk').first())
+        self.course = self.student.courses.exclude(teacher=None).order_by('pk').first() if self.student else None
+        teacher = self.course.teacher if self.course else Teacher.objects.exclude(user=None).first()
+        self.teacher = teacher.user if teacher else None
+        self.admin = User.objects.filter(is_superuser=True).first() or User.objects.create_superuser(
+            'bench-admin', 'bench-admin@example.com', 'password'
+        )
+        self.job = None
+        if self.teacher and self.course:
+            self.job = jobs.enqueue('export', user=self.teacher, kind='attendance', course=self.course.pk)
+            jobs.Worker(pool='inline').run(burst=True)
+
+    def user(self, role):
+        return {'teacher': self.teacher, 'student': self.student and self.student.user,
+                'admin': self.admin, 'anonymous': None}[role]
+
+    def url(self, name):
+        role, kwargs, query = ROUTES[name]
+        objects = {'student': self.student, 'course': self.course, 'job': self.job}
+        kwargs = {key: (objects[value].pk if value in objects else value) for key, value in kwargs.items()}
+        course = self.course.pk if self.course else ''
+        data = {key: value.format(course=course) for key, value in POSTS[name].items()} if name in POSTS else None
+        return role, reverse(name, kwargs=kwargs) + query.format(course=course), data
+
+
+def measure(client, url, repeat, data=None):
+    # warm up once, then time `repeat` requests; peak memory comes from a
+    # separate traced request so tracing does not skew the latency numbers
+    def fetch():
+        if data is not None:
+            response = client.post(url, data, secure=True)
+        else:
+            response = client.get(url, secure=True)
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+        return response
+
+    response = fetch()
+    latencies, sql_times, query_counts = [], [], []
+    for _ in range(repeat):
+        # timed here: captured_queries rounds each query to whole milliseconds
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            started = time.perf_counter()
+            fetch()
+            latencies.append(time.perf_counter() - started)
+        query_counts.append(recorder.count)
+        sql_times.append(recorder.duration)
+
+    tracemalloc.start()
+    fetch()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'status': response.status_code,
+        'queries': max(query_counts),
+        'sql_ms': round(statistics.median(sql_times) * 1000, 3),
+        'latency_ms': round(statistics.median(latencies) * 1000, 3),
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def run(repeat=5, stdout=None):
+    # job files go to a scratch directory, like the throwaway database, and
+    # static URLs are not hashed, so no collectstatic manifest is needed
+    storages = {**settings.STORAGES,
+                'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'}}
+    with tempfile.TemporaryDirectory() as job_output, \
+            override_settings(JOB_OUTPUT_DIR=job_output, STORAGES=storages):
+        return _run(repeat, stdout)
+
+
+def _run(repeat, stdout):
+    sample = Sample()
+    results = {}
+    for name in url_names():
+        if name not in ROUTES:
+            if stdout:
+                stdout.write(f'{name}: no benchmark recipe, skipped')
+            continue
+        role, url, data = sample.url(name)
+        client = Client()
+        user = sample.user(role)
+        if user is not None:
+            client.force_login(user)
+        results[name] = {'url': url, **measure(client, url, repeat, data)}
+        if stdout:
+            result = results[name]
+            stdout.write(f"{name:20} {result['status']} {result['queries']:4} queries "
+                         f"{result['sql_ms']:9.2f} ms sql {result['latency_ms']:9.2f} ms "
+                         f"{result['peak_kb']:10.1f} KiB")
+    return results
+
+
+# differences below these are treated as run-to-run noise
+NOISE_FLOOR = {'latency_ms': 5, 'peak_kb': 64}
+
+
+def compare(baseline, current, tolerance=0.25):
+    # (size, url name, metric, old, new) for every metric that got worse
+    regressions = []
+    for size, views in current.items():
+        for name, result in views.items():
+            old = baseline.get(size, {}).get(name)
+            if not old:
+                continue
+            if result['queries'] > old['queries']:
+                regressions.append((size, name, 'queries', old['queries'], result['queries']))
+            for metric in ('latency_ms', 'peak_kb'):
+                if (result[metric] > old[metric] * (1 + tolerance)
+                        and result[metric] - old[metric] > NOISE_FLOOR[metric]):
+                    regressions.append((size, name, metric, old[metric], result[metric]))
+    return regressions
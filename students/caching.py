@@ -0,0 +1,88 @@
+import hashlib
+import uuid
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.template.loader import render_to_string
+
+from .metrics import registry
+
+# -------------------------------
+# Versioned cache keys
+# -------------------------------
+# Cached output is keyed by version tokens: one per teacher for their
+# dashboard, one per student for their grade and attendance pages, one per
+# user for their permission set, one for the attendance list's ETag (see
+# conditional.py), plus an 'all' token per scope. A write that changes what
+# a page shows bumps the matching token, and entries under the old token are
+# never read again and expire on their own. Tokens are random rather than counters, so a token
+# that gets evicted cannot come back with an old value and serve stale
+# entries. The backend is whatever CACHES['default'] is (see settings.py).
+
+CACHE_TIMEOUT = 60 * 60
+
+
+def _key(scope, ident):
+    return f'version:{scope}:{ident}'
+
+
+def versions(*pairs):
+    # current token for each (scope, id) pair, creating missing ones
+    keys = [_key(scope, ident) for scope, ident in pairs]
+    found = cache.get_many(keys)
+    missing = {key: uuid.uuid4().hex for key in keys if key not in found}
+    if missing:
+        cache.set_many(missing, None)
+        found.update(missing)
+    return ':'.join(found[key] for key in keys)
+
+
+async def aversions(*pairs):
+    keys = [_key(scope, ident) for scope, ident in pairs]
+    found = await cache.aget_many(keys)
+    missing = {key: uuid.uuid4().hex for key in keys if key not in found}
+    if missing:
+        await cache.aset_many(missing, None)
+        found.update(missing)
+    return ':'.join(found[key] for key in keys)
+
+
+def _new_tokens(keys):
+    cache.set_many({key: uuid.uuid4().hex for key in keys}, None)
+
+
+def bump(scope, idents):
+    keys = [_key(scope, ident) for ident in set(idents) if ident is not None]
+    if not keys:
+        return
+    _new_tokens(keys)
+    if connection.in_atomic_block:
+        # a page rendered before the write commits would be cached under the
+        # token set above, so bump again once the new rows are visible
+        transaction.on_commit(lambda: _new_tokens(keys))
+
+
+def make_key(name, version, *vary_on):
+    # vary_on is hashed so user-supplied parts (cursors, filters) keep the key
+    # short and safe for any backend
+    digest = hashlib.md5(':'.join(map(str, vary_on)).encode(), usedforsecurity=False).hexdigest()
+    return f'{name}:{version}:{digest}'
+
+
+async def afragment(name, template, context, scopes, vary_on=()):
+    # render `template` with await context() and cache the HTML under the
+    # scopes' versions; context is only awaited on a miss and must return
+    # evaluated data, since the template renders on the event loop
+    key = make_key(name, await aversions(*scopes), *vary_on)
+    html = await cache.aget(key)
+    registry.count_cache(name, hit=html is not None)
+    if html is None:
+        html = render_to_string(template, await context())
+        await cache.aset(key, html, CACHE_TIMEOUT)
+    return html
+
+
+def bump_course_teachers(course_ids):
+    # invalidate the dashboards of whoever teaches these courses
+    from .models import Course
+    bump('teacher', Course.objects.filter(pk__in=course_ids).values_list('teacher_id', flat=True))
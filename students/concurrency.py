@@ -0,0 +1,48 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from .middleware import track_queries
+
+# -------------------------------
+# Concurrent reads for async views
+# -------------------------------
+# Django's async ORM still runs a request's queries one after another on one
+# thread. gather() takes independent read functions (each must return fully
+# evaluated data: lists, dicts, model instances) and, with
+# ASYNC_PARALLEL_QUERIES on, runs each on its own pool thread and database
+# connection, so the view waits for the slowest read rather than the sum.
+#
+# Reads on other connections cannot see uncommitted writes, so only gather
+# reads in views that have not written anything yet. The test suite turns
+# parallel reads off: its data lives in a transaction that only the main
+# connection can see.
+
+
+def _read_on_pool_thread(read):
+    def run():
+        # pool threads keep their connections between requests; apply
+        # CONN_MAX_AGE to them the way request_finished does for the request
+        # thread, and make their queries count towards the request's budget
+        close_old_connections()
+        track_queries()
+        return read()
+    return run
+
+
+async def gather(*reads):
+    if not getattr(settings, 'ASYNC_PARALLEL_QUERIES', False):
+        return [await sync_to_async(read)() for read in reads]
+    return await asyncio.gather(*(
+        sync_to_async(_read_on_pool_thread(read), thread_sensitive=False)()
+        for read in reads
+    ))
+
+
+async def request_user(request):
+    # templates and context processors read request.user synchronously;
+    # resolve it once here so rendering does not query from the event loop
+    request.user = await request.auser()
+    return request.user
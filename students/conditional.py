@@ -0,0 +1,76 @@
+import functools
+import hashlib
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from . import concurrency
+
+# -------------------------------
+# Conditional GETs
+# -------------------------------
+# Pages that clients poll answer 304 Not Modified, without running the view,
+# when nothing they show has changed. A view's validator(request, *args,
+# **kwargs) returns None (let the view run, e.g. to 404) or a pair:
+#
+#   parts:          values that change whenever the page would, such as
+#                   version tokens (caching.py) or updated_at timestamps
+#   last_modified:  a datetime, or None when the timestamps do not see every
+#                   change (deletes, renamed courses) and only the ETag is safe
+#
+# The ETag also covers the user and their CSRF cookie: pages show who is
+# logged in and embed a CSRF token for the logout form.
+#
+# Django's condition() decorator calls its functions on the event loop, where
+# the ORM cannot run, and before login_required when stacked under it, so
+# this wraps both kinds of view instead.
+
+
+def _etag(request, parts):
+    # on a first visit this creates the CSRF secret the page will be rendered with
+    get_token(request)
+    key = ':'.join(map(str, (request.user.pk, request.META['CSRF_COOKIE'], *parts)))
+    return quote_etag(hashlib.md5(key.encode(), usedforsecurity=False).hexdigest())
+
+
+def _check(request, validator, args, kwargs):
+    if request.method not in ('GET', 'HEAD'):
+        return None, None, None
+    validators = validator(request, *args, **kwargs)
+    if validators is None:
+        return None, None, None
+    parts, last_modified = validators
+    etag = _etag(request, parts)
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    return get_conditional_response(request, etag=etag, last_modified=timestamp), etag, timestamp
+
+
+def _stamp(response, etag, timestamp):
+    if etag and response.status_code in (200, 304):
+        response.headers.setdefault('ETag', etag)
+        if timestamp:
+            response.headers.setdefault('Last-Modified', http_date(timestamp))
+    return response
+
+
+def conditional(validator):
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                await concurrency.request_user(request)
+                response, etag, timestamp = await sync_to_async(_check)(request, validator, args, kwargs)
+                if response is None:
+                    response = await view(request, *args, **kwargs)
+                return _stamp(response, etag, timestamp)
+        else:
+            @functools.wraps(view)
+            def wrapper(request, *args, **kwargs):
+                response, etag, timestamp = _check(request, validator, args, kwargs)
+                if response is None:
+                    response = view(request, *args, **kwargs)
+                return _stamp(response, etag, timestamp)
+        return wrapper
+    return decorator
@@ -0,0 +1,77 @@
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Attendance, Grade
+
+# -------------------------------
+# Streaming exports
+# -------------------------------
+# Rows are read as values() dicts through a chunked server-side iterator and
+# written out one at a time, so memory stays flat however many rows match
+# and the first bytes go out before the query has finished.
+
+CHUNK_SIZE = 2000
+
+EXPORTS = {
+    'attendance': {
+        'model': Attendance,
+        'date_field': 'date',
+        'fields': ['id', 'date', 'status',
+                   'student_id', 'student__name',
+                   'course_id', 'course__course_code', 'course__course_name'],
+    },
+    'grades': {
+        'model': Grade,
+        'date_field': 'exam__date',
+        'fields': ['id', 'student_id', 'student__name',
+                   'course_id', 'course__course_code', 'course__course_name',
+                   'exam_id', 'exam__name', 'exam__date', 'score'],
+    },
+}
+FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+
+def export_queryset(kind, course=None, department=None, start=None, end=None, teacher=None):
+    export = EXPORTS[kind]
+    queryset = export['model'].objects.all()
+    if teacher is not None:
+        queryset = queryset.filter(course__teacher=teacher)
+    if course is not None:
+        queryset = queryset.filter(course_id=course)
+    if department is not None:
+        queryset = queryset.filter(course__department_id=department)
+    if start is not None:
+        queryset = queryset.filter(**{f"{export['date_field']}__gte": start})
+    if end is not None:
+        queryset = queryset.filter(**{f"{export['date_field']}__lte": end})
+    return queryset.order_by('id').values_list(*export['fields'])
+
+
+class Echo:
+    # csv.writer target that hands each line back instead of buffering it
+    def write(self, value):
+        return value
+
+
+def stream_csv(kind, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORTS[kind]['fields'])
+    for row in rows.iterator(chunk_size=CHUNK_SIZE):
+        yield writer.writerow(row)
+
+
+def stream_jsonl(kind, rows):
+    fields = EXPORTS[kind]['fields']
+    for row in rows.iterator(chunk_size=CHUNK_SIZE):
+        yield json.dumps(dict(zip(fields, row)), cls=DjangoJSONEncoder) + '\n'
+
+
+def stream(kind, fmt, rows):
+    if fmt == 'jsonl':
+        return stream_jsonl(kind, rows)
+    return stream_csv(kind, rows)
@@ -1,9 +1,16 @@
+import csv
+import io
+
 from django import forms
+from django.core.exceptions import ValidationError
+from django.urls import reverse_lazy
 from django.contrib.auth.models import User
 from django.contrib.auth import get_user_model
 User=get_user_model()
 
 from .models import Student,Course,Attendance,Grade,Exam
+from .exports import FORMATS
+from .autocomplete import enrolled_students, teacher_exams
 
 
 
@@ -52,29 +59,210 @@ class SignUpForm(forms.ModelForm):
         return cleaned_data
     
 
+class AutocompleteSelect(forms.Select):
+    # renders only the selected option; autocomplete.js fills the rest in from
+    # the JSON endpoint as the user types, so the page size and the queries do
+    # not grow with the number of rows the field could point at
+    def __init__(self, kind, attrs=None):
+        super().__init__(attrs)
+        self.kind = kind
+
+    class Media:
+        js = ['students/autocomplete.js']
+
+    def build_attrs(self, base_attrs, extra_attrs=None):
+        attrs = super().build_attrs(base_attrs, extra_attrs)
+        attrs['data-autocomplete'] = reverse_lazy('autocomplete', kwargs={'kind': self.kind})
+        return attrs
+
+    def optgroups(self, name, value, attrs=None):
+        field = self.choices.field
+        selected = []
+        for item in value:
+            # a re-rendered invalid form carries whatever was posted; to_python
+            # looks the row up within the field's queryset
+            try:
+                obj = field.to_python(item)
+            except (ValueError, ValidationError):
+                continue
+            if obj is not None:
+                selected.append(obj)
+        options = [self.create_option(name, '', '---------', not selected, 0)]
+        for index, obj in enumerate(selected, start=1):
+            options.append(self.create_option(name, obj.pk, field.label_from_instance(obj), True, index))
+        return [(None, options, 0)]
+
+
 class AttendanceForm(forms.ModelForm):
     class Meta:
         model = Attendance
         fields = ['student', 'course', 'status']
+        widgets = {
+            'student': AutocompleteSelect('students'),
+        }
 
     def __init__(self, *args, **kwargs):
         teacher = kwargs.pop('teacher', None)
         super().__init__(*args, **kwargs)
         if teacher:
             self.fields['course'].queryset = Course.objects.filter(teacher=teacher)
+            self.fields['student'].queryset = enrolled_students(teacher)
+
+
+class RosterCourseForm(forms.Form):
+    course=forms.ModelChoiceField(queryset=Course.objects.none())
+
+    def __init__(self, *args, **kwargs):
+        teacher = kwargs.pop('teacher', None)
+        super().__init__(*args, **kwargs)
+        self.fields['course'].queryset = Course.objects.filter(teacher=teacher)
+
+
+class RosterAttendanceForm(forms.Form):
+    # one present/absent field per enrolled student, named status_<student id>
+    def __init__(self, *args, **kwargs):
+        students = kwargs.pop('students')
+        marked = kwargs.pop('marked', {})
+        super().__init__(*args, **kwargs)
+        for student in students:
+            self.fields[f'status_{student.pk}'] = forms.ChoiceField(
+                label=student.name,
+                choices=Attendance.status_choices,
+                initial=marked.get(student.pk, 'present'),
+                widget=forms.RadioSelect,
+            )
+
+    def statuses(self):
+        return {
+            int(name.removeprefix('status_')): status
+            for name, status in self.cleaned_data.items()
+        }
+
+
+class ExportFilterForm(forms.Form):
+    format=forms.ChoiceField(choices=[(fmt, fmt) for fmt in FORMATS],required=False)
+    course=forms.IntegerField(required=False)
+    department=forms.IntegerField(required=False)
+    start=forms.DateField(required=False)
+    end=forms.DateField(required=False)
 
 
 class GradeForm(forms.ModelForm):
     class Meta:
         model = Grade
         fields = ['student', 'exam', 'score','course']
+        widgets = {
+            'student': AutocompleteSelect('students'),
+            'exam': AutocompleteSelect('exams'),
+        }
 
     def __init__(self, *args, **kwargs):
         teacher = kwargs.pop('teacher', None)
         super().__init__(*args, **kwargs)
+        # Exam labels include the course name
+        self.fields['exam'].queryset = Exam.objects.select_related('course')
 
         if teacher:
-            # self.fields['exam'].queryset = Exam.objects.filter(
-            #     course__teacher=teacher
-            # )
+            self.fields['exam'].queryset = teacher_exams(teacher).select_related('course')
             self.fields['course'].queryset = Course.objects.filter(teacher=teacher)
+            self.fields['student'].queryset = enrolled_students(teacher)
+
+
+class GradeGridForm(forms.Form):
+    # students x exams grid for one course; cells are named score_<student id>_<exam id>
+    csv_text=forms.CharField(label='Paste CSV',required=False,widget=forms.Textarea(attrs={'rows': 4}))
+    csv_file=forms.FileField(label='Upload CSV',required=False)
+
+    def __init__(self, *args, **kwargs):
+        self.students = list(kwargs.pop('students'))
+        self.exams = list(kwargs.pop('exams'))
+        scores = kwargs.pop('scores', {})
+        super().__init__(*args, **kwargs)
+
+        self.max_scores = {exam.pk: exam.max_score for exam in self.exams}
+        for student in self.students:
+            for exam in self.exams:
+                self.fields[self.cell_name(student.pk, exam.pk)] = forms.FloatField(
+                    label=f'{student.name} - {exam.name}',
+                    required=False,
+                    min_value=0,
+                    max_value=self.max_scores[exam.pk],
+                    initial=scores.get((student.pk, exam.pk)),
+                    widget=forms.NumberInput(attrs={'step': 'any', 'max': self.max_scores[exam.pk]}),
+                )
+
+    @staticmethod
+    def cell_name(student_id, exam_id):
+        return f'score_{student_id}_{exam_id}'
+
+    def rows(self):
+        # (student, [bound cell per exam]) for rendering the grid
+        for student in self.students:
+            yield student, [self[self.cell_name(student.pk, exam.pk)] for exam in self.exams]
+
+    def clean(self):
+        cleaned_data = super().clean()
+        text = cleaned_data.get('csv_text')
+        upload = cleaned_data.get('csv_file')
+        if upload:
+            try:
+                text = upload.read().decode('utf-8-sig')
+            except UnicodeDecodeError:
+                raise forms.ValidationError('CSV must be UTF-8')
+        if text:
+            for name, score in self.parse_csv(text).items():
+                cleaned_data[name] = score
+        return cleaned_data
+
+    def parse_csv(self, text):
+        # header: student, <exam name>, ...; rows: <student id>, <score>, ...
+        reader = csv.reader(io.StringIO(text.strip()))
+        header = next(reader, None)
+        if not header:
+            return {}
+
+        exams_by_name = {exam.name.strip().lower(): exam for exam in self.exams}
+        columns = []
+        for title in header[1:]:
+            exam = exams_by_name.get(title.strip().lower())
+            if exam is None:
+                raise forms.ValidationError(f'Unknown exam column "{title}"')
+            columns.append(exam)
+
+        student_ids = {student.pk for student in self.students}
+        cells = {}
+        for line, row in enumerate(reader, start=2):
+            if not row or not row[0].strip():
+                continue
+            try:
+                student_id = int(row[0])
+            except ValueError:
+                raise forms.ValidationError(f'Line {line}: "{row[0]}" is not a student id')
+            if student_id not in student_ids:
+                raise forms.ValidationError(f'Line {line}: student {student_id} is not enrolled in this course')
+
+            for exam, value in zip(columns, row[1:]):
+                value = value.strip()
+                if not value:
+                    continue
+                try:
+                    score = float(value)
+                except ValueError:
+                    raise forms.ValidationError(f'Line {line}: "{value}" is not a number')
+                max_score = self.max_scores[exam.pk]
+                if not 0 <= score <= max_score:
+                    raise forms.ValidationError(
+                        f'Line {line}: {exam.name} score must be between 0 and {max_score}'
+                    )
+                cells[self.cell_name(student_id, exam.pk)] = score
+        return cells
+
+    def scores(self):
+        # only filled-in cells; blank cells leave any existing grade untouched
+        scores = {}
+        for student in self.students:
+            for exam in self.exams:
+                score = self.cleaned_data.get(self.cell_name(student.pk, exam.pk))
+                if score is not None:
+                    scores[(student.pk, exam.pk)] = score
+        return scores
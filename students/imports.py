@@ -0,0 +1,278 @@
+import csv
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import DatabaseError, models, transaction
+
+from . import caching, search
+from .models import Course, Department, Student, Teacher
+
+# -------------------------------
+# Bulk imports
+# -------------------------------
+# Files are read one row at a time; departments, courses and teachers are
+# resolved through in-memory maps loaded once up front, and valid rows are
+# written in batches of bulk_create calls, one transaction per batch. A bad
+# row is handed back as a reject instead of stopping the run; so is a row
+# the database refuses, found by retrying a failed batch one row per
+# savepoint. Departments named for the first time are created with the rows
+# that use them, so a reject or a failed batch leaves none behind.
+
+
+class RowError(Exception):
+    pass
+
+
+def read_rows(path, fmt=None):
+    # yields (line number, row dict) for a .csv or .jsonl file
+    fmt = fmt or ('jsonl' if str(path).endswith(('.jsonl', '.ndjson')) else 'csv')
+    with open(path, newline='', encoding='utf-8-sig') as handle:
+        if fmt == 'csv':
+            for line, row in enumerate(csv.DictReader(handle), start=2):
+                yield line, row
+        else:
+            for line, text in enumerate(handle, start=1):
+                if not text.strip():
+                    continue
+                try:
+                    row = json.loads(text)
+                except ValueError:
+                    row = None
+                yield line, row if isinstance(row, dict) else {'_raw': text.rstrip('\n')}
+
+
+def _text(row, name, max_length, required=False):
+    value = str(row.get(name) or '').strip()
+    if required and not value:
+        raise RowError(f'{name} is required')
+    if len(value) > max_length:
+        raise RowError(f'{name} is longer than {max_length} characters')
+    return value
+
+
+def _int(row, name, required=False):
+    value = str(row.get(name) or '').strip()
+    if not value:
+        if required:
+            raise RowError(f'{name} is required')
+        return None
+    try:
+        number = int(value)
+    except ValueError:
+        raise RowError(f'{name} "{value}" is not a whole number')
+    if number < 0:
+        raise RowError(f'{name} cannot be negative')
+    return number
+
+
+def _codes(value):
+    if isinstance(value, list):
+        return [str(code).strip() for code in value if str(code).strip()]
+    return [code.strip() for code in str(value or '').replace('|', ';').split(';') if code.strip()]
+
+
+def _unsave(objects):
+    # a rolled-back bulk_create leaves the ids it handed out behind
+    for obj in objects:
+        if isinstance(obj, tuple):
+            _unsave(obj)
+        elif isinstance(obj, models.Model):
+            obj.pk = None
+            obj._state.adding = True
+            for field in obj._meta.concrete_fields:
+                if field.is_relation and field.is_cached(obj):
+                    # take the related instance's id again once it has one
+                    setattr(obj, field.name, field.get_cached_value(obj))
+
+
+class Importer:
+    model = None
+
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+        self.departments = {name: Department(pk=pk, name=name)
+                            for pk, name in Department.objects.values_list('pk', 'name')}
+        self.row_departments = {}
+        self.courses = dict(Course.objects.values_list('course_code', 'pk'))
+        self.teachers = dict(Teacher.objects.values_list('name', 'pk'))
+        # queued rows: (line, row, built item, the row's departments)
+        self.batch = []
+        self.created = 0
+        # (line, row, error) for queued rows the database refused
+        self.rejects = []
+
+    def department(self, name):
+        # unknown departments stay unsaved until flush(); only an accepted
+        # row's are kept (see add())
+        if not name:
+            return None
+        department = self.departments.get(name) or Department(name=name)
+        self.row_departments[name] = department
+        return department
+
+    def course_ids(self, codes):
+        missing = [code for code in codes if code not in self.courses]
+        if missing:
+            raise RowError(f'unknown course code(s): {", ".join(missing)}')
+        return [self.courses[code] for code in codes]
+
+    def add(self, row, line=None):
+        # validate one row and queue it; raises RowError for a reject
+        if '_raw' in row:
+            raise RowError('not a JSON object')
+        self.row_departments = {}
+        item = self.build(row)
+        self.departments.update(self.row_departments)
+        self.batch.append((line, row, item, list(self.row_departments.values())))
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.batch:
+            return
+        try:
+            self.save(self.batch)
+        except DatabaseError:
+            # find the rows the database refuses, one savepoint each
+            with transaction.atomic():
+                for entry in self.batch:
+                    self.save_one(entry)
+        else:
+            self.created += len(self.batch)
+        self.batch = []
+
+    def save(self, entries):
+        departments = {id(department): department
+                       for *_, row_departments in entries for department in row_departments
+                       if department.pk is None}
+        items = [item for _, _, item, _ in entries]
+        try:
+            with transaction.atomic():
+                # bulk_create fills in the new departments' ids, and the rows
+                # pick them up from the instances they were built with
+                Department.objects.bulk_create(list(departments.values()))
+                self.write(items)
+        except DatabaseError:
+            _unsave([*departments.values(), *items])
+            raise
+
+    def save_one(self, entry):
+        line, row, item, _ = entry
+        try:
+            self.save([entry])
+        except DatabaseError as error:
+            self.forget(item)
+            self.rejects.append((line, row, str(error)))
+        else:
+            self.created += 1
+
+    def take_rejects(self):
+        rejects, self.rejects = self.rejects, []
+        return rejects
+
+    def forget(self, item):
+        # undo what build() noted about a row the database refused
+        pass
+
+    def build(self, row):
+        raise NotImplementedError
+
+    def write(self, batch):
+        raise NotImplementedError
+
+
+class CourseImporter(Importer):
+    # course_name, course_code, department, credits, teacher (name, optional)
+    def __init__(self, batch_size=1000):
+        super().__init__(batch_size)
+        # codes in the database and in accepted rows; enrollments and student
+        # rows look courses up by code, so it must name one course
+        self.codes = set(self.courses)
+
+    def build(self, row):
+        code = _text(row, 'course_code', 10, required=True)
+        if code in self.codes:
+            raise RowError(f'course code "{code}" already exists')
+        teacher = _text(row, 'teacher', 200)
+        if teacher and teacher not in self.teachers:
+            raise RowError(f'unknown teacher "{teacher}"')
+        course = Course(
+            course_name=_text(row, 'course_name', 256, required=True),
+            course_code=code,
+            department=self.department(_text(row, 'department', 256, required=True)),
+            credits=_int(row, 'credits', required=True),
+            teacher_id=self.teachers.get(teacher),
+        )
+        self.codes.add(code)
+        return course
+
+    def forget(self, course):
+        self.codes.discard(course.course_code)
+
+    def write(self, batch):
+        for course in Course.objects.bulk_create(batch):
+            self.courses[course.course_code] = course.pk
+
+
+class StudentImporter(Importer):
+    # name, age, grade, email, department, courses (course codes split by ';')
+    def build(self, row):
+        email = _text(row, 'email', 254)
+        if email:
+            try:
+                validate_email(email)
+            except ValidationError:
+                raise RowError(f'invalid email "{email}"')
+        student = Student(
+            name=_text(row, 'name', 256, required=True),
+            age=_int(row, 'age'),
+            grade=_text(row, 'grade', 10) or None,
+            email=email or None,
+            department=self.department(_text(row, 'department', 256)),
+        )
+        return student, self.course_ids(_codes(row.get('courses')))
+
+    def write(self, batch):
+        students = Student.objects.bulk_create([student for student, _ in batch])
+        Enrollment = Student.courses.through
+        Enrollment.objects.bulk_create([
+            Enrollment(student_id=student.pk, course_id=course_id)
+            for student, (_, course_ids) in zip(students, batch)
+            for course_id in course_ids
+        ])
+        # bulk_create sends no signals, so index the new students here
+        search.index_students([student.pk for student in students])
+        caching.bump_course_teachers({course_id for _, course_ids in batch for course_id in course_ids})
+
+
+class EnrollmentImporter(Importer):
+    # student (id), course (course code)
+    def __init__(self, batch_size=1000):
+        super().__init__(batch_size)
+        self.student_ids = set(Student.objects.values_list('pk', flat=True))
+
+    def build(self, row):
+        student_id = _int(row, 'student', required=True)
+        if student_id not in self.student_ids:
+            raise RowError(f'unknown student {student_id}')
+        return student_id, self.course_ids([_text(row, 'course', 10, required=True)])[0]
+
+    def write(self, batch):
+        Enrollment = Student.courses.through
+        Enrollment.objects.bulk_create(
+            [Enrollment(student_id=student_id, course_id=course_id) for student_id, course_id in batch],
+            ignore_conflicts=True,
+        )
+        student_ids = {student_id for student_id, _ in batch}
+        search.index_students(student_ids)
+        Student.touch(student_ids)
+        caching.bump('student', student_ids)
+        caching.bump_course_teachers({course_id for _, course_id in batch})
+
+
+IMPORTERS = {
+    'courses': CourseImporter,
+    'students': StudentImporter,
+    'enrollments': EnrollmentImporter,
+}
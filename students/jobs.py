@@ -0,0 +1,355 @@
+import io
+import logging
+import multiprocessing
+import os
+import random
+import socket
+import threading
+import time
+from contextlib import contextmanager
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+import django
+from django.conf import settings
+from django.core.management import call_command
+from django.db import close_old_connections, connection
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from . import exports, reports
+from .models import Job, Teacher
+
+logger = logging.getLogger('students.jobs')
+
+# -------------------------------
+# Background jobs
+# -------------------------------
+# Work too slow for a request (exports, rollup rebuilds, imports, reports) is
+# queued as a Job row with enqueue() and run by `manage.py run_jobs`, a
+# separate process that is scaled on its own. The table is the queue, so it
+# needs nothing but the database (and, with SQLite, the same disk).
+#
+# A worker claims a due job with a compare-and-set UPDATE on its status, so
+# any number of workers can share the table. It holds a lease on each job it
+# runs and keeps renewing it; when a worker dies its jobs' leases run out and
+# they are queued again. A job's outcome is only written while its claim
+# (worker, attempt and an unexpired lease) still holds, so a worker that lost
+# the lease cannot overwrite a newer run. A task that raises is retried with exponential
+# backoff until max_attempts, except for PermanentError, which fails at once.
+#
+# A task is task(progress, **job.args) and returns a JSON-able result. It
+# reports how far along it is with progress(done, total, message), which
+# the status endpoint serves.
+
+
+class PermanentError(Exception):
+    # retrying cannot help (bad arguments, missing input)
+    pass
+
+
+def enqueue(task, user=None, max_attempts=None, **args):
+    # args are the task's keyword arguments and must be JSON-able
+    if task not in TASKS:
+        raise ValueError(f'unknown job kind {task!r}')
+    return Job.objects.create(kind=task, args=args, user=user,
+                              max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS)
+
+
+def describe(job):
+    # the status endpoint's payload
+    return {
+        'id': job.pk,
+        'kind': job.kind,
+        'status': job.status,
+        'done': job.done,
+        'total': job.total,
+        'percent': job.percent,
+        'message': job.message,
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'run_at': job.run_at,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at,
+        'result': job.result,
+        'error': job.error.strip().splitlines()[-1] if job.error else None,
+    }
+
+
+def _lease():
+    return timezone.now() + timedelta(seconds=settings.JOB_LEASE)
+
+
+def retry_delay(attempts):
+    # 1x, 2x, 4x ... the base, capped, with jitter so jobs that failed
+    # together do not all come back at the same moment
+    delay = min(settings.JOB_RETRY_BACKOFF * 2 ** (attempts - 1), settings.JOB_RETRY_BACKOFF_MAX)
+    return delay * random.uniform(1, 1.25)
+
+
+def claim(worker, kinds=None):
+    now = timezone.now()
+    due = Job.objects.filter(status='queued', run_at__lte=now)
+    if kinds:
+        due = due.filter(kind__in=kinds)
+    for pk in due.order_by('run_at', 'id').values_list('pk', flat=True)[:10]:
+        # another worker may have taken it since the SELECT
+        claimed = Job.objects.filter(pk=pk, status='queued').update(
+            status='running', worker=worker, attempts=F('attempts') + 1,
+            leased_until=_lease(), started_at=now,
+        )
+        if claimed:
+            return pk
+    return None
+
+
+def renew(job_ids):
+    Job.objects.filter(pk__in=job_ids, status='running').update(leased_until=_lease())
+
+
+@contextmanager
+def heartbeat(job_ids):
+    # keep renewing the leases from a thread while this one is busy
+    stop = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(settings.JOB_LEASE / 3):
+                renew(job_ids)
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=beat, name='job-heartbeat', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def held(job):
+    # the claim this process is running the job under
+    return Job.objects.filter(pk=job.pk, status='running', worker=job.worker, attempts=job.attempts,
+                              leased_until__gte=timezone.now())
+
+
+def recover():
+    # running jobs whose worker stopped renewing their lease
+    expired = Job.objects.filter(status='running', leased_until__lt=timezone.now())
+    expired.filter(attempts__gte=F('max_attempts')).update(
+        status='failed', leased_until=None, finished_at=timezone.now(), error='worker lost',
+    )
+    return expired.update(status='queued', leased_until=None, message='worker lost; queued again')
+
+
+class Progress:
+    # handed to a task as `progress`; writes at most every JOB_PROGRESS_INTERVAL
+    def __init__(self, job):
+        self.job = job
+        self.saved = 0.0
+
+    def __call__(self, done, total=None, message=None):
+        self.job.done = done
+        if total is not None:
+            self.job.total = total
+        if message is not None:
+            self.job.message = message[:256]
+        if time.monotonic() - self.saved >= settings.JOB_PROGRESS_INTERVAL:
+            self.save()
+
+    def save(self):
+        held(self.job).update(
+            done=self.job.done, total=self.job.total, message=self.job.message,
+        )
+        self.saved = time.monotonic()
+
+
+def execute(job_id):
+    # runs on a pool process or thread, with its own database connection
+    close_old_connections()
+    try:
+        job = Job.objects.get(pk=job_id)
+        progress = Progress(job)
+        try:
+            result = TASKS[job.kind](progress, **job.args)
+        except Exception as error:
+            _failed(job, error)
+        else:
+            finished = held(job).update(
+                status='done', result=result, done=job.done, total=job.total, message=job.message,
+                error='', leased_until=None, finished_at=timezone.now(),
+            )
+            if not finished:
+                _lost(job)
+        return job_id
+    finally:
+        close_old_connections()
+
+
+def _failed(job, error):
+    logger.warning('job %s (%s) attempt %s failed: %r', job.pk, job.kind, job.attempts, error)
+    trace = ''.join(traceback.format_exception(error))
+    if isinstance(error, PermanentError) or job.attempts >= job.max_attempts:
+        updated = held(job).update(
+            status='failed', error=trace, leased_until=None, finished_at=timezone.now(),
+        )
+    else:
+        updated = held(job).update(
+            status='queued', error=trace, leased_until=None,
+            run_at=timezone.now() + timedelta(seconds=retry_delay(job.attempts)),
+        )
+    if not updated:
+        _lost(job)
+
+
+def _lost(job):
+    # the lease ran out and the job was queued again (or another worker has
+    # it by now); that run's outcome is the one that counts
+    logger.warning('job %s (%s) attempt %s lost its lease; outcome dropped', job.pk, job.kind, job.attempts)
+
+
+class Worker:
+    """
+    Claim jobs and run them on a pool of ``size`` processes or threads
+    (``pool='inline'`` runs them one at a time in this thread). With
+    ``burst``, return once nothing is due instead of polling forever.
+    """
+
+    def __init__(self, pool='process', size=None, kinds=None, poll=1.0, stdout=None):
+        self.pool = pool
+        self.size = 1 if pool == 'inline' else size or os.cpu_count() or 1
+        self.kinds = kinds
+        self.poll = poll
+        self.stdout = stdout
+        self.name = f'{socket.gethostname()}:{os.getpid()}'
+        self.stopping = False
+
+    def executor(self):
+        if self.pool == 'process':
+            # spawned, not forked: children set Django up themselves and
+            # open their own connections
+            return ProcessPoolExecutor(self.size, mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=django.setup)
+        if self.pool == 'thread':
+            return ThreadPoolExecutor(self.size, thread_name_prefix='job')
+        return None
+
+    def run(self, burst=False):
+        executor = self.executor()
+        running = {}
+        leases_checked = 0.0
+        try:
+            while True:
+                if time.monotonic() - leases_checked >= settings.JOB_LEASE / 3:
+                    renew(running.values())
+                    recover()
+                    leases_checked = time.monotonic()
+                while not self.stopping and len(running) < self.size:
+                    job_id = claim(self.name, self.kinds)
+                    if job_id is None:
+                        break
+                    self.log(f'job {job_id} started')
+                    if executor is None:
+                        with heartbeat([job_id]):
+                            self.finished(execute(job_id))
+                    else:
+                        running[executor.submit(execute, job_id)] = job_id
+
+                if not running:
+                    if burst or self.stopping:
+                        return
+                    time.sleep(self.poll)
+                    continue
+
+                finished, _ = wait(running, timeout=self.poll, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    job_id = running.pop(future)
+                    if future.exception() is not None:
+                        # the pool itself broke (e.g. a child was killed); the
+                        # lease brings the job back
+                        logger.error('job %s crashed its worker: %r', job_id, future.exception())
+                    self.finished(job_id)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+
+    def finished(self, job_id):
+        job = Job.objects.filter(pk=job_id).values_list('status', flat=True).first()
+        self.log(f'job {job_id} {job}')
+
+    def log(self, message):
+        if self.stdout is not None:
+            self.stdout.write(message)
+
+
+# -------------------------------
+# Tasks
+# -------------------------------
+def output_path(job, filename):
+    directory = settings.JOB_OUTPUT_DIR
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f'{job.pk}-{filename}')
+
+
+def export(progress, kind, format='csv', teacher=None, course=None, department=None, start=None, end=None):
+    if kind not in exports.EXPORTS or format not in exports.FORMATS:
+        raise PermanentError(f'unknown export {kind}.{format}')
+    rows = exports.export_queryset(
+        kind, course=course, department=department,
+        start=parse_date(start) if start else None,
+        end=parse_date(end) if end else None,
+        teacher=Teacher.objects.get(pk=teacher) if teacher else None,
+    )
+    total = rows.count()
+    progress(0, total, f'exporting {total} rows')
+
+    path = output_path(progress.job, f'{kind}.{format}')
+    # written under a temporary name, so a retry never serves half a file
+    with open(f'{path}.partial', 'w', newline='') as output:
+        lines = exports.stream(kind, format, rows)
+        if format == 'csv':
+            output.write(next(lines))
+        for done, line in enumerate(lines, 1):
+            output.write(line)
+            progress(done)
+    os.replace(f'{path}.partial', path)
+    progress(total, message=f'exported {total} rows')
+    return {'file': os.path.basename(path), 'rows': total}
+
+
+# management commands that may be queued from code or `manage.py enqueue_job`
+COMMANDS = {'rebuild_gradebook', 'rebuild_attendance', 'rebuild_search_index', 'import_school', 'refresh_replica'}
+
+
+def command(progress, name, args=(), options=None):
+    if name not in COMMANDS:
+        raise PermanentError(f'{name} cannot be run as a job')
+    output = io.StringIO()
+    progress(0, message=f'running {name}')
+    call_command(name, *args, stdout=output, stderr=output, **(options or {}))
+    return {'output': output.getvalue()[-4000:]}
+
+
+def report_cards(progress, term, department=None, course=None, formats=reports.FORMATS,
+                 batch_size=reports.BATCH_SIZE):
+    # rendered in this process: the worker pool already runs jobs side by side
+    try:
+        run = reports.ReportCards(term, department=department, course=course, formats=formats,
+                                  batch_size=batch_size, workers=0)
+    except ValueError as error:
+        raise PermanentError(str(error))
+    summary = run.run(report=lambda done, total, rate: progress(done, total, f'{rate:,.0f} students/s'))
+    # a retry resumes from the run's manifest
+    return {**{key: value for key, value in summary.items() if key != 'files'},
+            'files': len(summary['files']), 'directory': run.directory}
+
+
+TASKS = {
+    'export': export,
+    'command': command,
+    'report_cards': report_cards,
+}
@@ -0,0 +1,53 @@
+import json
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from students import benchmark
+from students.management.commands.seed_school import SIZES
+
+
+class Command(BaseCommand):
+    help = ('Seed a throwaway test database at each size and request every students URL, '
+            'recording query count, SQL time, latency and peak memory as JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', choices=sorted(SIZES), default=['1k'])
+        parser.add_argument('--days', type=int, default=20)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--output', '-o', default='bench_output.json')
+        parser.add_argument('--compare', help='Earlier results file; exit non-zero on regressions.')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Allowed relative slowdown before a metric counts as a regression.')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        results = {}
+        try:
+            for size in options['sizes']:
+                self.stdout.write(self.style.MIGRATE_HEADING(f'== {size} students =='))
+                old_name = connection.settings_dict['NAME']
+                connection.creation.create_test_db(verbosity=0, autoclobber=True)
+                try:
+                    call_command('seed_school', size=size, days=options['days'], stdout=self.stdout)
+                    results[size] = benchmark.run(repeat=options['repeat'], stdout=self.stdout)
+                finally:
+                    connection.creation.destroy_test_db(old_name, verbosity=0)
+        finally:
+            teardown_test_environment()
+
+        with open(options['output'], 'w') as handle:
+            json.dump(results, handle, indent=2, sort_keys=True)
+        self.stdout.write(self.style.SUCCESS(f'Wrote {options["output"]}'))
+
+        if options['compare']:
+            with open(options['compare']) as handle:
+                baseline = json.load(handle)
+            regressions = benchmark.compare(baseline, results, options['tolerance'])
+            for size, name, metric, old, new in regressions:
+                self.stdout.write(self.style.ERROR(f'{size} {name}: {metric} {old} -> {new}'))
+            if regressions:
+                raise CommandError(f'{len(regressions)} benchmark regressions against {options["compare"]}')
+            self.stdout.write(self.style.SUCCESS(f'No regressions against {options["compare"]}'))
@@ -0,0 +1,25 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from students import jobs
+
+
+class Command(BaseCommand):
+    help = ('Queue a background job, e.g. from cron: '
+            'enqueue_job command \'{"name": "rebuild_gradebook"}\'')
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(jobs.TASKS))
+        parser.add_argument('arguments', nargs='?', default='{}', help="The task's arguments as a JSON object.")
+        parser.add_argument('--max-attempts', type=int)
+
+    def handle(self, *args, **options):
+        try:
+            task_args = json.loads(options['arguments'])
+        except json.JSONDecodeError as error:
+            raise CommandError(f'args must be a JSON object: {error}')
+        if not isinstance(task_args, dict):
+            raise CommandError('args must be a JSON object')
+        job = jobs.enqueue(options['kind'], max_attempts=options['max_attempts'], **task_args)
+        self.stdout.write(self.style.SUCCESS(f'Queued job {job.pk}.'))
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from students import reports
+
+
+class Command(BaseCommand):
+    help = ('Render end-of-term report cards (HTML and/or CSV) for a department, a course or every '
+            'student into MEDIA_ROOT/report_cards/. An interrupted run resumes where it stopped.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('term', help='e.g. 2025-fall; names the output directory.')
+        scope = parser.add_mutually_exclusive_group()
+        scope.add_argument('--department', type=int, help='Department id.')
+        scope.add_argument('--course', type=int, help='Course id.')
+        parser.add_argument('--format', action='append', choices=reports.FORMATS, dest='formats',
+                            help='Repeat for several; defaults to all.')
+        parser.add_argument('--batch-size', type=int, default=reports.BATCH_SIZE)
+        parser.add_argument('--workers', type=int,
+                            help='Render processes; defaults to the CPU count, 0 renders in this process.')
+        parser.add_argument('--restart', action='store_true', help='Ignore what earlier runs finished.')
+
+    def handle(self, *args, **options):
+        try:
+            run = reports.ReportCards(
+                options['term'], department=options['department'], course=options['course'],
+                formats=tuple(options['formats'] or reports.FORMATS),
+                batch_size=options['batch_size'], workers=options['workers'],
+            )
+        except ValueError as error:
+            raise CommandError(error)
+        if options['restart']:
+            run.restart()
+
+        summary = run.run(report=self.report)
+        skipped = summary['students'] - summary['rendered']
+        if skipped:
+            self.stdout.write(f'{skipped} students were done by an earlier run')
+        self.stdout.write(self.style.SUCCESS(
+            f"Rendered {summary['rendered']} report cards in {summary['seconds']}s; see {run.directory}"
+        ))
+
+    def report(self, done, total, rate):
+        self.stdout.write(f'{done}/{total} students, {rate:,.0f} students/s')
@@ -0,0 +1,54 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from students import imports
+
+
+class Command(BaseCommand):
+    help = ('Bulk import courses, students or enrollments from a CSV or JSONL file. '
+            'Bad rows are written to a reject file instead of stopping the import.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(imports.IMPORTERS))
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help='Defaults to jsonl for .jsonl/.ndjson files, csv otherwise.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--rejects', help='Reject file (JSONL); defaults to <path>.rejects.jsonl')
+
+    def handle(self, *args, **options):
+        importer = imports.IMPORTERS[options['kind']](batch_size=options['batch_size'])
+        rejects_path = options['rejects'] or f"{options['path']}.rejects.jsonl"
+
+        started = time.monotonic()
+        rejected = 0
+        with open(rejects_path, 'w') as rejects:
+            for line, row in imports.read_rows(options['path'], options['format']):
+                try:
+                    importer.add(row, line)
+                except imports.RowError as error:
+                    rejected += self.write_rejects(rejects, [(line, row, str(error))])
+                    continue
+                # rows of a flushed batch that the database refused
+                rejected += self.write_rejects(rejects, importer.take_rejects())
+                if importer.created and not importer.batch:
+                    self.report(importer.created, rejected, started)
+            importer.flush()
+            rejected += self.write_rejects(rejects, importer.take_rejects())
+
+        self.report(importer.created, rejected, started)
+        if rejected:
+            self.stdout.write(self.style.WARNING(f'{rejected} rows rejected; see {rejects_path}'))
+        self.stdout.write(self.style.SUCCESS(f'Imported {importer.created} {options["kind"]}.'))
+
+    def write_rejects(self, rejects, entries):
+        for line, row, error in entries:
+            rejects.write(json.dumps({'line': line, 'error': error, 'row': row}) + '\n')
+        return len(entries)
+
+    def report(self, created, rejected, started):
+        elapsed = max(time.monotonic() - started, 1e-6)
+        self.stdout.write(f'{created} rows imported, {rejected} rejected, '
+                          f'{(created + rejected) / elapsed:,.0f} rows/s')
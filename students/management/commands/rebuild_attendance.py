@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from students import caching
+from students.models import Attendance, AttendanceSummary, CourseAttendanceDay
+
+
+class Command(BaseCommand):
+    help = ('Rebuild (or with --verify, check) the attendance rollup tables '
+            '(per student/course and per course/day) from raw Attendance rows.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true',
+                            help='Only compare the tables with the raw attendance and report differences.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        problems = 0
+        for rollup in (AttendanceSummary, CourseAttendanceDay):
+            expected = rollup.counts(Attendance.objects.all())
+            if options['verify']:
+                problems += self.verify(rollup, expected)
+                continue
+
+            rows = [rollup(**dict(zip(rollup.keys, key)), **counts) for key, counts in expected.items()]
+            with transaction.atomic():
+                rollup.objects.all().delete()
+                rollup.objects.bulk_create(rows, batch_size=options['batch_size'])
+                caching.bump('student', ['all'])
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt {len(rows)} {rollup._meta.verbose_name} rows.'))
+
+        if problems:
+            raise CommandError(f'{problems} attendance rollup rows are out of date; '
+                               'run rebuild_attendance to fix them.')
+
+    def verify(self, rollup, expected):
+        actual = {
+            tuple(row[key] for key in rollup.keys): {'present': row['present'], 'absent': row['absent']}
+            for row in rollup.objects.values(*rollup.keys, 'present', 'absent').iterator()
+        }
+        wrong = sorted(key for key in expected.keys() | actual.keys() if expected.get(key) != actual.get(key))
+        for key in wrong:
+            self.stdout.write(f'{rollup._meta.verbose_name} {key}: {actual.get(key)} != {expected.get(key)}')
+        if not wrong:
+            self.stdout.write(self.style.SUCCESS(f'All {len(actual)} {rollup._meta.verbose_name} rows match.'))
+        return len(wrong)
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from students import caching
+from students.models import EXAM_KINDS, Grade, Gradebook
+
+
+class Command(BaseCommand):
+    help = 'Rebuild (or with --verify, check) the gradebook rollup table from raw Grade rows.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true',
+                            help='Only compare the table with the raw grades and report differences.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        expected = Gradebook.compute(Grade.objects.all())
+
+        if options['verify']:
+            self.verify(expected)
+            return
+
+        rows = [
+            Gradebook(student_id=student_id, course_id=course_id, **fields)
+            for (student_id, course_id), fields in expected.items()
+        ]
+        with transaction.atomic():
+            Gradebook.objects.all().delete()
+            Gradebook.objects.bulk_create(rows, batch_size=options['batch_size'])
+            caching.bump('student', ['all'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {len(rows)} gradebook rows.'))
+
+    def verify(self, expected):
+        fields = [*EXAM_KINDS, 'total', 'percentage']
+        actual = {
+            (row['student_id'], row['course_id']): {name: row[name] for name in fields}
+            for row in Gradebook.objects.values('student_id', 'course_id', *fields).iterator()
+        }
+
+        missing = expected.keys() - actual.keys()
+        extra = actual.keys() - expected.keys()
+        wrong = [pair for pair in expected.keys() & actual.keys() if expected[pair] != actual[pair]]
+
+        for pair in sorted(missing):
+            self.stdout.write(f'missing: student {pair[0]}, course {pair[1]}')
+        for pair in sorted(extra):
+            self.stdout.write(f'extra: student {pair[0]}, course {pair[1]}')
+        for pair in sorted(wrong):
+            self.stdout.write(f'mismatch: student {pair[0]}, course {pair[1]}: '
+                              f'{actual[pair]} != {expected[pair]}')
+
+        if missing or extra or wrong:
+            raise CommandError(f'{len(missing) + len(extra) + len(wrong)} gradebook rows are out of date; '
+                               'run rebuild_gradebook to fix them.')
+        self.stdout.write(self.style.SUCCESS(f'All {len(actual)} gradebook rows match.'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from students import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the student search index from the student, department and course tables.'
+
+    def handle(self, *args, **options):
+        if not search.available():
+            raise CommandError('The student search index needs the SQLite database backend.')
+        search.rebuild()
+        self.stdout.write(self.style.SUCCESS('Rebuilt the student search index.'))
@@ -0,0 +1,37 @@
+import os
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = ('Copy the primary SQLite database to the read replica (SQLITE_REPLICA). '
+            'Run it periodically, e.g. from cron; replica reads are as old as the last run.')
+
+    def handle(self, *args, **options):
+        replica = settings.DATABASES.get('replica')
+        if replica is None:
+            raise CommandError('No replica is configured; set SQLITE_REPLICA.')
+
+        started = time.monotonic()
+        target = str(replica['NAME'])
+        partial = f'{target}.partial'
+        # the backup API copies a consistent snapshot while writers carry on
+        connection = connections['default']
+        connection.ensure_connection()
+        copy = sqlite3.connect(partial)
+        try:
+            connection.connection.backup(copy)
+            # readers open the copy with query_only; a rollback journal means
+            # they need no -wal/-shm files next to it
+            copy.execute('PRAGMA journal_mode=DELETE')
+        finally:
+            copy.close()
+        # swap it in atomically; open replica connections keep reading the
+        # old file until they reconnect (REPLICA_CONN_MAX_AGE)
+        os.replace(partial, target)
+        self.stdout.write(self.style.SUCCESS(
+            f'Refreshed the replica at {target} in {time.monotonic() - started:.1f}s.'))
@@ -0,0 +1,33 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from students import jobs
+
+
+class Command(BaseCommand):
+    help = ('Run queued background jobs (exports, rebuilds, imports, reports) on a pool of '
+            'processes or threads. Start as many workers, on as many machines, as needed.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pool', choices=['process', 'thread', 'inline'], default='process',
+                            help='process (default) for CPU-heavy work, thread for I/O-bound work, '
+                                 'inline to run one job at a time in this process.')
+        parser.add_argument('--workers', type=int, help='Pool size; defaults to the number of CPUs.')
+        parser.add_argument('--kind', action='append', dest='kinds', choices=sorted(jobs.TASKS),
+                            help='Only run jobs of this kind (repeatable).')
+        parser.add_argument('--poll', type=float, default=1.0, help='Seconds between queue checks.')
+        parser.add_argument('--burst', action='store_true', help='Exit once no job is due.')
+
+    def handle(self, *args, **options):
+        worker = jobs.Worker(pool=options['pool'], size=options['workers'], kinds=options['kinds'],
+                             poll=options['poll'], stdout=self.stdout)
+
+        def stop(signum, frame):
+            # finish the running jobs, start no new ones
+            self.stdout.write('stopping after the running jobs finish')
+            worker.stopping = True
+
+        signal.signal(signal.SIGTERM, stop)
+        self.stdout.write(f'worker {worker.name}: {worker.size} {options["pool"]} slot(s)')
+        worker.run(burst=options['burst'])
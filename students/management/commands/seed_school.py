@@ -0,0 +1,169 @@
+import datetime
+import random
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from faker import Faker
+
+from students import caching
+from students.models import (EXAM_KINDS, EXAM_MAX_SCORES, Attendance, Course, CustomerUser, Department, Exam,
+                             Grade, Student, Teacher)
+
+SIZES = {'1k': 1_000, '10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+EXAMS = [(kind, EXAM_MAX_SCORES[kind]) for kind in EXAM_KINDS]
+
+
+class Command(BaseCommand):
+    help = ('Fill an empty database with a synthetic school: departments, teachers, courses, '
+            'students, enrollments, exam grades and attendance days. Seeded accounts use the '
+            'password "password".')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', choices=sorted(SIZES), default='1k',
+                            help='Number of students (ignored if --students is given).')
+        parser.add_argument('--students', type=int)
+        parser.add_argument('--courses-per-student', type=int, default=3)
+        parser.add_argument('--days', type=int, default=20, help='School days of attendance to generate.')
+        parser.add_argument('--student-users', type=int, default=100,
+                            help='How many students also get a login account.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, for repeatable data.')
+
+    def handle(self, *args, **options):
+        if Student.objects.exists():
+            raise CommandError('seed_school expects an empty database (see `manage.py flush`).')
+
+        self.options = options
+        self.batch_size = options['batch_size']
+        self.random = random.Random(options['seed'])
+        self.fake = Faker()
+        self.fake.seed_instance(options['seed'])
+        self.password = make_password('password')
+
+        n_students = options['students'] or SIZES[options['size']]
+        started = time.monotonic()
+
+        with transaction.atomic():
+            departments = self.create_departments(max(3, min(50, n_students // 2000)))
+            teachers = self.create_teachers(max(2, n_students // 40))
+            courses = self.create_courses(teachers, departments)
+            exams = self.create_exams(courses)
+
+        # students and everything hanging off them are generated a chunk at a time
+        created = 0
+        while created < n_students:
+            size = min(self.batch_size, n_students - created)
+            with transaction.atomic():
+                self.create_students(created, size, departments, courses, exams)
+            created += size
+            elapsed = time.monotonic() - started
+            self.stdout.write(f'{created}/{n_students} students ({created / elapsed:,.0f}/s)')
+
+        call_command('rebuild_gradebook', stdout=self.stdout)
+        call_command('rebuild_attendance', stdout=self.stdout)
+        call_command('rebuild_search_index', stdout=self.stdout)
+        # ids may be reused after a flush, so drop any dashboards cached before it
+        caching.bump('teacher', ['all'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {n_students} students, {len(courses)} courses and {len(teachers)} teachers '
+            f'in {time.monotonic() - started:.1f}s.'
+        ))
+
+    def create_departments(self, count):
+        names = set()
+        while len(names) < count:
+            names.add(self.fake.unique.job().split(',')[0][:256])
+        return Department.objects.bulk_create([Department(name=name) for name in sorted(names)])
+
+    def create_users(self, prefix, start, count, group_name, **flags):
+        users = CustomerUser.objects.bulk_create([
+            CustomerUser(username=f'{prefix}{start + i}', email=f'{prefix}{start + i}@example.com',
+                         password=self.password, **flags)
+            for i in range(count)
+        ], batch_size=self.batch_size)
+        # bulk_create skips the m2m_changed receiver, so the role flags are set above
+        group, _ = Group.objects.get_or_create(name=group_name)
+        Membership = CustomerUser.groups.through
+        Membership.objects.bulk_create([Membership(customeruser_id=user.pk, group_id=group.pk) for user in users],
+                                       batch_size=self.batch_size)
+        return users
+
+    def create_teachers(self, count):
+        users = self.create_users('teacher', 0, count, 'teacher', is_teacher=True)
+        return Teacher.objects.bulk_create(
+            [Teacher(user=user, name=self.fake.name()) for user in users],
+            batch_size=self.batch_size,
+        )
+
+    def create_courses(self, teachers, departments):
+        courses = []
+        for i, teacher in enumerate(teachers * 2):
+            subject = self.fake.unique.catch_phrase()[:200]
+            courses.append(Course(
+                course_name=subject,
+                course_code=f'C{i:05d}',
+                department=departments[i % len(departments)],
+                credits=self.random.randint(1, 5),
+                teacher=teacher,
+            ))
+        return Course.objects.bulk_create(courses, batch_size=self.batch_size)
+
+    def create_exams(self, courses):
+        term_start = datetime.date.today() - datetime.timedelta(days=120)
+        exams = Exam.objects.bulk_create([
+            Exam(name=name, kind=name, max_score=max_score, course=course,
+                 date=term_start + datetime.timedelta(days=25 * (i + 1)))
+            for course in courses
+            for i, (name, max_score) in enumerate(EXAMS)
+        ], batch_size=self.batch_size)
+        by_course = {}
+        for exam in exams:
+            by_course.setdefault(exam.course_id, []).append(exam)
+        return by_course
+
+    def create_students(self, start, count, departments, courses, exams):
+        options = self.options
+        with_users = max(0, min(count, options['student_users'] - start))
+        users = self.create_users('student', start, with_users, 'student', is_student=True) if with_users else []
+
+        students = Student.objects.bulk_create([
+            Student(
+                name=self.fake.name(),
+                age=self.random.randint(16, 25),
+                grade=str(self.random.randint(9, 12)),
+                email=f'student{start + i}@example.com',
+                department=self.random.choice(departments),
+                user=users[i] if i < len(users) else None,
+            )
+            for i in range(count)
+        ], batch_size=self.batch_size)
+
+        per_student = min(options['courses_per_student'], len(courses))
+        enrollments = [(student.pk, course.pk)
+                       for student in students
+                       for course in self.random.sample(courses, per_student)]
+        Enrollment = Student.courses.through
+        Enrollment.objects.bulk_create(
+            [Enrollment(student_id=student_id, course_id=course_id) for student_id, course_id in enrollments],
+            batch_size=self.batch_size,
+        )
+
+        Grade.objects.bulk_create([
+            Grade(student_id=student_id, course_id=course_id, exam=exam,
+                  score=round(self.random.uniform(0.4, 1) * max_score, 1))
+            for student_id, course_id in enrollments
+            for exam, (_, max_score) in zip(exams[course_id], EXAMS)
+        ], batch_size=self.batch_size)
+
+        today = datetime.date.today()
+        days = [today - datetime.timedelta(days=day) for day in range(options['days'])]
+        for day in days:
+            Attendance.objects.bulk_create([
+                Attendance(student_id=student_id, course_id=course_id, date=day,
+                           status='present' if self.random.random() < 0.9 else 'absent')
+                for student_id, course_id in enrollments
+            ], batch_size=self.batch_size)
@@ -0,0 +1,239 @@
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+
+# -------------------------------
+# Request metrics
+# -------------------------------
+# Each worker process keeps its own counters in memory. When METRICS_DIR is
+# set, a worker also writes a snapshot there at most every
+# METRICS_FLUSH_INTERVAL seconds, and the /metrics/ endpoint adds up every
+# snapshot, so one scrape covers all gunicorn workers. When a worker exits
+# (or, if it was killed, once a scrape finds its process gone) its snapshot is
+# added into retired.json and removed, so counters never go backwards and the
+# directory does not grow with every restart.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+
+def _histogram(buckets):
+    return {'buckets': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+
+
+def _observe(histogram, buckets, value):
+    for index, bound in enumerate(buckets):
+        if value <= bound:
+            histogram['buckets'][index] += 1
+            break
+    histogram['sum'] += value
+    histogram['count'] += 1
+
+
+def empty():
+    return {'requests': {}, 'duration': {}, 'db': {}, 'size': {}, 'cache': {}}
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = empty()
+        self.last_flush = 0.0
+        # pid alone is reused after a restart; the token keeps snapshots apart
+        self.worker = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+
+    def observe(self, view, method, status, duration, db_time, queries, size):
+        with self.lock:
+            data = self.data
+            key = f'{view}|{method}|{status}'
+            data['requests'][key] = data['requests'].get(key, 0) + 1
+            _observe(data['duration'].setdefault(view, _histogram(LATENCY_BUCKETS)), LATENCY_BUCKETS, duration)
+            db = data['db'].setdefault(view, {'seconds': 0.0, 'queries': 0})
+            db['seconds'] += db_time
+            db['queries'] += queries
+            if size is not None:
+                _observe(data['size'].setdefault(view, _histogram(SIZE_BUCKETS)), SIZE_BUCKETS, size)
+        self.maybe_flush()
+
+    def count_cache(self, name, hit):
+        key = f"{name}|{'hit' if hit else 'miss'}"
+        with self.lock:
+            self.data['cache'][key] = self.data['cache'].get(key, 0) + 1
+
+    def maybe_flush(self, force=False):
+        directory = getattr(settings, 'METRICS_DIR', None)
+        now = time.monotonic()
+        if not directory or (not force and now - self.last_flush < getattr(settings, 'METRICS_FLUSH_INTERVAL', 1.0)):
+            return
+        self.last_flush = now
+        with self.lock:
+            snapshot = json.dumps(self.data)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'metrics-{self.worker}.json')
+        with open(f'{path}.tmp', 'w') as handle:
+            handle.write(snapshot)
+        os.replace(f'{path}.tmp', path)
+
+    def collect(self):
+        # this worker's live numbers plus every other worker's last snapshot
+        # and the totals of workers that have exited
+        directory = getattr(settings, 'METRICS_DIR', None)
+        with self.lock:
+            total = json.loads(json.dumps(self.data))
+        if not directory:
+            return total
+        own = os.path.join(directory, f'metrics-{self.worker}.json')
+        with _locked(directory):
+            for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+                if path == own:
+                    continue
+                if not _alive(path):
+                    _retire(directory, path)
+                    continue
+                snapshot = _read(path)
+                if snapshot is not None:
+                    merge(total, snapshot)
+            retired = _read(os.path.join(directory, 'retired.json'))
+        if retired is not None:
+            merge(total, retired)
+        return total
+
+    def retire(self):
+        # at exit: hand this worker's counters over to retired.json
+        directory = getattr(settings, 'METRICS_DIR', None)
+        if not directory:
+            return
+        self.maybe_flush(force=True)
+        with self.lock:
+            self.data = empty()
+        with _locked(directory):
+            _retire(directory, os.path.join(directory, f'metrics-{self.worker}.json'))
+
+
+@contextmanager
+def _locked(directory):
+    # one process at a time moves snapshots into retired.json
+    import fcntl
+
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, 'retired.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _alive(path):
+    # snapshots are named metrics-<pid>-<token>.json; keep any other name
+    try:
+        pid = int(os.path.basename(path).split('-')[1])
+    except (IndexError, ValueError):
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _read(path):
+    try:
+        with open(path) as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return None
+
+
+def _retire(directory, path):
+    snapshot = _read(path)
+    if snapshot is not None:
+        retired = os.path.join(directory, 'retired.json')
+        total = merge(_read(retired) or empty(), snapshot)
+        with open(f'{retired}.tmp', 'w') as handle:
+            json.dump(total, handle)
+        os.replace(f'{retired}.tmp', retired)
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def merge(total, other):
+    for key, count in other['requests'].items():
+        total['requests'][key] = total['requests'].get(key, 0) + count
+    for section in ('duration', 'size'):
+        for view, histogram in other[section].items():
+            mine = total[section].setdefault(view, {'buckets': [0] * len(histogram['buckets']), 'sum': 0.0, 'count': 0})
+            mine['buckets'] = [a + b for a, b in zip(mine['buckets'], histogram['buckets'])]
+            mine['sum'] += histogram['sum']
+            mine['count'] += histogram['count']
+    for view, db in other['db'].items():
+        mine = total['db'].setdefault(view, {'seconds': 0.0, 'queries': 0})
+        mine['seconds'] += db['seconds']
+        mine['queries'] += db['queries']
+    # snapshots written before cache counters existed have no 'cache' section
+    for key, count in other.get('cache', {}).items():
+        total['cache'][key] = total['cache'].get(key, 0) + count
+    return total
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _render_histogram(lines, name, help_text, histograms, buckets):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} histogram')
+    for view, histogram in sorted(histograms.items()):
+        cumulative = 0
+        for bound, count in zip(buckets, histogram['buckets']):
+            cumulative += count
+            lines.append(f'{name}_bucket{{view="{_label(view)}",le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{view="{_label(view)}",le="+Inf"}} {histogram["count"]}')
+        lines.append(f'{name}_sum{{view="{_label(view)}"}} {histogram["sum"]}')
+        lines.append(f'{name}_count{{view="{_label(view)}"}} {histogram["count"]}')
+
+
+def render(data):
+    # Prometheus text exposition format 0.0.4
+    lines = [
+        '# HELP school_http_requests_total Requests handled, by URL name, method and status.',
+        '# TYPE school_http_requests_total counter',
+    ]
+    for key, count in sorted(data['requests'].items()):
+        view, method, status = key.split('|')
+        lines.append(f'school_http_requests_total{{view="{_label(view)}",method="{method}",status="{status}"}} {count}')
+
+    _render_histogram(lines, 'school_http_request_duration_seconds',
+                      'Time spent handling a request, by URL name.', data['duration'], LATENCY_BUCKETS)
+    _render_histogram(lines, 'school_http_response_size_bytes',
+                      'Response body size (non-streaming responses), by URL name.', data['size'], SIZE_BUCKETS)
+
+    lines.append('# HELP school_http_db_seconds_total Time spent in SQL, by URL name.')
+    lines.append('# TYPE school_http_db_seconds_total counter')
+    for view, db in sorted(data['db'].items()):
+        lines.append(f'school_http_db_seconds_total{{view="{_label(view)}"}} {db["seconds"]}')
+    lines.append('# HELP school_http_db_queries_total SQL queries run, by URL name.')
+    lines.append('# TYPE school_http_db_queries_total counter')
+    for view, db in sorted(data['db'].items()):
+        lines.append(f'school_http_db_queries_total{{view="{_label(view)}"}} {db["queries"]}')
+    lines.append('# HELP school_cache_requests_total Cached fragment lookups, by fragment and hit/miss.')
+    lines.append('# TYPE school_cache_requests_total counter')
+    for key, count in sorted(data['cache'].items()):
+        name, result = key.split('|')
+        lines.append(f'school_cache_requests_total{{cache="{_label(name)}",result="{result}"}} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+atexit.register(registry.retire)
@@ -0,0 +1,174 @@
+import logging
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+from .metrics import registry
+
+logger = logging.getLogger('students.queries')
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryRecorder:
+    # connection.execute_wrapper hook: counts queries, SQL time and how often
+    # each query shape (SQL with placeholders, params left out) repeats
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+        # an async view can run queries on several threads at once
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                self.duration += elapsed
+                self.count += 1
+                self.shapes[sql] += 1
+
+    def repeated(self, threshold):
+        return [(sql, count) for sql, count in self.shapes.most_common() if count >= threshold]
+
+
+# The recorder for the request being handled. Context variables follow the
+# request into sync_to_async threads, so queries an async view runs on other
+# threads (see concurrency.py) are counted against the right request.
+current_recorder = ContextVar('current_recorder', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    recorder = current_recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def track_queries():
+    # hook record_query into this thread's connections (they are per thread)
+    for connection in connections.all():
+        if record_query not in connection.execute_wrappers:
+            connection.execute_wrappers.append(record_query)
+
+
+class QueryBudgetMiddleware:
+    """
+    Record the queries each request runs and check them against the per-view
+    budgets in ``settings.QUERY_BUDGETS`` (keyed by URL name). Going over a
+    budget, or repeating one query shape ``QUERY_REPEAT_THRESHOLD`` times
+    (an N+1), logs a warning, or raises ``QueryBudgetExceeded`` when
+    ``settings.QUERY_BUDGET_RAISE`` is on, as it is in the test suite.
+
+    The numbers are left on ``request.query_stats`` for later middleware.
+    Queries run while a streaming response is being consumed are not counted.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        recorder = QueryRecorder()
+        token = current_recorder.set(recorder)
+        try:
+            track_queries()
+            response = self.get_response(request)
+        finally:
+            current_recorder.reset(token)
+        return self.finish(request, recorder, response)
+
+    async def __acall__(self, request):
+        recorder = QueryRecorder()
+        token = current_recorder.set(recorder)
+        try:
+            # the async ORM runs queries on this request's sync thread
+            await sync_to_async(track_queries)()
+            response = await self.get_response(request)
+        finally:
+            current_recorder.reset(token)
+        return self.finish(request, recorder, response)
+
+    def finish(self, request, recorder, response):
+        match = getattr(request, 'resolver_match', None)
+        url_name = match.url_name if match else None
+        request.query_stats = {
+            'url_name': url_name,
+            'queries': recorder.count,
+            'sql_time': recorder.duration,
+            'repeated': recorder.repeated(getattr(settings, 'QUERY_REPEAT_THRESHOLD', 5)),
+        }
+        self.check(request, recorder, url_name)
+        return response
+
+    def check(self, request, recorder, url_name):
+        problems = []
+        budget = getattr(settings, 'QUERY_BUDGETS', {}).get(url_name)
+        if budget is not None and recorder.count > budget:
+            problems.append(f'{recorder.count} queries, budget is {budget}')
+        for sql, count in request.query_stats['repeated']:
+            problems.append(f'query repeated {count} times (N+1?): {sql[:200]}')
+        if not problems:
+            return
+
+        message = f'{request.method} {request.path} [{url_name}]: ' + '; '.join(problems)
+        if getattr(settings, 'QUERY_BUDGET_RAISE', False):
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+
+
+class MetricsMiddleware:
+    """
+    Feed every request into the metrics registry served at /metrics/. Sits
+    outside QueryBudgetMiddleware so it can pick up ``request.query_stats``.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        return self.observe(request, response, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        return self.observe(request, response, time.perf_counter() - started)
+
+    def observe(self, request, response, duration):
+        stats = getattr(request, 'query_stats', None) or {}
+        match = getattr(request, 'resolver_match', None)
+        registry.observe(
+            view=(match.url_name if match else None) or 'unmatched',
+            method=request.method,
+            status=response.status_code,
+            duration=duration,
+            db_time=stats.get('sql_time', 0.0),
+            queries=stats.get('queries', 0),
+            size=None if response.streaming else len(response.content),
+        )
+        return response
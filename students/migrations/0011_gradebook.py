@@ -0,0 +1,51 @@
+# Generated by Django 5.2.4 on 2026-10-18 10:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_gradebook(apps, schema_editor):
+    Grade = apps.get_model('students', 'Grade')
+    Gradebook = apps.get_model('students', 'Gradebook')
+    kinds = ('quiz', 'test', 'midterm', 'final')
+
+    rows = {}
+    grades = Grade.objects.exclude(course=None).values_list('student_id', 'course_id', 'exam__name', 'score')
+    for student_id, course_id, exam_name, score in grades.iterator():
+        row = rows.setdefault((student_id, course_id), {kind: None for kind in kinds})
+        if exam_name.lower() in kinds:
+            row[exam_name.lower()] = score
+
+    objs = []
+    for (student_id, course_id), row in rows.items():
+        total = sum(row[kind] or 0 for kind in kinds)
+        objs.append(Gradebook(student_id=student_id, course_id=course_id, total=total, percentage=total, **row))
+    Gradebook.objects.bulk_create(objs, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('students', '0010_alter_grade_unique_together'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Gradebook',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quiz', models.FloatField(blank=True, null=True)),
+                ('test', models.FloatField(blank=True, null=True)),
+                ('midterm', models.FloatField(blank=True, null=True)),
+                ('final', models.FloatField(blank=True, null=True)),
+                ('total', models.FloatField(default=0)),
+                ('percentage', models.FloatField(default=0)),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='students.course')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='gradebook', to='students.student')),
+            ],
+            options={
+                'unique_together': {('student', 'course')},
+            },
+        ),
+        migrations.RunPython(backfill_gradebook, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.4 on 2026-10-18 10:45
+
+from django.db import migrations
+from django.db.models import Exists, OuterRef
+
+
+def sync_role_flags(apps, schema_editor):
+    CustomerUser = apps.get_model('students', 'CustomerUser')
+    Group = apps.get_model('auth', 'Group')
+    CustomerUser.objects.update(
+        is_teacher=Exists(Group.objects.filter(name='teacher', user=OuterRef('pk'))),
+        is_student=Exists(Group.objects.filter(name='student', user=OuterRef('pk'))),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('students', '0011_gradebook'),
+    ]
+
+    operations = [
+        migrations.RunPython(sync_role_flags, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.4 on 2026-10-18 11:20
+
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS students_student_search
+        USING fts5(name, department, courses, tokenize='trigram')
+    """)
+    schema_editor.execute("""
+        INSERT INTO students_student_search (rowid, name, department, courses)
+        SELECT s.id, s.name, COALESCE(d.name, ''),
+               COALESCE((SELECT group_concat(c.course_name, ' ')
+                         FROM students_student_courses sc
+                         JOIN students_course c ON c.id = sc.course_id
+                         WHERE sc.student_id = s.id), '')
+        FROM students_student s
+        LEFT JOIN students_department d ON d.id = s.department_id
+    """)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE IF EXISTS students_student_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('students', '0012_sync_role_flags'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.4 on 2026-10-18 10:46
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('students', '0013_student_search_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='attendance',
+            name='date',
+            field=models.DateField(default=django.utils.timezone.localdate, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='exam',
+            name='date',
+            field=models.DateField(default=django.utils.timezone.localdate, editable=False),
+        ),
+    ]
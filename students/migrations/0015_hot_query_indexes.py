@@ -0,0 +1,37 @@
+# Generated by Django 5.2.4 on 2026-10-18 10:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('students', '0014_attendance_exam_date_default'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='attendance',
+            index=models.Index(fields=['-date', 'id'], name='attendance_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='attendance',
+            index=models.Index(fields=['student', '-date'], name='attendance_student_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='attendance',
+            index=models.Index(fields=['course', 'date'], name='attendance_course_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['teacher', 'course_name'], name='course_teacher_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='grade',
+            index=models.Index(fields=['course', 'student'], name='grade_course_student_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='student',
+            index=models.Index(fields=['name', 'id'], name='student_name_id_idx'),
+        ),
+    ]
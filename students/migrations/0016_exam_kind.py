@@ -0,0 +1,34 @@
+# Generated by Django 5.2.4 on 2026-10-18 13:05
+
+from django.db import migrations, models
+
+MAX_SCORES = {'quiz': 10, 'test': 15, 'midterm': 25, 'final': 50, 'other': 100}
+
+
+def backfill_kind(apps, schema_editor):
+    Exam = apps.get_model('students', 'Exam')
+    for kind, max_score in MAX_SCORES.items():
+        exams = Exam.objects.all() if kind == 'other' else Exam.objects.filter(name__iexact=kind)
+        exams.filter(kind='').update(kind=kind, max_score=max_score)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('students', '0015_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exam',
+            name='kind',
+            field=models.CharField(blank=True, choices=[('quiz', 'quiz'), ('test', 'test'), ('midterm', 'midterm'), ('final', 'final'), ('other', 'other')], db_index=True, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='exam',
+            name='max_score',
+            field=models.PositiveIntegerField(blank=True, default=100),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_kind, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.4 on 2026-10-18 10:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_rollups(apps, schema_editor):
+    Attendance = apps.get_model('students', 'Attendance')
+    present = models.Count('id', filter=models.Q(status='present'))
+    absent = models.Count('id', filter=models.Q(status='absent'))
+    for model_name, keys in (('AttendanceSummary', ('student_id', 'course_id')),
+                             ('CourseAttendanceDay', ('course_id', 'date'))):
+        Rollup = apps.get_model('students', model_name)
+        rows = Attendance.objects.order_by().values(*keys).annotate(present=present, absent=absent)
+        Rollup.objects.bulk_create((Rollup(**row) for row in rows.iterator()), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('students', '0016_exam_kind'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttendanceSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('present', models.PositiveIntegerField(default=0)),
+                ('absent', models.PositiveIntegerField(default=0)),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='students.course')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attendance_summary', to='students.student')),
+            ],
+            options={
+                'unique_together': {('student', 'course')},
+            },
+        ),
+        migrations.CreateModel(
+            name='CourseAttendanceDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('present', models.PositiveIntegerField(default=0)),
+                ('absent', models.PositiveIntegerField(default=0)),
+                ('date', models.DateField()),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attendance_days', to='students.course')),
+            ],
+            options={
+                'ordering': ['-date'],
+                'unique_together': {('course', 'date')},
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 11:05
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('students', '0017_attendance_rollups'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='student',
+            index=models.Index(django.db.models.functions.text.Lower('name'), models.F('id'), name='student_lower_name_idx'),
+        ),
+    ]
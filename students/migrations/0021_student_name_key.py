@@ -0,0 +1,40 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:43
+
+import students.models
+from django.db import migrations, models
+
+
+def backfill_name_keys(apps, schema_editor):
+    Student = apps.get_model('students', 'Student')
+    batch = []
+    for student in Student.objects.only('pk', 'name').iterator(chunk_size=1000):
+        student.name_key = student.name.casefold()
+        batch.append(student)
+        if len(batch) == 1000:
+            Student.objects.bulk_update(batch, ['name_key'])
+            batch = []
+    Student.objects.bulk_update(batch, ['name_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('students', '0020_job'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='student',
+            name='student_lower_name_idx',
+        ),
+        migrations.AddField(
+            model_name='student',
+            name='name_key',
+            field=students.models.CasefoldField(default='', max_length=512, source='name'),
+        ),
+        migrations.RunPython(backfill_name_keys, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='student',
+            index=models.Index(fields=['name_key', 'id'], name='student_name_key_idx'),
+        ),
+    ]
@@ -1,10 +1,35 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser
 from django.conf import settings
 from django.core.exceptions import ValidationError
+from django.utils import timezone
+
+from . import caching
 
 # Create your models here.
 
+class CasefoldField(models.CharField):
+    # a casefolded copy of another field, set whenever the row is written
+    # (save() and bulk_create() both call pre_save). SQLite's LOWER() and
+    # LIKE only fold ASCII letters, so case-insensitive prefix matching on
+    # names like "Élodie" needs the folding done in Python.
+    def __init__(self,*args,source=None,**kwargs):
+        self.source=source
+        kwargs.setdefault('editable',False)
+        super().__init__(*args,**kwargs)
+
+    def deconstruct(self):
+        name,path,args,kwargs=super().deconstruct()
+        kwargs['source']=self.source
+        kwargs.pop('editable',None)
+        return name,path,args,kwargs
+
+    def pre_save(self,model_instance,add):
+        value=getattr(model_instance,self.source).casefold()
+        setattr(model_instance,self.attname,value)
+        return value
+
+
 class Teacher(models.Model):
     user = models.OneToOneField("CustomerUser", on_delete=models.CASCADE,null=True,blank=True)
     name = models.CharField(max_length=200)
@@ -20,6 +45,13 @@ class Course(models.Model):
     department=models.ForeignKey("Department",on_delete=models.CASCADE)
     credits=models.PositiveIntegerField()
     teacher=models.ForeignKey(Teacher,on_delete=models.CASCADE,null=True)
+    updated_at=models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes=[
+            # a teacher's courses, listed by name
+            models.Index(fields=['teacher','course_name'],name='course_teacher_name_idx'),
+        ]
 
     def __str__(self):
         return self.course_name
@@ -45,6 +77,11 @@ class Student(models.Model):
     department=models.ForeignKey(Department,
                                 on_delete=models.SET_NULL,
                                 null=True,blank=True)
+    # autocomplete matches name prefixes on this
+    name_key=CasefoldField(max_length=512,source='name',default='')
+    # also moved forward when the courses or department shown with the
+    # student change (see signals.py)
+    updated_at=models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
@@ -54,43 +91,193 @@ class Student(models.Model):
                             null=True,
                             blank=True)
 
+    class Meta:
+        indexes=[
+            # student_list pages on (name, id)
+            models.Index(fields=['name','id'],name='student_name_id_idx'),
+            # autocomplete: case-insensitive name prefix as a range scan
+            models.Index(fields=['name_key','id'],name='student_name_key_idx'),
+        ]
+
+    @classmethod
+    def touch(cls,student_ids):
+        # queryset updates skip auto_now
+        cls.objects.filter(pk__in=student_ids).update(updated_at=timezone.now())
+
     
 class Attendance(models.Model):
     student=models.ForeignKey(Student,on_delete=models.CASCADE)
     course=models.ForeignKey(Course,on_delete=models.CASCADE)
-    date=models.DateField(auto_now_add=True)
+    date=models.DateField(default=timezone.localdate,editable=False)
     status_choices=(
         ('present','present'),
         ('absent','absent')
     )
     status=models.CharField(max_length=10,choices=status_choices)
+    updated_at=models.DateTimeField(auto_now=True)
 
     class Meta:
         unique_together=('student','course','date')
         ordering=['-date']
+        indexes=[
+            # attendance_list pages on (-date, id)
+            models.Index(fields=['-date','id'],name='attendance_date_id_idx'),
+            # my_attendance: one student's rows, newest first
+            models.Index(fields=['student','-date'],name='attendance_student_date_idx'),
+            # roster marking: one course on one day
+            models.Index(fields=['course','date'],name='attendance_course_date_idx'),
+        ]
 
     def __str__(self):
         return f"self.student.name - {self.Course.course_name}-{self.date}-{self.status}"
-    
+
+    @classmethod
+    def mark_roster(cls,course,statuses):
+        # statuses maps student id -> status; one batched INSERT that
+        # upserts on (student, course, date) when re-submitted the same day
+        rows=[cls(student_id=student_id,course=course,status=status)
+              for student_id,status in statuses.items()]
+        with transaction.atomic():
+            rows=cls.objects.bulk_create(rows,
+                                         update_conflicts=True,
+                                         unique_fields=['student','course','date'],
+                                         update_fields=['status','updated_at'])
+            # bulk_create skips post_save, so refresh the rollups here
+            AttendanceSummary.refresh({(student_id,course.pk) for student_id in statuses})
+            CourseAttendanceDay.refresh({(course.pk,row.date) for row in rows})
+            caching.bump('attendance',['all'])
+        return rows
+
+
+class AttendanceRollup(models.Model):
+    # present/absent counts grouped by some key, kept in sync from Attendance
+    # (see signals.py) and rebuilt with `manage.py rebuild_attendance`
+    present=models.PositiveIntegerField(default=0)
+    absent=models.PositiveIntegerField(default=0)
+
+    keys=()
+
+    class Meta:
+        abstract=True
+
+    @property
+    def rate(self):
+        total=self.present+self.absent
+        return round(self.present*100/total,1) if total else None
+
+    @classmethod
+    def counts(cls,attendance):
+        # {key tuple: {'present': n, 'absent': n}}, grouped in SQL
+        rows=(attendance
+              .order_by()
+              .values(*cls.keys)
+              .annotate(present=models.Count('id',filter=models.Q(status='present')),
+                        absent=models.Count('id',filter=models.Q(status='absent'))))
+        return {tuple(row.pop(key) for key in cls.keys):row for row in rows.iterator()}
+
+    @classmethod
+    def refresh(cls,wanted):
+        # recompute the rows for the given key tuples only; keys left with no
+        # attendance lose their row
+        wanted=set(wanted)
+        if not wanted:
+            return
+        attendance=Attendance.objects.filter(**{
+            f'{key}__in':{values[index] for values in wanted}
+            for index,key in enumerate(cls.keys)
+        })
+        rows={key:counts for key,counts in cls.counts(attendance).items() if key in wanted}
+
+        with transaction.atomic(savepoint=False):
+            cls.objects.bulk_create([cls(**dict(zip(cls.keys,key)),**counts) for key,counts in rows.items()],
+                                    update_conflicts=True,
+                                    unique_fields=[key.removesuffix('_id') for key in cls.keys],
+                                    update_fields=['present','absent'])
+            stale=wanted-rows.keys()
+            if stale:
+                query=models.Q()
+                for key in stale:
+                    query|=models.Q(**dict(zip(cls.keys,key)))
+                cls.objects.filter(query).delete()
+
+
+class AttendanceSummary(AttendanceRollup):
+    # one row per (student, course)
+    student=models.ForeignKey(Student,on_delete=models.CASCADE,related_name='attendance_summary')
+    course=models.ForeignKey(Course,on_delete=models.CASCADE)
+
+    keys=('student_id','course_id')
+
+    class Meta:
+        unique_together=('student','course')
+
+    @classmethod
+    def refresh(cls,wanted):
+        wanted=set(wanted)
+        super().refresh(wanted)
+        # every attendance write comes through here; expire the students'
+        # cached attendance pages and dashboards
+        caching.bump('student',{student_id for student_id,_ in wanted})
+
+    def __str__(self):
+        return f'{self.student_id} - {self.course_id} - {self.present}/{self.present+self.absent}'
+
+
+class CourseAttendanceDay(AttendanceRollup):
+    # one row per (course, date)
+    course=models.ForeignKey(Course,on_delete=models.CASCADE,related_name='attendance_days')
+    date=models.DateField()
+
+    keys=('course_id','date')
+
+    class Meta:
+        unique_together=('course','date')
+        ordering=['-date']
+
+    def __str__(self):
+        return f'{self.course_id} - {self.date} - {self.present}/{self.present+self.absent}'
+
+
+EXAM_KINDS=('quiz','test','midterm','final')
+EXAM_MAX_SCORES={'quiz':10,'test':15,'midterm':25,'final':50,'other':100}
+
 
 class Exam(models.Model):
+    kind_choices=(
+        ('quiz','quiz'),
+        ('test','test'),
+        ('midterm','midterm'),
+        ('final','final'),
+        ('other','other'),
+    )
     name=models.CharField(max_length=256)
     course=models.ForeignKey(Course,on_delete=models.CASCADE)
-    date=models.DateField(auto_now_add=True)
-
-    def max_score(self):
-        name=self.name.lower()
-
-        if name=='quiz':
-            return 10
-        elif name=='test':
-            return 15
-        elif name=='midterm':
-            return 25
-        elif name=='final':
-            return 50
-        else:
-            return 100
+    date=models.DateField(default=timezone.localdate,editable=False)
+    # left blank, kind is worked out from the name and max_score from the kind
+    kind=models.CharField(max_length=10,choices=kind_choices,blank=True,db_index=True)
+    max_score=models.PositiveIntegerField(blank=True)
+
+    @staticmethod
+    def kind_for_name(name):
+        name=name.lower()
+        return name if name in EXAM_KINDS else 'other'
+
+    def save(self,*args,**kwargs):
+        if not self.kind:
+            self.kind=self.kind_for_name(self.name)
+        # signals.py refreshes the gradebook when the kind changes
+        self._old_kind=None
+        if self.pk:
+            old=Exam.objects.filter(pk=self.pk).values_list('kind','max_score').first()
+            if old:
+                self._old_kind,old_max_score=old
+                # a new kind brings its own max score, unless one was set by hand
+                if (self.kind!=self._old_kind and self.max_score==old_max_score
+                        and old_max_score==EXAM_MAX_SCORES.get(self._old_kind)):
+                    self.max_score=None
+        if self.max_score is None:
+            self.max_score=EXAM_MAX_SCORES[self.kind]
+        super().save(*args,**kwargs)
 
     def __str__(self):
         return f'{self.name} - {self.course.course_name} - {self.date}'
@@ -102,17 +289,150 @@ class Grade(models.Model):
     course=models.ForeignKey(Course,on_delete=models.CASCADE,null=True,blank=True)
 
     score=models.FloatField()
+    updated_at=models.DateTimeField(auto_now=True)
 
     class Meta:
         unique_together=('student','exam','course')
+        indexes=[
+            # grade grid, exports and gradebook refreshes filter by course first
+            models.Index(fields=['course','student'],name='grade_course_student_idx'),
+        ]
 
     def clean(self):
-        max_score=self.exam.max_score()
+        if self.exam_id is None or self.score is None:
+            return
+        # the form hands over the Exam it already loaded, so this reads a column
+        max_score=self.exam.max_score
         if self.score>max_score:
             raise ValidationError(f'Score cannot be greater than {max_score}')
 
     def __str__(self):
         return f'{self.student.name} - {self.exam.name} - {self.score}'
-    
 
+    @classmethod
+    def save_grid(cls,course,scores):
+        # scores maps (student id, exam id) -> score, already validated against
+        # each exam's max score; the whole matrix is one upsert in one transaction
+        rows=[cls(student_id=student_id,exam_id=exam_id,course=course,score=score)
+              for (student_id,exam_id),score in scores.items()]
+        with transaction.atomic():
+            rows=cls.objects.bulk_create(rows,
+                                         update_conflicts=True,
+                                         unique_fields=['student','exam','course'],
+                                         update_fields=['score','updated_at'])
+            # bulk_create skips post_save, so refresh the rollup here
+            Gradebook.refresh({(student_id,course.pk) for student_id,_ in scores})
+        return rows
+
+
+class Gradebook(models.Model):
+    # denormalized per-(student, course) totals, kept in sync from Grade
+    # (see signals.py) and rebuilt with `manage.py rebuild_gradebook`
+    student=models.ForeignKey(Student,on_delete=models.CASCADE,related_name='gradebook')
+    course=models.ForeignKey(Course,on_delete=models.CASCADE)
+    quiz=models.FloatField(null=True,blank=True)
+    test=models.FloatField(null=True,blank=True)
+    midterm=models.FloatField(null=True,blank=True)
+    final=models.FloatField(null=True,blank=True)
+    total=models.FloatField(default=0)
+    percentage=models.FloatField(default=0)
+
+    class Meta:
+        unique_together=('student','course')
+
+    def __str__(self):
+        return f'{self.student_id} - {self.course_id} - {self.total}'
+
+    @staticmethod
+    def pivot(grades):
+        # one row of scalar columns per (student, course), pivoted by exam
+        # kind in SQL with conditional aggregation
+        kinds={kind:models.Sum('score',filter=models.Q(exam__kind=kind))
+               for kind in EXAM_KINDS}
+        return (grades
+                .exclude(course=None)
+                .order_by()
+                .values('student_id','course_id')
+                .annotate(**kinds,
+                          total=models.Sum('score',filter=models.Q(exam__kind__in=EXAM_KINDS))))
+
+    @classmethod
+    def compute(cls,grades):
+        # grades: Grade queryset -> {(student id, course id): row fields}
+        rows={}
+        for row in cls.pivot(grades).iterator():
+            pair=(row.pop('student_id'),row.pop('course_id'))
+            row['total']=row['total'] or 0
+            # quiz + test + midterm + final max scores add up to 100
+            row['percentage']=row['total']
+            rows[pair]=row
+        return rows
+
+    @classmethod
+    def refresh(cls,pairs):
+        # recompute the rows for the given (student id, course id) pairs only
+        pairs={pair for pair in pairs if pair[1] is not None}
+        if not pairs:
+            return
+        student_ids={student_id for student_id,_ in pairs}
+        course_ids={course_id for _,course_id in pairs}
+        rows=cls.compute(Grade.objects.filter(student_id__in=student_ids,course_id__in=course_ids))
+        rows={pair:fields for pair,fields in rows.items() if pair in pairs}
+
+        with transaction.atomic(savepoint=False):
+            cls.objects.bulk_create([cls(student_id=student_id,course_id=course_id,**fields)
+                                     for (student_id,course_id),fields in rows.items()],
+                                    update_conflicts=True,
+                                    unique_fields=['student','course'],
+                                    update_fields=[*EXAM_KINDS,'total','percentage'])
+            stale=pairs-rows.keys()
+            if stale:
+                query=models.Q()
+                for student_id,course_id in stale:
+                    query|=models.Q(student_id=student_id,course_id=course_id)
+                cls.objects.filter(query).delete()
+        # every grade write comes through here; expire the students' cached grades
+        caching.bump('student',student_ids)
+
+
+class Job(models.Model):
+    # slow work queued by the web process and run by `manage.py run_jobs`
+    # (see jobs.py); the table is the queue, no broker needed
+    status_choices=(
+        ('queued','queued'),
+        ('running','running'),
+        ('done','done'),
+        ('failed','failed'),
+    )
+    kind=models.CharField(max_length=64)
+    args=models.JSONField(default=dict,blank=True)
+    user=models.ForeignKey(CustomerUser,on_delete=models.SET_NULL,null=True,blank=True)
+    status=models.CharField(max_length=10,choices=status_choices,default='queued')
+    # queued jobs wait until run_at; a retry pushes it back
+    run_at=models.DateTimeField(default=timezone.now)
+    attempts=models.PositiveIntegerField(default=0)
+    max_attempts=models.PositiveIntegerField(default=3)
+    # a running job whose lease runs out (its worker died) is queued again
+    leased_until=models.DateTimeField(null=True,blank=True)
+    worker=models.CharField(max_length=128,blank=True)
+    done=models.PositiveIntegerField(default=0)
+    total=models.PositiveIntegerField(null=True,blank=True)
+    message=models.CharField(max_length=256,blank=True)
+    result=models.JSONField(null=True,blank=True)
+    error=models.TextField(blank=True)
+    created_at=models.DateTimeField(auto_now_add=True)
+    started_at=models.DateTimeField(null=True,blank=True)
+    finished_at=models.DateTimeField(null=True,blank=True)
+
+    class Meta:
+        indexes=[
+            # the worker's claim: the oldest due queued jobs
+            models.Index(fields=['status','run_at'],name='job_status_run_at_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} #{self.pk} ({self.status})'
 
+    @property
+    def percent(self):
+        return round(self.done*100/self.total,1) if self.total else None
@@ -0,0 +1,163 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+
+# -------------------------------
+# Keyset (cursor) pagination
+# -------------------------------
+# Pages are addressed by an opaque token holding the sort key of the row the
+# previous page stopped at, so fetching page 1000 is the same indexed range
+# scan as page 1. The exact total count is only run when asked for.
+
+def encode_cursor(direction, key):
+    raw = json.dumps([direction, key], cls=DjangoJSONEncoder)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        direction, key = json.loads(raw)
+    except (ValueError, TypeError):
+        return None, None
+    if direction not in ('next', 'prev') or not isinstance(key, list):
+        return None, None
+    return direction, key
+
+
+class KeysetPage:
+    def __init__(self, object_list, has_next, has_previous, next_cursor, previous_cursor, count=None):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.count = count
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """
+    Paginate ``object_list`` by ``ordering`` (e.g. ``['-date', 'id']``); the
+    ordering must end in a unique field. A plain list that is already in
+    order (such as ranked search ids) can be paged with ``ordering=None``,
+    in which case the cursor is the list position.
+    """
+
+    def __init__(self, object_list, per_page, ordering=None, with_count=False):
+        self.object_list = object_list
+        self.per_page = per_page
+        self.ordering = ordering
+        self.with_count = with_count
+
+    def page(self, token=None):
+        direction, key = decode_cursor(token) if token else (None, None)
+        if self.ordering is None:
+            rows, has_more = self._list_rows(direction, key)
+        else:
+            rows, has_more = self._queryset_rows(direction, key)
+
+        if direction == 'prev':
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, direction == 'next'
+
+        count = None
+        if self.with_count:
+            count = len(self.object_list) if self.ordering is None else self.object_list.count()
+
+        return KeysetPage(
+            rows,
+            has_next=has_next,
+            has_previous=has_previous,
+            next_cursor=encode_cursor('next', self._key(rows, -1)) if rows and has_next else None,
+            previous_cursor=encode_cursor('prev', self._key(rows, 0)) if rows and has_previous else None,
+            count=count,
+        )
+
+    def _list_rows(self, direction, key):
+        position = key[0] if key and type(key[0]) is int and key[0] >= 0 else None
+        if position is None:
+            start = 0
+        elif direction == 'prev':
+            start = max(position - self.per_page, 0)
+        else:
+            start = position + 1
+        end = position if direction == 'prev' and position is not None else start + self.per_page
+        rows = list(enumerate(self.object_list[start:end], start=start))
+        has_more = start > 0 if direction == 'prev' else end < len(self.object_list)
+        self._positions = [index for index, _ in rows]
+        return [row for _, row in rows], has_more
+
+    def _queryset_rows(self, direction, key):
+        ordering = self.ordering
+        if direction == 'prev':
+            ordering = [name[1:] if name.startswith('-') else '-' + name for name in ordering]
+
+        queryset = self.object_list.order_by(*ordering)
+        key = self._clean_key(key)
+        if key is not None:
+            queryset = queryset.filter(self._after(ordering, key))
+
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if direction == 'prev':
+            rows.reverse()
+        return rows, has_more
+
+    def _clean_key(self, key):
+        # the cursor comes from the URL: a key that does not fit the ordering's
+        # fields (tampered, or from an older ordering) starts at page one
+        if key is None or len(key) != len(self.ordering):
+            return None
+        cleaned = []
+        for name, value in zip(self.ordering, key):
+            field = self.object_list.model._meta.get_field(name.lstrip('-'))
+            try:
+                value = field.to_python(value)
+            except (ValidationError, TypeError, ValueError):
+                return None
+            if value is None:
+                return None
+            cleaned.append(value)
+        return cleaned
+
+    @staticmethod
+    def _after(ordering, key):
+        # rows strictly after `key` in `ordering`:
+        # a >= x AND ((a > x) OR (a = x AND b > y) OR ...)
+        # The leading bound on its own lets SQLite start an index range scan
+        # at the cursor instead of expanding the OR and sorting.
+        condition = Q()
+        for index, name in enumerate(ordering):
+            field = name.lstrip('-')
+            lookup = 'lt' if name.startswith('-') else 'gt'
+            term = Q(**{f'{field}__{lookup}': key[index]})
+            for previous, value in zip(ordering[:index], key):
+                term &= Q(**{previous.lstrip('-'): value})
+            condition |= term
+        first = ordering[0]
+        bound = Q(**{f"{first.lstrip('-')}__{'lte' if first.startswith('-') else 'gte'}": key[0]})
+        return bound & condition
+
+    def _key(self, rows, index):
+        if self.ordering is None:
+            return [self._positions[index]]
+        row = rows[index]
+        fields = [name.lstrip('-') for name in self.ordering]
+        if isinstance(row, dict):
+            return [row[field] for field in fields]
+        return [getattr(row, field) for field in fields]
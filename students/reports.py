@@ -0,0 +1,265 @@
+import csv
+import json
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import django
+from django.conf import settings
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .models import EXAM_KINDS, AttendanceSummary, Gradebook, Student
+
+# -------------------------------
+# Batch report cards
+# -------------------------------
+# End-of-term report cards for every student in a department, a course or
+# the whole school. The data for a batch of students is read in four
+# set-based queries (students, enrollments with course credits, gradebook
+# rollups, attendance rollups) and assembled into plain dicts. The batch is
+# then rendered to one HTML file per student and one CSV per batch on a
+# process pool.
+#
+# Each finished batch is appended to manifest.jsonl in the run's directory,
+# so a run that is interrupted picks up where it stopped when started again.
+# manifest.json is written once every student is done.
+
+BATCH_SIZE = 500
+FORMATS = ('html', 'csv')
+COURSE_FIELDS = ['credits', *EXAM_KINDS, 'total', 'percentage', 'present', 'absent', 'attendance_rate']
+CSV_FIELDS = ['term', 'student_id', 'student', 'department', 'course_code', 'course', *COURSE_FIELDS]
+
+
+def _rate(present, absent):
+    total = present + absent
+    return round(present * 100 / total, 1) if total else None
+
+
+def fetch_cards(student_ids):
+    # four queries for the whole batch, whatever its size
+    students = (
+        Student.objects
+        .filter(pk__in=student_ids)
+        .order_by('id')
+        .values('id', 'name', 'grade', 'email', 'department__name')
+    )
+    enrollments = (
+        Student.courses.through.objects
+        .filter(student_id__in=student_ids)
+        .order_by('course__course_code')
+        .values_list('student_id', 'course_id', 'course__course_code', 'course__course_name', 'course__credits')
+    )
+    gradebook = {
+        (row.pop('student_id'), row.pop('course_id')): row
+        for row in Gradebook.objects.filter(student_id__in=student_ids)
+        .values('student_id', 'course_id', *EXAM_KINDS, 'total', 'percentage')
+    }
+    attendance = {
+        (student_id, course_id): (present, absent)
+        for student_id, course_id, present, absent in AttendanceSummary.objects
+        .filter(student_id__in=student_ids)
+        .values_list('student_id', 'course_id', 'present', 'absent')
+    }
+
+    courses = {}
+    for student_id, course_id, code, name, credits in enrollments:
+        grades = gradebook.get((student_id, course_id), {})
+        present, absent = attendance.get((student_id, course_id), (0, 0))
+        courses.setdefault(student_id, []).append({
+            'code': code,
+            'name': name,
+            'credits': credits,
+            **{kind: grades.get(kind) for kind in EXAM_KINDS},
+            'total': grades.get('total', 0),
+            'percentage': grades.get('percentage', 0),
+            'present': present,
+            'absent': absent,
+            'attendance_rate': _rate(present, absent),
+        })
+
+    cards = []
+    for student in students:
+        enrolled = courses.get(student['id'], [])
+        credits = sum(course['credits'] for course in enrolled)
+        cards.append({
+            'id': student['id'],
+            'name': student['name'],
+            'grade': student['grade'],
+            'email': student['email'],
+            'department': student['department__name'],
+            'courses': enrolled,
+            'credits': credits,
+            # credit-weighted percentage across the student's courses
+            'average': round(sum(course['percentage'] * course['credits'] for course in enrolled) / credits, 1)
+            if credits else None,
+            'attendance_rate': _rate(sum(course['present'] for course in enrolled),
+                                     sum(course['absent'] for course in enrolled)),
+        })
+    return cards
+
+
+def render_batch(directory, term, cards, formats):
+    # runs on a pool process; returns the files it wrote, relative to directory
+    files = []
+    if 'html' in formats:
+        os.makedirs(os.path.join(directory, 'html'), exist_ok=True)
+        for card in cards:
+            name = os.path.join('html', f"{card['id']}.html")
+            _write(directory, name, render_to_string('students/reports/report_card.html',
+                                                     {'term': term, 'card': card}))
+            files.append(name)
+    if 'csv' in formats and cards:
+        os.makedirs(os.path.join(directory, 'csv'), exist_ok=True)
+        name = os.path.join('csv', f"students-{cards[0]['id']}-{cards[-1]['id']}.csv")
+        path = os.path.join(directory, name)
+        with open(f'{path}.partial', 'w', newline='') as output:
+            writer = csv.DictWriter(output, CSV_FIELDS)
+            writer.writeheader()
+            for card in cards:
+                for course in card['courses']:
+                    writer.writerow({
+                        'term': term, 'student_id': card['id'], 'student': card['name'],
+                        'department': card['department'], 'course_code': course['code'],
+                        'course': course['name'],
+                        **{field: course[field] for field in COURSE_FIELDS},
+                    })
+        os.replace(f'{path}.partial', path)
+        files.append(name)
+    return files
+
+
+def _write(directory, name, content):
+    # a half-written file never has the final name
+    path = os.path.join(directory, name)
+    with open(f'{path}.partial', 'w') as output:
+        output.write(content)
+    os.replace(f'{path}.partial', path)
+
+
+class ReportCards:
+    """
+    One report card run: ``term`` plus at most one of ``department`` or
+    ``course`` (ids; neither means every student). Files go to
+    ``MEDIA_ROOT/report_cards/<term>/<scope>/``. ``workers=0`` renders in
+    this process, as a background job does.
+    """
+
+    def __init__(self, term, department=None, course=None, formats=FORMATS, batch_size=BATCH_SIZE, workers=None):
+        # the term names a directory
+        if not re.fullmatch(r'[\w-][\w.-]*', term):
+            raise ValueError(f'term must be letters, digits, "-", "_" or ".": {term!r}')
+        self.term = term
+        self.formats = formats
+        self.batch_size = batch_size
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.students = Student.objects.all()
+        self.scope = 'all'
+        if department is not None:
+            self.students = self.students.filter(department_id=department)
+            self.scope = f'department-{department}'
+        elif course is not None:
+            self.students = self.students.filter(courses=course)
+            self.scope = f'course-{course}'
+        self.directory = os.path.join(settings.MEDIA_ROOT, 'report_cards', term, self.scope)
+
+    @property
+    def manifest(self):
+        return os.path.join(self.directory, 'manifest.jsonl')
+
+    def finished(self):
+        # batches recorded by earlier (possibly interrupted) runs
+        done, files, lines = set(), [], []
+        if not os.path.exists(self.manifest):
+            return done, files
+        with open(self.manifest) as manifest:
+            for line in manifest:
+                try:
+                    batch = json.loads(line) if line.endswith('\n') else None
+                except json.JSONDecodeError:
+                    batch = None
+                if batch is None:
+                    # cut off mid-write: drop it so new batches append after
+                    # the last whole line, and redo that batch
+                    _write(self.directory, 'manifest.jsonl', ''.join(lines))
+                    break
+                lines.append(line)
+                done.update(batch['students'])
+                files.extend(batch['files'])
+        return done, files
+
+    def restart(self):
+        for name in ('manifest.jsonl', 'manifest.json'):
+            if os.path.exists(os.path.join(self.directory, name)):
+                os.remove(os.path.join(self.directory, name))
+
+    def batches(self, skip):
+        ids = [pk for pk in self.students.order_by('id').values_list('pk', flat=True) if pk not in skip]
+        return [ids[start:start + self.batch_size] for start in range(0, len(ids), self.batch_size)]
+
+    def run(self, report=None):
+        """
+        Render every student not in the manifest yet. ``report(done, total,
+        rate)`` is called after each batch. Returns the run's summary, also
+        written to manifest.json.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        done, files = self.finished()
+        batches = self.batches(done)
+        total = len(done) + sum(map(len, batches))
+        started = time.monotonic()
+        rendered = 0
+
+        def record(student_ids, batch_files):
+            nonlocal rendered
+            with open(self.manifest, 'a') as manifest:
+                manifest.write(json.dumps({'students': student_ids, 'files': batch_files}) + '\n')
+                manifest.flush()
+                os.fsync(manifest.fileno())
+            done.update(student_ids)
+            files.extend(batch_files)
+            rendered += len(student_ids)
+            if report is not None:
+                report(len(done), total, rendered / max(time.monotonic() - started, 1e-6))
+
+        if self.workers:
+            self.render_on_pool(batches, record)
+        else:
+            for student_ids in batches:
+                record(student_ids, render_batch(self.directory, self.term, fetch_cards(student_ids), self.formats))
+
+        seconds = time.monotonic() - started
+        summary = {
+            'term': self.term,
+            'scope': self.scope,
+            'students': len(done),
+            'rendered': rendered,
+            'files': sorted(files),
+            'seconds': round(seconds, 2),
+            'students_per_second': round(rendered / seconds, 1) if seconds else None,
+            'completed_at': timezone.now().isoformat(),
+        }
+        _write(self.directory, 'manifest.json', json.dumps(summary, indent=2))
+        return summary
+
+    def render_on_pool(self, batches, record):
+        # the database is read here, one batch ahead of the pool; keep a
+        # couple of batches per process queued so none sits idle
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(self.workers, mp_context=context, initializer=django.setup) as pool:
+            pending = {}
+            batches = iter(batches)
+            while True:
+                while len(pending) < self.workers * 2:
+                    student_ids = next(batches, None)
+                    if student_ids is None:
+                        break
+                    cards = fetch_cards(student_ids)
+                    pending[pool.submit(render_batch, self.directory, self.term, cards, self.formats)] = student_ids
+                if not pending:
+                    return
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    record(pending.pop(future), future.result())
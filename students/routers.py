@@ -0,0 +1,70 @@
+import functools
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+
+# -------------------------------
+# Read replica routing
+# -------------------------------
+# Views wrapped in replica_reads send their reads to the 'replica' database
+# when one is configured (see settings.py); writes always go to 'default'.
+# The flag lives in a context variable, so it follows an async view's reads
+# onto pool threads and is never left set for the next request on a thread.
+#
+# Only views that write nothing and cache nothing under a version token are
+# marked: a page cached from a replica older than the write that bumped its
+# token would stay stale until the next bump.
+#
+# Users, sessions and permissions are always read from 'default', even in a
+# marked view: they decide who may see the page, so a deactivated user or a
+# revoked permission must count at once, and CachedModelBackend caches the
+# permission set under a version token.
+PRIMARY_APPS = {'auth', 'contenttypes', 'sessions'}
+
+reading_replica = ContextVar('reading_replica', default=False)
+
+
+def replica_reads(view):
+    if iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            token = reading_replica.set(True)
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                reading_replica.reset(token)
+    else:
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            token = reading_replica.set(True)
+            try:
+                response = view(request, *args, **kwargs)
+                # template responses render after the view returns
+                if hasattr(response, 'render') and not response.is_rendered:
+                    response.render()
+                return response
+            finally:
+                reading_replica.reset(token)
+    return wrapper
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if not reading_replica.get() or 'replica' not in settings.DATABASES:
+            return None
+        # the user's groups and permissions links are auto-created models
+        owner = model._meta.auto_created or model
+        if owner._meta.app_label in PRIMARY_APPS or owner._meta.label == settings.AUTH_USER_MODEL:
+            return None
+        return 'replica'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replica is a copy of the same tables
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
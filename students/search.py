@@ -0,0 +1,94 @@
+from django.db import connection
+
+from .models import Course, Department, Student
+
+# SQLite FTS5 index over student name, department name and enrolled course
+# names, one row per student (rowid = student id). The trigram tokenizer
+# gives substring matches like the old icontains search did.
+TABLE = 'students_student_search'
+CHUNK_SIZE = 500
+
+CREATE_SQL = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE}
+USING fts5(name, department, courses, tokenize='trigram')
+"""
+DROP_SQL = f'DROP TABLE IF EXISTS {TABLE}'
+
+INSERT_SQL = f"""
+INSERT INTO {TABLE} (rowid, name, department, courses)
+SELECT s.id, s.name, COALESCE(d.name, ''),
+       COALESCE((SELECT group_concat(c.course_name, ' ')
+                 FROM {Student.courses.through._meta.db_table} sc
+                 JOIN {Course._meta.db_table} c ON c.id = sc.course_id
+                 WHERE sc.student_id = s.id), '')
+FROM {Student._meta.db_table} s
+LEFT JOIN {Department._meta.db_table} d ON d.id = s.department_id
+"""
+
+
+def available():
+    return connection.vendor == 'sqlite'
+
+
+def _chunks(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), CHUNK_SIZE):
+        yield ids[start:start + CHUNK_SIZE]
+
+
+def index_students(student_ids):
+    # (re)build the index rows for these students from the live tables
+    if not available():
+        return
+    with connection.cursor() as cursor:
+        for chunk in _chunks(student_ids):
+            params = ', '.join(['%s'] * len(chunk))
+            cursor.execute(f'DELETE FROM {TABLE} WHERE rowid IN ({params})', chunk)
+            cursor.execute(f'{INSERT_SQL} WHERE s.id IN ({params})', chunk)
+
+
+def remove_students(student_ids):
+    if not available():
+        return
+    with connection.cursor() as cursor:
+        for chunk in _chunks(student_ids):
+            params = ', '.join(['%s'] * len(chunk))
+            cursor.execute(f'DELETE FROM {TABLE} WHERE rowid IN ({params})', chunk)
+
+
+def rebuild():
+    with connection.cursor() as cursor:
+        cursor.execute(DROP_SQL)
+        cursor.execute(CREATE_SQL)
+        cursor.execute(INSERT_SQL)
+
+
+def search_students(q):
+    # every matching student id, best match first, for the search box; ids
+    # are cheap to hold and the paginator loads only the shown page
+    terms = q.split()
+    if not terms:
+        return []
+
+    with connection.cursor() as cursor:
+        if all(len(term) >= 3 for term in terms):
+            # every term must appear in some column; bm25 rank orders the hits
+            match = ' '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+            cursor.execute(
+                f'SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s ORDER BY rank',
+                [match],
+            )
+        else:
+            # trigrams need 3+ characters; short terms scan the (small) index
+            # table, each term matching some column as in the MATCH above
+            like = ("(name LIKE %s ESCAPE '\\' OR department LIKE %s ESCAPE '\\' "
+                    "OR courses LIKE %s ESCAPE '\\')")
+            params = []
+            for term in terms:
+                pattern = '%{}%'.format(term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_'))
+                params += [pattern] * 3
+            cursor.execute(
+                f"SELECT rowid FROM {TABLE} WHERE {' AND '.join([like] * len(terms))} ORDER BY name",
+                params,
+            )
+        return [row[0] for row in cursor.fetchall()]
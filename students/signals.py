@@ -0,0 +1,314 @@
+from django.contrib.auth.models import Group, Permission
+from django.db.models import Exists, OuterRef
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import caching, search
+from .models import (Attendance, AttendanceSummary, Course, CourseAttendanceDay, CustomerUser, Department, Exam,
+                     Grade, Gradebook, Student)
+
+
+# -------------------------------
+# Gradebook rollup
+# -------------------------------
+@receiver(pre_save, sender=Grade)
+def remember_grade_pair(sender, instance, **kwargs):
+    # an edit can move a grade to another student/course; keep the old pair
+    # so its gradebook row is recomputed too
+    instance._old_pair = None
+    if instance.pk:
+        instance._old_pair = (
+            Grade.objects.filter(pk=instance.pk)
+            .values_list('student_id', 'course_id')
+            .first()
+        )
+
+
+@receiver(post_save, sender=Grade)
+@receiver(post_delete, sender=Grade)
+def refresh_gradebook(sender, instance, **kwargs):
+    pairs = {(instance.student_id, instance.course_id)}
+    if getattr(instance, '_old_pair', None):
+        pairs.add(instance._old_pair)
+    Gradebook.refresh(pairs)
+
+
+@receiver(post_save, sender=Exam)
+def refresh_exam_gradebook(sender, instance, created, **kwargs):
+    # an exam's kind decides which column its scores count towards
+    if not created and getattr(instance, '_old_kind', None) != instance.kind:
+        Gradebook.refresh(
+            Grade.objects.filter(exam=instance).values_list('student_id', 'course_id')
+        )
+
+
+# -------------------------------
+# Attendance rollups
+# -------------------------------
+@receiver(pre_save, sender=Attendance)
+def remember_attendance_key(sender, instance, **kwargs):
+    instance._old_key = None
+    if instance.pk:
+        instance._old_key = (
+            Attendance.objects.filter(pk=instance.pk)
+            .values_list('student_id', 'course_id', 'date')
+            .first()
+        )
+
+
+@receiver(post_save, sender=Attendance)
+@receiver(post_delete, sender=Attendance)
+def refresh_attendance_rollups(sender, instance, **kwargs):
+    keys = {(instance.student_id, instance.course_id, instance.date)}
+    if getattr(instance, '_old_key', None):
+        keys.add(instance._old_key)
+    AttendanceSummary.refresh({(student_id, course_id) for student_id, course_id, _ in keys})
+    CourseAttendanceDay.refresh({(course_id, date) for _, course_id, date in keys})
+
+
+# -------------------------------
+# Cached roles
+# -------------------------------
+def refresh_role_flags(user_ids):
+    CustomerUser.objects.filter(pk__in=user_ids).update(
+        is_teacher=Exists(Group.objects.filter(name='teacher', user=OuterRef('pk'))),
+        is_student=Exists(Group.objects.filter(name='student', user=OuterRef('pk'))),
+    )
+
+
+@receiver(m2m_changed, sender=CustomerUser.groups.through)
+def sync_role_flags(sender, instance, action, reverse, pk_set, **kwargs):
+    # is_teacher/is_student mirror the 'teacher'/'student' groups so role
+    # checks read the already-loaded user row instead of querying groups
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        # group.user_set changed; post_clear carries no pk_set, so resync
+        # everyone who could have been affected
+        user_ids = pk_set if pk_set is not None else CustomerUser.objects.values('pk')
+    else:
+        user_ids = [instance.pk]
+
+    refresh_role_flags(user_ids)
+    if not reverse:
+        instance.refresh_from_db(fields=['is_teacher', 'is_student'])
+
+
+@receiver(pre_delete, sender=Group)
+def remember_group_members(sender, instance, **kwargs):
+    # the memberships are gone by post_delete
+    instance._member_ids = list(instance.user_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def sync_group_role_flags(sender, instance, created=False, **kwargs):
+    # renaming or deleting the 'teacher'/'student' group changes every
+    # member's role without an m2m_changed
+    if created:
+        return
+    member_ids = getattr(instance, '_member_ids', None)
+    if member_ids is None:
+        member_ids = instance.user_set.values('pk')
+    refresh_role_flags(member_ids)
+
+
+# -------------------------------
+# Student search index
+# -------------------------------
+@receiver(post_save, sender=Student)
+def index_student(sender, instance, **kwargs):
+    search.index_students([instance.pk])
+
+
+@receiver(post_delete, sender=Student)
+def unindex_student(sender, instance, **kwargs):
+    search.remove_students([instance.pk])
+
+
+@receiver(m2m_changed, sender=Student.courses.through)
+def index_enrollments(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        # course.student_set.clear() sends no ids afterwards; remember them
+        instance._cleared_student_ids = list(instance.student_set.values_list('pk', flat=True))
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        search.index_students([instance.pk])
+    elif action == 'post_clear':
+        search.index_students(getattr(instance, '_cleared_student_ids', []))
+    else:
+        search.index_students(pk_set)
+
+
+@receiver(post_save, sender=Course)
+def index_course_students(sender, instance, created, **kwargs):
+    if not created:
+        search.index_students(instance.student_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Department)
+def index_department_students(sender, instance, created, **kwargs):
+    if not created:
+        search.index_students(instance.student_set.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Course)
+@receiver(pre_delete, sender=Department)
+def remember_indexed_students(sender, instance, **kwargs):
+    # enrollments/department links are gone by post_delete
+    instance._indexed_student_ids = list(instance.student_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Course)
+@receiver(post_delete, sender=Department)
+def reindex_students(sender, instance, **kwargs):
+    search.index_students(getattr(instance, '_indexed_student_ids', []))
+
+
+# -------------------------------
+# Teacher dashboard cache
+# -------------------------------
+def _student_course_ids(student):
+    return list(student.courses.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Student)
+def expire_student_dashboards(sender, instance, created, **kwargs):
+    if not created:
+        caching.bump_course_teachers(_student_course_ids(instance))
+
+
+@receiver(pre_delete, sender=Student)
+def expire_deleted_student_dashboards(sender, instance, **kwargs):
+    caching.bump_course_teachers(_student_course_ids(instance))
+
+
+@receiver(m2m_changed, sender=Student.courses.through)
+def expire_enrollment_dashboards(sender, instance, action, reverse, pk_set, **kwargs):
+    # the student side: student_dashboard lists the student's courses
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        if not reverse:
+            caching.bump('student', [instance.pk])
+        elif action == 'post_clear':
+            caching.bump('student', getattr(instance, '_cleared_student_ids', []))
+        else:
+            caching.bump('student', pk_set)
+
+    # the teacher side
+    if reverse:
+        # course.student_set changed: only that course's teacher is affected
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            caching.bump('teacher', [instance.teacher_id])
+    elif action == 'pre_clear':
+        caching.bump_course_teachers(_student_course_ids(instance))
+    elif action in ('post_add', 'post_remove'):
+        caching.bump_course_teachers(pk_set)
+
+
+@receiver(pre_save, sender=Course)
+def remember_course_teacher(sender, instance, **kwargs):
+    instance._old_teacher_id = None
+    if instance.pk:
+        instance._old_teacher_id = (
+            Course.objects.filter(pk=instance.pk).values_list('teacher_id', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+def expire_course_dashboards(sender, instance, **kwargs):
+    caching.bump('teacher', [instance.teacher_id, getattr(instance, '_old_teacher_id', None)])
+    # course names show on the students' pages too; after a delete the
+    # enrollments are gone, so use the ids the search index remembered
+    student_ids = getattr(instance, '_indexed_student_ids', None)
+    if student_ids is None:
+        student_ids = instance.student_set.values_list('pk', flat=True)
+    caching.bump('student', student_ids)
+
+
+@receiver(post_save, sender=Department)
+@receiver(post_delete, sender=Department)
+def expire_department_dashboards(sender, instance, **kwargs):
+    # department names show on every roster row
+    caching.bump('teacher', ['all'])
+
+
+# -------------------------------
+# Conditional GET validators
+# -------------------------------
+# StudentDetail's validator is the student's updated_at, so it moves forward
+# when the courses or department shown with the student change. The
+# attendance_list validator is the 'attendance' version, bumped for the rows
+# and for the student and course names shown on them.
+@receiver(m2m_changed, sender=Student.courses.through)
+def touch_enrolled_students(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        Student.touch([instance.pk])
+    elif action == 'post_clear':
+        Student.touch(getattr(instance, '_cleared_student_ids', []))
+    else:
+        Student.touch(pk_set)
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_save, sender=Department)
+def touch_course_students(sender, instance, created, **kwargs):
+    if not created:
+        Student.touch(instance.student_set.values('pk'))
+
+
+@receiver(post_delete, sender=Course)
+@receiver(post_delete, sender=Department)
+def touch_orphaned_students(sender, instance, **kwargs):
+    # remembered by remember_indexed_students
+    Student.touch(getattr(instance, '_indexed_student_ids', []))
+
+
+@receiver(post_save, sender=Attendance)
+@receiver(post_delete, sender=Attendance)
+@receiver(post_save, sender=Student)
+@receiver(post_delete, sender=Student)
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+def expire_attendance_list(sender, **kwargs):
+    caching.bump('attendance', ['all'])
+
+
+# -------------------------------
+# Permission cache
+# -------------------------------
+@receiver(m2m_changed, sender=CustomerUser.groups.through)
+@receiver(m2m_changed, sender=CustomerUser.user_permissions.through)
+def expire_user_permissions(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        caching.bump('permissions', [instance.pk])
+    elif pk_set is not None:
+        caching.bump('permissions', pk_set)
+    else:
+        # group.user_set.clear() or permission.user_set.clear()
+        caching.bump('permissions', ['all'])
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def expire_group_permissions(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        caching.bump('permissions', ['all'])
+
+
+@receiver(post_delete, sender=Group)
+@receiver(post_delete, sender=Permission)
+def expire_deleted_permissions(sender, **kwargs):
+    caching.bump('permissions', ['all'])
+
+
+@receiver(post_save, sender=CustomerUser)
+def expire_saved_user_permissions(sender, instance, update_fields, **kwargs):
+    # is_active and is_superuser change the permission set; logins only
+    # touch last_login
+    if update_fields is None or set(update_fields) != {'last_login'}:
+        caching.bump('permissions', [instance.pk])
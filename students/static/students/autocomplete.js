@@ -0,0 +1,55 @@
+// Turns <select data-autocomplete="url"> into a search box plus a short
+// select: typing fetches up to 20 matches from the JSON endpoint and puts
+// them in the select, which is still what the form submits. When the form
+// has a course picker, matches are limited to that course.
+(function () {
+    function attach(select) {
+        const search = document.createElement("input");
+        search.type = "search";
+        search.placeholder = "Type to search...";
+        search.autocomplete = "off";
+        select.parentNode.insertBefore(search, select);
+
+        const course = select.form && select.form.elements["course"];
+        let timer = null;
+        let latest = 0;
+
+        function load() {
+            const params = new URLSearchParams({q: search.value});
+            if (course && course.value) {
+                params.set("course", course.value);
+            }
+            const request = ++latest;
+            fetch(select.dataset.autocomplete + "?" + params, {credentials: "same-origin"})
+                .then(function (response) { return response.json(); })
+                .then(function (data) {
+                    // an older, slower response must not replace a newer one
+                    if (request !== latest) {
+                        return;
+                    }
+                    const selected = select.value;
+                    select.replaceChildren(new Option("---------", ""));
+                    data.results.forEach(function (result) {
+                        const option = new Option(result.text, result.id, false, String(result.id) === selected);
+                        if (result.max_score !== undefined) {
+                            option.dataset.maxScore = result.max_score;
+                        }
+                        select.add(option);
+                    });
+                    select.dispatchEvent(new Event("change"));
+                });
+        }
+
+        search.addEventListener("input", function () {
+            clearTimeout(timer);
+            timer = setTimeout(load, 200);
+        });
+        if (course) {
+            course.addEventListener("change", load);
+        }
+    }
+
+    document.addEventListener("DOMContentLoaded", function () {
+        document.querySelectorAll("select[data-autocomplete]").forEach(attach);
+    });
+})();
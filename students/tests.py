@@ -1,3 +1,1241 @@
-from django.test import TestCase
+import io
+import json
+import os
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from importlib import import_module
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import Group, Permission
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import benchmark, concurrency, exports, jobs, metrics, reports, search
+from .forms import GradeGridForm
+from .middleware import QueryBudgetExceeded, QueryBudgetMiddleware
+from .models import (Attendance, AttendanceSummary, Course, CourseAttendanceDay, CustomerUser, Department, Exam, Grade,
+                     Gradebook, Job, Student, Teacher)
+from .pagination import KeysetPaginator, encode_cursor
+from .routers import ReplicaRouter, replica_reads
 
 # Create your tests here.
+
+
+# the hashed static names need a collectstatic manifest; StaticBundleTests
+# builds one
+PLAIN_STATIC = {**settings.STORAGES, 'staticfiles': {
+    'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+}}
+
+
+# reads on other connections cannot see the test's uncommitted data
+@override_settings(ASYNC_PARALLEL_QUERIES=False, STORAGES=PLAIN_STATIC)
+class SchoolTestCase(TestCase):
+    # a small school: one teacher with one course, six enrolled students
+    # with attendance and grades, one of whom can log in, and an admin
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.department = Department.objects.create(name='Science')
+
+        cls.teacher_user = CustomerUser.objects.create_user('teacher', password='password')
+        cls.teacher_user.groups.add(Group.objects.create(name='teacher'))
+        cls.teacher = Teacher.objects.create(user=cls.teacher_user, name='Teacher')
+        cls.course = Course.objects.create(course_name='Physics', course_code='PHY1',
+                                           department=cls.department, credits=3, teacher=cls.teacher)
+        exams = [Exam.objects.create(name=name, course=cls.course) for name in ('quiz', 'midterm')]
+
+        student_group = Group.objects.create(name='student')
+        cls.students = []
+        for i in range(6):
+            user = CustomerUser.objects.create_user(f'student{i}', password='password')
+            user.groups.add(student_group)
+            student = Student.objects.create(name=f'Student {i}', department=cls.department, user=user)
+            student.courses.add(cls.course)
+            Attendance.objects.create(student=student, course=cls.course, status='present')
+            for exam in exams:
+                Grade.objects.create(student=student, exam=exam, course=cls.course, score=5)
+            cls.students.append(student)
+        cls.student = cls.students[0]
+
+        cls.admin = CustomerUser.objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def setUp(self):
+        # cached fragments outlive the per-test rollback, and ids get reused
+        cache.clear()
+
+    def get(self, user, name, query='', **kwargs):
+        self.client.force_login(user)
+        return self.client.get(reverse(name, kwargs=kwargs or None) + query, secure=True)
+
+
+@override_settings(QUERY_BUDGET_RAISE=True)
+class QueryBudgetTests(SchoolTestCase):
+
+    def test_views_stay_within_their_query_budgets(self):
+        views = [
+            (self.teacher_user, 'role_redirect', '', {}),
+            (self.admin, 'student_list', '', {}),
+            (self.admin, 'student_list', '?q=stud', {}),
+            (self.admin, 'student_detail', '', {'pk': self.student.pk}),
+            (self.teacher_user, 'teacher_dashboard', '', {}),
+            (self.student.user, 'student_dashboard', '', {}),
+            (self.teacher_user, 'roster_attendance', f'?course={self.course.pk}', {}),
+            (self.teacher_user, 'attendance_list', '', {}),
+            (self.student.user, 'my_attendance', '', {}),
+            (self.teacher_user, 'grade_grid', f'?course={self.course.pk}', {}),
+            (self.student.user, 'my_grades', '', {}),
+            (self.teacher_user, 'grade_list', '', {}),
+            (self.teacher_user, 'autocomplete', '?q=stu', {'kind': 'students'}),
+            (self.teacher_user, 'job_status', '', {'pk': jobs.enqueue('export', user=self.teacher_user, kind='grades').pk}),
+        ]
+        for user, name, query, kwargs in views:
+            with self.subTest(name=name, query=query):
+                response = self.get(user, name, query, **kwargs)
+                self.assertIn(response.status_code, (200, 302))
+
+    @override_settings(QUERY_BUDGETS={'teacher_dashboard': 1})
+    def test_going_over_budget_fails(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            self.get(self.teacher_user, 'teacher_dashboard')
+
+    @override_settings(QUERY_REPEAT_THRESHOLD=3)
+    def test_repeated_query_shape_fails(self):
+        def n_plus_one(request):
+            for student in Student.objects.all()[:3]:
+                student.department.name
+            return HttpResponse()
+
+        with self.assertRaises(QueryBudgetExceeded):
+            QueryBudgetMiddleware(n_plus_one)(RequestFactory().get('/'))
+
+    @override_settings(ASYNC_PARALLEL_QUERIES=True)
+    def test_queries_on_pool_threads_are_counted(self):
+        def select_one():
+            # no tables: the test's in-memory database is locked to other threads
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+
+        async def view(request):
+            await concurrency.gather(select_one, select_one)
+            return HttpResponse()
+
+        request = RequestFactory().get('/')
+        async_to_sync(QueryBudgetMiddleware(view))(request)
+        self.assertEqual(request.query_stats['queries'], 2)
+
+    @override_settings(QUERY_BUDGET_RAISE=False, QUERY_BUDGETS={'teacher_dashboard': 1})
+    def test_going_over_budget_logs_outside_tests(self):
+        with self.assertLogs('students.queries', 'WARNING') as logs:
+            response = self.get(self.teacher_user, 'teacher_dashboard')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('budget is 1', logs.output[0])
+
+
+class RosterAttendanceTests(SchoolTestCase):
+
+    def post(self, statuses):
+        self.client.force_login(self.teacher_user)
+        data = {f'status_{student.pk}': statuses.get(student, 'present') for student in self.course.student_set.all()}
+        return self.client.post(reverse('roster_attendance') + f'?course={self.course.pk}', data, secure=True)
+
+    def test_whole_roster_is_marked_and_remarked_in_place(self):
+        late = Student.objects.create(name='Late Enrolment')
+        late.courses.add(self.course)
+        response = self.get(self.teacher_user, 'roster_attendance', f'?course={self.course.pk}')
+        self.assertEqual(len([name for name in response.context['form'].fields if name.startswith('status_')]), 7)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post({self.student: 'absent', late: 'absent'})
+        self.assertRedirects(response, reverse('attendance_list'), fetch_redirect_response=False)
+        inserts = [query for query in queries.captured_queries if query['sql'].startswith('INSERT INTO "students_attendance"')]
+        self.assertEqual(len(inserts), 1)
+
+        today = Attendance.objects.filter(course=self.course, date=timezone.localdate())
+        self.assertEqual(today.count(), 7)
+        self.assertEqual(set(today.filter(status='absent').values_list('student_id', flat=True)),
+                         {self.student.pk, late.pk})
+
+        # re-submitting the same day updates the rows instead of adding more
+        self.post({late: 'absent'})
+        self.assertEqual(today.count(), 7)
+        self.assertEqual(list(today.filter(status='absent').values_list('student_id', flat=True)), [late.pk])
+        self.assertEqual((AttendanceSummary.objects.get(student=self.student, course=self.course).present,
+                          CourseAttendanceDay.objects.get(course=self.course, date=timezone.localdate()).absent),
+                         (1, 1))
+
+    def test_only_the_teachers_courses(self):
+        other = Course.objects.create(course_name='Art', course_code='ART1', department=self.department, credits=2)
+        response = self.get(self.teacher_user, 'roster_attendance', f'?course={other.pk}')
+        self.assertIsNone(response.context['form'])
+        self.assertTrue(response.context['course_form'].has_error('course'))
+
+
+class GradebookTests(SchoolTestCase):
+
+    def row(self, student=None, course=None):
+        return Gradebook.objects.filter(student=student or self.student, course=course or self.course).first()
+
+    def test_rows_follow_grade_writes(self):
+        self.assertEqual((self.row().quiz, self.row().midterm, self.row().total), (5, 5, 10))
+
+        final = Exam.objects.create(name='final', course=self.course)
+        grade = Grade.objects.create(student=self.student, exam=final, course=self.course, score=40)
+        self.assertEqual((self.row().final, self.row().total, self.row().percentage), (40, 50, 50))
+
+        grade.score = 30
+        grade.save()
+        self.assertEqual(self.row().total, 40)
+
+        # moving a grade to another course recomputes both rows
+        other = Course.objects.create(course_name='Art', course_code='ART1', department=self.department, credits=2)
+        grade.course = other
+        grade.save()
+        self.assertEqual((self.row().final, self.row().total), (None, 10))
+        self.assertEqual(self.row(course=other).final, 30)
+
+        grade.delete()
+        self.assertIsNone(self.row(course=other))
+        # another student's row is untouched throughout
+        self.assertEqual(self.row(student=self.students[1]).total, 10)
+
+    def test_rebuild_and_verify(self):
+        Gradebook.objects.filter(student=self.student).delete()
+        Gradebook.objects.filter(student=self.students[1]).update(total=99)
+        output = io.StringIO()
+        with self.assertRaisesMessage(CommandError, '2 gradebook rows are out of date'):
+            call_command('rebuild_gradebook', verify=True, stdout=output)
+        self.assertIn(f'missing: student {self.student.pk}, course {self.course.pk}', output.getvalue())
+
+        call_command('rebuild_gradebook', stdout=output)
+        self.assertEqual(self.row(student=self.students[1]).total, 10)
+        call_command('rebuild_gradebook', verify=True, stdout=output)
+        self.assertIn('All 6 gradebook rows match.', output.getvalue())
+
+
+class GradePivotTests(SchoolTestCase):
+
+    def test_pivot_sums_each_kind_in_one_query(self):
+        lab = Exam.objects.create(name='Lab', course=self.course)
+        test = Exam.objects.create(name='Test', course=self.course)
+        for exam, score in ((lab, 70), (test, 12)):
+            Grade.objects.create(student=self.student, exam=exam, course=self.course, score=score)
+        # grades without a course have no gradebook row
+        Grade.objects.create(student=self.student, exam=test, score=3)
+
+        with CaptureQueriesContext(connection) as queries:
+            rows = list(Gradebook.pivot(Grade.objects.filter(student=self.student)))
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(rows, [{'student_id': self.student.pk, 'course_id': self.course.pk,
+                                 'quiz': 5, 'test': 12, 'midterm': 5, 'final': None, 'total': 22}])
+
+    def test_grade_list_pages_the_teachers_rows(self):
+        other = Course.objects.create(course_name='Art', course_code='ART1', department=self.department, credits=2)
+        students = Student.objects.bulk_create(Student(name=f'Pupil {i:02}') for i in range(50))
+        Gradebook.objects.bulk_create(Gradebook(student=student, course=self.course, total=i)
+                                      for i, student in enumerate(students))
+        Gradebook.objects.create(student=self.student, course=other, total=1)
+
+        response = self.get(self.teacher_user, 'grade_list')
+        page = response.context['page_obj']
+        self.assertEqual((page.paginator.count, len(page)), (56, 50))
+        self.assertEqual(page[0]['student__name'], 'Pupil 00')
+        page = self.get(self.teacher_user, 'grade_list', f'?course={self.course.pk}&page=2').context['page_obj']
+        self.assertEqual([row['student__name'] for row in page], [f'Student {i}' for i in range(6)])
+        self.assertEqual(self.get(self.teacher_user, 'grade_list', f'?course={other.pk}').context['page_obj']
+                         .paginator.count, 0)
+
+
+class RoleFlagTests(SchoolTestCase):
+
+    def test_flags_follow_group_membership(self):
+        self.assertEqual((self.teacher_user.is_teacher, self.student.user.is_student), (True, True))
+        user = CustomerUser.objects.create_user('both', password='password')
+        teacher_group, student_group = Group.objects.get(name='teacher'), Group.objects.get(name='student')
+
+        user.groups.add(teacher_group, student_group)
+        self.assertEqual((user.is_teacher, user.is_student), (True, True))
+        user.groups.remove(teacher_group)
+        self.assertEqual((user.is_teacher, user.is_student), (False, True))
+
+        # from the group's side
+        teacher_group.user_set.add(user)
+        student_group.user_set.clear()
+        user.refresh_from_db()
+        self.assertEqual((user.is_teacher, user.is_student), (True, False))
+        self.assertFalse(CustomerUser.objects.get(pk=self.student.user.pk).is_student)
+
+    def test_flags_follow_renamed_and_deleted_groups(self):
+        teacher_group, student_group = Group.objects.get(name='teacher'), Group.objects.get(name='student')
+        teacher_group.name = 'former teachers'
+        teacher_group.save()
+        self.teacher_user.refresh_from_db()
+        self.assertFalse(self.teacher_user.is_teacher)
+
+        student_group.name = 'teacher'
+        student_group.save()
+        self.student.user.refresh_from_db()
+        self.assertEqual((self.student.user.is_teacher, self.student.user.is_student), (True, False))
+
+        student_group.delete()
+        self.assertFalse(CustomerUser.objects.filter(is_teacher=True).exists())
+        self.client.force_login(self.student.user)
+        self.assertEqual(self.client.get(reverse('student_dashboard'), secure=True).status_code, 302)
+
+    def test_role_checks_do_not_query_groups(self):
+        for user, target in ((self.teacher_user, 'teacher_dashboard'), (self.student.user, 'student_dashboard'),
+                             (self.admin, 'admin:index')):
+            self.client.force_login(user)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse('role_redirect'), secure=True)
+            self.assertRedirects(response, reverse(target), fetch_redirect_response=False)
+            self.assertFalse([query for query in queries.captured_queries if 'auth_group' in query['sql']])
+
+
+class AttendanceRollupTests(SchoolTestCase):
+
+    def counts(self, student=None):
+        summary = AttendanceSummary.objects.get(student=student or self.student, course=self.course)
+        return summary.present, summary.absent
+
+    def day(self, date):
+        day = CourseAttendanceDay.objects.filter(course=self.course, date=date).first()
+        return day and (day.present, day.absent)
+
+    def test_rollups_follow_attendance_writes(self):
+        today = timezone.localdate()
+        yesterday = today - timedelta(days=1)
+        self.assertEqual((self.counts(), self.day(today)), ((1, 0), (6, 0)))
+
+        record = Attendance.objects.create(student=self.student, course=self.course, date=yesterday, status='absent')
+        self.assertEqual((self.counts(), self.day(yesterday)), ((1, 1), (0, 1)))
+        record.status = 'present'
+        record.save()
+        self.assertEqual((self.counts(), self.day(yesterday)), ((2, 0), (1, 0)))
+        self.assertEqual(AttendanceSummary.objects.get(student=self.student, course=self.course).rate, 100.0)
+
+        record.delete()
+        self.assertEqual((self.counts(), self.day(yesterday)), ((1, 0), None))
+        self.assertEqual(self.counts(self.students[1]), (1, 0))
+
+    def test_rebuild_verify_and_backfill(self):
+        AttendanceSummary.objects.filter(student=self.student).update(absent=3)
+        CourseAttendanceDay.objects.all().delete()
+        output = io.StringIO()
+        with self.assertRaisesMessage(CommandError, '2 attendance rollup rows are out of date'):
+            call_command('rebuild_attendance', verify=True, stdout=output)
+
+        call_command('rebuild_attendance', stdout=output)
+        self.assertEqual((self.counts(), self.day(timezone.localdate())), ((1, 0), (6, 0)))
+        call_command('rebuild_attendance', verify=True, stdout=output)
+
+        AttendanceSummary.objects.all().delete()
+        CourseAttendanceDay.objects.all().delete()
+        import_module('students.migrations.0017_attendance_rollups').backfill_rollups(apps, None)
+        self.assertEqual((AttendanceSummary.objects.count(), self.day(timezone.localdate())), (6, (6, 0)))
+
+
+class GradeGridCsvTests(SchoolTestCase):
+
+    def form(self, text=None, upload=None):
+        exams = Exam.objects.filter(course=self.course).order_by('id')
+        files = {'csv_file': SimpleUploadedFile('grades.csv', upload)} if upload is not None else {}
+        return GradeGridForm({'csv_text': text or ''}, files, students=self.students, exams=exams)
+
+    def test_csv_fills_in_the_grid(self):
+        form = self.form(upload=f'student,Quiz,midterm\n{self.student.pk},4,\n'.encode('utf-8-sig'))
+        self.assertTrue(form.is_valid(), form.errors)
+        quiz, midterm = Exam.objects.filter(course=self.course).order_by('id')
+        self.assertEqual(form.scores()[(self.student.pk, quiz.pk)], 4)
+        self.assertNotIn((self.student.pk, midterm.pk), form.scores())
+
+    def test_bad_csv_is_a_form_error(self):
+        stranger = Student.objects.create(name='Stranger')
+        for text, error in [
+            ('student,final\n1,4', 'Unknown exam column "final"'),
+            (f'student,quiz\n{stranger.pk},4', f'Line 2: student {stranger.pk} is not enrolled in this course'),
+            (f'student,midterm\n{self.student.pk},26', 'Line 2: midterm score must be between 0 and 25'),
+            (f'student,quiz\n{self.student.pk},-1', 'score must be between 0 and'),
+        ]:
+            form = self.form(text)
+            self.assertFalse(form.is_valid())
+            self.assertIn(error, form.non_field_errors()[0])
+
+    def test_uploads_must_be_utf8(self):
+        form = self.form(upload='student,quiz\n1,4 \xe9\n'.encode('latin-1'))
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.non_field_errors(), ['CSV must be UTF-8'])
+
+
+class StudentSearchTests(SchoolTestCase):
+
+    def test_index_follows_students_courses_and_departments(self):
+        student = Student.objects.create(name='Ada Lovelace', department=self.department)
+        self.assertEqual(search.search_students('lovelace'), [student.pk])
+
+        student.name = 'Ada King'
+        student.save()
+        self.assertEqual(search.search_students('lovelace'), [])
+        self.assertEqual(search.search_students('King'), [student.pk])
+
+        student.courses.add(self.course)
+        self.course.course_name = 'Astronomy'
+        self.course.save()
+        self.assertIn(student.pk, search.search_students('astro'))
+        self.department.name = 'Natural Philosophy'
+        self.department.save()
+        self.assertEqual(len(search.search_students('philosophy')), 7)
+
+        self.course.student_set.clear()
+        self.assertEqual(search.search_students('astro'), [])
+        student.delete()
+        self.assertEqual(search.search_students('king'), [])
+
+    def test_every_match_is_returned(self):
+        Student.objects.bulk_create(Student(name=f'Pupil {i}') for i in range(30))
+        search.rebuild()
+        self.assertEqual(len(search.search_students('pupil')), 30)
+        self.assertEqual(len(search.search_students('pu')), 30)
+
+        response = self.get(self.admin, 'student_list', '?q=pupil&count=1')
+        self.assertContains(response, '30 students')
+
+    def test_short_terms_must_each_match(self):
+        al = Student.objects.create(name='Al Johnson', department=self.department)
+        Student.objects.create(name='Al Smith')
+        self.assertEqual(search.search_students('Al Johnson'), [al.pk])
+        self.assertEqual(search.search_students('al sci'), [al.pk])
+        self.assertEqual(len(search.search_students('al ')), 2)
+        self.assertEqual(search.search_students('al xy'), [])
+
+
+class KeysetPaginationTests(SchoolTestCase):
+
+    def setUp(self):
+        super().setUp()
+        today = timezone.localdate()
+        Attendance.objects.bulk_create(
+            Attendance(student=student, course=self.course, date=today - timedelta(days=day), status='absent')
+            for student in self.students for day in range(1, 20)
+        )
+
+    def pages(self, user, name, query):
+        # follow the Next links, then walk back with Previous
+        forward, cursor = [], None
+        while True:
+            page = self.get(user, name, query + (f'&cursor={cursor}' if cursor else '')).context['page_obj']
+            forward.append([row.pk for row in page])
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        backward = []
+        while page.has_previous:
+            page = self.get(user, name, f'{query}&cursor={page.previous_cursor}').context['page_obj']
+            backward.insert(0, [row.pk for row in page])
+        return forward, backward
+
+    def test_attendance_pages_cover_every_row_once(self):
+        forward, backward = self.pages(self.teacher_user, 'attendance_list', '?')
+        self.assertEqual([len(page) for page in forward], [50, 50, 20])
+        self.assertEqual(backward, forward[:-1])
+        expected = Attendance.objects.order_by('-date', 'id').values_list('pk', flat=True)
+        self.assertEqual(sum(forward, []), list(expected))
+
+    def test_search_results_page_by_position(self):
+        forward, backward = self.pages(self.admin, 'student_list', '?q=student')
+        self.assertEqual(sum(forward, []), search.search_students('student'))
+        self.assertEqual(backward, forward[:-1])
+
+    def test_tampered_cursors_start_at_page_one(self):
+        first = self.get(self.teacher_user, 'attendance_list').context['page_obj']
+        for key in (['2024/01/01', 1], ['2024-01-01', 'x'], [None, 1], ['2024-01-01'], 'x'):
+            cursor = encode_cursor('next', key)
+            response = self.get(self.teacher_user, 'attendance_list', f'?cursor={cursor}')
+            self.assertEqual([row.pk for row in response.context['page_obj']], [row.pk for row in first])
+        response = self.get(self.admin, 'student_list', f"?q=student&cursor={encode_cursor('next', [-3])}")
+        self.assertEqual(len(response.context['page_obj']), 5)
+
+    def test_count_is_kept_across_pages(self):
+        response = self.get(self.teacher_user, 'attendance_list', '?count=1')
+        self.assertContains(response, '120 records')
+        self.assertContains(response, f"cursor={response.context['page_obj'].next_cursor}&count=1")
+
+
+class ExportTests(SchoolTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        # another teacher's course, a week back
+        other = Course.objects.create(course_name='Art', course_code='ART1', department=cls.department, credits=2)
+        Attendance.objects.create(student=cls.student, course=other, status='absent')
+        Attendance.objects.filter(course=other).update(date=timezone.localdate() - timedelta(days=7))
+
+    def export(self, user, kind, query=''):
+        response = self.get(user, 'export_data', query, kind=kind)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_csv_and_jsonl(self):
+        response, body = self.export(self.admin, 'attendance')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = body.splitlines()
+        self.assertEqual(lines[0].split(','), exports.EXPORTS['attendance']['fields'])
+        self.assertEqual(len(lines), 8)
+
+        response, body = self.export(self.admin, 'grades', '?format=jsonl')
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(len(rows), 12)
+        self.assertEqual((rows[0]['course__course_code'], rows[0]['score']), ('PHY1', 5.0))
+
+    def test_filters_and_teacher_scope(self):
+        week_ago = (timezone.localdate() - timedelta(days=7)).isoformat()
+        self.assertEqual(len(self.export(self.admin, 'attendance', f'?end={week_ago}')[1].splitlines()), 2)
+        self.assertEqual(len(self.export(self.admin, 'attendance', f'?course={self.course.pk}')[1].splitlines()), 7)
+        # teachers only get their own courses
+        self.assertEqual(len(self.export(self.teacher_user, 'attendance')[1].splitlines()), 7)
+
+        self.assertEqual(self.get(self.admin, 'export_data', '?start=soon', kind='attendance').status_code, 400)
+        self.assertEqual(self.get(self.admin, 'export_data', '?format=xml', kind='grades').status_code, 400)
+        self.assertEqual(self.get(self.admin, 'export_data', kind='teachers').status_code, 404)
+
+    def test_command(self):
+        with tempfile.NamedTemporaryFile('r', suffix='.csv') as output:
+            call_command('export_data', 'attendance', output=output.name, start=timezone.localdate().isoformat(),
+                         stderr=io.StringIO())
+            self.assertEqual(len(output.readlines()), 7)
+        with self.assertRaisesMessage(CommandError, "'2024/01/01' is not a date"):
+            call_command('export_data', 'attendance', '--start', '2024/01/01')
+
+
+class ImportTests(SchoolTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def run_import(self, kind, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as handle:
+            handle.write(content)
+        output = io.StringIO()
+        call_command('import_school', kind, path, batch_size=2, stdout=output)
+        with open(f'{path}.rejects.jsonl') as rejects:
+            return output.getvalue(), [json.loads(line) for line in rejects]
+
+    def test_courses_students_and_enrollments(self):
+        output, rejects = self.run_import('courses', 'courses.csv', (
+            'course_name,course_code,department,credits,teacher\n'
+            'Chemistry,CHE1,Science,4,Teacher\n'
+            'Poetry,POE1,Humanities,2,\n'
+            'Painting,PAI1,Arts,x,\n'
+            'Physics again,PHY1,Science,3,\n'
+            'Poetry again,POE1,Humanities,2,\n'
+        ))
+        self.assertIn('Imported 2 courses.', output)
+        self.assertEqual([(reject['line'], reject['error']) for reject in rejects], [
+            (4, 'credits "x" is not a whole number'),
+            (5, 'course code "PHY1" already exists'),
+            (6, 'course code "POE1" already exists'),
+        ])
+        # the rejected row's department was never created
+        self.assertEqual(sorted(Department.objects.values_list('name', flat=True)), ['Humanities', 'Science'])
+        self.assertEqual(Course.objects.get(course_code='CHE1').teacher, self.teacher)
+
+        output, rejects = self.run_import('students', 'students.jsonl', (
+            '{"name": "Ada", "email": "ada@example.com", "department": "Maths", "courses": "CHE1;POE1"}\n'
+            '{"name": "Bob", "department": "Drama", "courses": ["XYZ1"]}\n'
+            'not json\n'
+        ))
+        self.assertIn('Imported 1 students.', output)
+        self.assertEqual([reject['error'] for reject in rejects],
+                         ['unknown course code(s): XYZ1', 'not a JSON object'])
+        self.assertFalse(Department.objects.filter(name='Drama').exists())
+        ada = Student.objects.get(name='Ada')
+        self.assertEqual(ada.department.name, 'Maths')
+        self.assertEqual(search.search_students('ada'), [ada.pk])
+
+        output, rejects = self.run_import('enrollments', 'enrollments.csv', (
+            f'student,course\n{ada.pk},PHY1\n{ada.pk},CHE1\n999999,PHY1\n'
+        ))
+        self.assertEqual([reject['error'] for reject in rejects], ['unknown student 999999'])
+        self.assertEqual(sorted(ada.courses.values_list('course_code', flat=True)), ['CHE1', 'PHY1', 'POE1'])
+
+    def test_rows_the_database_refuses_are_rejected_alone(self):
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE TRIGGER refuse_bad1 BEFORE INSERT ON students_course WHEN NEW.course_code = 'BAD1' "
+                           "BEGIN SELECT RAISE(ABORT, 'course refused'); END")
+        output, rejects = self.run_import('courses', 'courses.csv', (
+            'course_name,course_code,department,credits,teacher\n'
+            'Chemistry,CHE1,Science,4,\n'
+            'Bad,BAD1,Occult,1,\n'
+            'Alchemy,ALC1,Occult,2,\n'
+            'Bad again,BAD1,Science,1,\n'
+        ))
+        self.assertIn('Imported 2 courses.', output)
+        self.assertEqual([(reject['line'], reject['error'], reject['row']['course_code']) for reject in rejects],
+                         [(3, 'course refused', 'BAD1'), (5, 'course refused', 'BAD1')])
+        # the refused row's new department came with the next row that used it
+        self.assertEqual(Course.objects.get(course_code='ALC1').department.name, 'Occult')
+        self.assertEqual(Department.objects.filter(name='Occult').count(), 1)
+        self.assertFalse(Course.objects.filter(course_code='BAD1').exists())
+
+
+class ExamKindTests(SchoolTestCase):
+
+    def test_kind_and_max_score_come_from_the_name(self):
+        exam = Exam.objects.create(name='Final', course=self.course)
+        self.assertEqual((exam.kind, exam.max_score), ('final', 50))
+        exam = Exam.objects.create(name='Lab report', course=self.course)
+        self.assertEqual((exam.kind, exam.max_score), ('other', 100))
+
+    def test_changing_the_kind_moves_scores_and_max_score(self):
+        quiz = Exam.objects.get(course=self.course, name='quiz')
+        quiz.kind = 'test'
+        quiz.save()
+        quiz.refresh_from_db()
+        self.assertEqual(quiz.max_score, 15)
+        row = Gradebook.objects.get(student=self.student, course=self.course)
+        self.assertEqual((row.quiz, row.test, row.total), (None, 5, 10))
+
+        # a max score set by hand stays
+        quiz.max_score = 12
+        quiz.save()
+        quiz.kind = 'final'
+        quiz.save()
+        quiz.refresh_from_db()
+        self.assertEqual(quiz.max_score, 12)
+
+        # renaming keeps the kind
+        quiz.name = 'midterm'
+        quiz.save()
+        self.assertEqual(Exam.objects.get(pk=quiz.pk).kind, 'final')
+
+    def test_migration_backfills_kind_and_max_score(self):
+        backfill_kind = import_module('students.migrations.0016_exam_kind').backfill_kind
+        Exam.objects.create(name='Essay', course=self.course)
+        Exam.objects.update(kind='', max_score=100)
+        backfill_kind(apps, None)
+        self.assertEqual(sorted(Exam.objects.values_list('name', 'kind', 'max_score')),
+                         [('Essay', 'other', 100), ('midterm', 'midterm', 25), ('quiz', 'quiz', 10)])
+
+
+class TeacherDashboardTests(SchoolTestCase):
+
+    def test_only_students_in_the_teachers_courses_are_listed(self):
+        other = Teacher.objects.create(name='Other')
+        course = Course.objects.create(course_name='Art', course_code='ART1',
+                                       department=self.department, credits=2, teacher=other)
+        Student.objects.create(name='Not Mine', department=self.department).courses.add(course)
+
+        response = self.get(self.teacher_user, 'teacher_dashboard')
+        self.assertContains(response, 'Student 5 - Science (Physics)')
+        self.assertNotContains(response, 'Not Mine')
+
+    def test_roster_is_cached_until_enrollments_change(self):
+        self.get(self.teacher_user, 'teacher_dashboard')
+        # user and teacher only; the session and roster come from the cache
+        with self.assertNumQueries(2):
+            self.client.get(reverse('teacher_dashboard'), secure=True)
+
+        newcomer = Student.objects.create(name='Newcomer', department=self.department)
+        self.assertNotContains(self.get(self.teacher_user, 'teacher_dashboard'), 'Newcomer')
+        newcomer.courses.add(self.course)
+        self.assertContains(self.get(self.teacher_user, 'teacher_dashboard'), 'Newcomer')
+
+        self.course.student_set.remove(newcomer)
+        self.assertNotContains(self.get(self.teacher_user, 'teacher_dashboard'), 'Newcomer')
+
+        self.department.name = 'Physics Dept'
+        self.department.save()
+        self.assertContains(self.get(self.teacher_user, 'teacher_dashboard'), 'Student 5 - Physics Dept')
+
+
+class StudentPageCacheTests(SchoolTestCase):
+    pages = ['my_grades', 'my_attendance', 'student_dashboard']
+
+    def test_repeat_views_skip_the_grade_and_attendance_tables(self):
+        for name in self.pages:
+            with self.subTest(name=name):
+                self.get(self.student.user, name)
+                with CaptureQueriesContext(connection) as queries:
+                    self.client.get(reverse(name), secure=True)
+                tables = ' '.join(query['sql'] for query in queries.captured_queries)
+                for table in ('students_grade', 'students_gradebook', 'students_attendance'):
+                    self.assertNotIn(f'"{table}"', tables)
+
+    def test_writes_expire_the_students_pages(self):
+        for name in self.pages:
+            self.get(self.student.user, name)
+
+        grade = self.student.grades.get(exam__kind='quiz')
+        grade.score = 9
+        grade.save()
+        self.assertContains(self.get(self.student.user, 'my_grades'), '<td>9.0</td>')
+
+        Attendance.mark_roster(self.course, {self.student.pk: 'absent'})
+        self.assertContains(self.get(self.student.user, 'my_attendance'), 'Absent')
+        self.assertContains(self.get(self.student.user, 'student_dashboard'), '0.0%')
+
+        course = Course.objects.create(course_name='Chemistry', course_code='CHE1',
+                                       department=self.department, credits=3, teacher=self.teacher)
+        self.student.courses.add(course)
+        self.assertContains(self.get(self.student.user, 'student_dashboard'), 'Chemistry')
+
+    def test_hits_and_misses_are_counted(self):
+        registry = metrics.Registry()
+        with mock.patch('students.caching.registry', registry):
+            self.get(self.student.user, 'my_grades')
+            self.get(self.student.user, 'my_grades')
+        body = metrics.render(registry.collect())
+        self.assertIn('school_cache_requests_total{cache="my_grades",result="hit"} 1', body)
+        self.assertIn('school_cache_requests_total{cache="my_grades",result="miss"} 1', body)
+
+
+class SessionAndPermissionCacheTests(SchoolTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.registrars = Group.objects.create(name='registrar')
+        self.registrars.permissions.add(Permission.objects.get(codename='view_student'))
+        self.teacher_user.groups.add(self.registrars)
+
+    def student_list_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('student_list'), secure=True)
+        self.assertEqual(response.status_code, 200)
+        return ' '.join(query['sql'] for query in queries.captured_queries)
+
+    def test_repeat_requests_skip_the_session_and_permission_tables(self):
+        self.get(self.teacher_user, 'student_list')
+        tables = self.student_list_queries()
+        for table in ('django_session', 'auth_permission', 'auth_group'):
+            self.assertNotIn(f'"{table}"', tables)
+
+    def test_sessions_fall_back_to_the_database(self):
+        self.get(self.teacher_user, 'student_list')
+        cache.clear()
+        self.assertIn('"django_session"', self.student_list_queries())
+
+    def test_permission_changes_apply_on_the_next_request(self):
+        self.assertEqual(self.get(self.teacher_user, 'student_list').status_code, 200)
+
+        self.registrars.permissions.clear()
+        self.assertEqual(self.client.get(reverse('student_list'), secure=True).status_code, 403)
+
+        self.teacher_user.user_permissions.add(Permission.objects.get(codename='view_student'))
+        self.assertEqual(self.client.get(reverse('student_list'), secure=True).status_code, 200)
+
+        self.registrars.user_set.remove(self.teacher_user)
+        self.teacher_user.user_permissions.clear()
+        self.assertEqual(self.client.get(reverse('student_list'), secure=True).status_code, 403)
+
+
+class ConditionalGetTests(SchoolTestCase):
+
+    def revalidate(self, name, response, **kwargs):
+        return self.client.get(reverse(name, kwargs=kwargs or None), secure=True,
+                               HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_unchanged_pages_answer_not_modified_without_rendering(self):
+        pages = [
+            (self.admin, 'student_detail', {'pk': self.student.pk}, 2),
+            (self.student.user, 'my_grades', {}, 2),
+            (self.student.user, 'my_attendance', {}, 2),
+            (self.teacher_user, 'attendance_list', {}, 1),
+        ]
+        for user, name, kwargs, queries in pages:
+            with self.subTest(name=name):
+                response = self.get(user, name, **kwargs)
+                self.assertEqual(response.status_code, 200)
+                # user and validator only; attendance_list's is a cache read
+                with self.assertNumQueries(queries):
+                    response = self.revalidate(name, response, **kwargs)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response.content, b'')
+
+    def test_student_detail_changes_with_its_courses(self):
+        response = self.get(self.admin, 'student_detail', pk=self.student.pk)
+        self.assertIn('Last-Modified', response)
+
+        self.course.course_name = 'Mechanics'
+        self.course.save()
+        response = self.revalidate('student_detail', response, pk=self.student.pk)
+        self.assertContains(response, 'Mechanics')
+
+        self.student.courses.clear()
+        response = self.revalidate('student_detail', response, pk=self.student.pk)
+        self.assertNotContains(response, 'Mechanics')
+
+    def test_writes_change_the_validators(self):
+        grades = self.get(self.student.user, 'my_grades')
+        attendance = self.get(self.teacher_user, 'attendance_list')
+
+        Grade.objects.filter(student=self.student).first().delete()
+        self.client.force_login(self.student.user)
+        self.assertEqual(self.revalidate('my_grades', grades).status_code, 200)
+
+        self.client.force_login(self.teacher_user)
+        Attendance.mark_roster(self.course, {self.student.pk: 'absent'})
+        attendance = self.revalidate('attendance_list', attendance)
+        self.assertContains(attendance, 'Absent')
+
+        self.student.name = 'Renamed'
+        self.student.save()
+        self.assertContains(self.revalidate('attendance_list', attendance), 'Renamed')
+
+    def test_etags_are_per_user(self):
+        response = self.get(self.students[0].user, 'my_grades')
+        self.client.force_login(self.students[1].user)
+        self.assertEqual(self.revalidate('my_grades', response).status_code, 200)
+
+
+class JobTests(SchoolTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.output = tempfile.TemporaryDirectory()
+        self.enterContext(self.settings(JOB_OUTPUT_DIR=self.output.name))
+        self.addCleanup(self.output.cleanup)
+
+    def work(self):
+        # inline: the test's data is only visible to this thread's connection
+        call_command('run_jobs', pool='inline', burst=True, stdout=io.StringIO())
+
+    def test_exports_run_in_the_background(self):
+        self.client.force_login(self.teacher_user)
+        response = self.client.post(reverse('export_job', args=['grades']), {'format': 'csv'}, secure=True)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['status'], 'queued')
+
+        self.work()
+        status = self.client.get(response['Location'], secure=True).json()
+        self.assertEqual((status['status'], status['done'], status['percent']), ('done', 12, 100.0))
+
+        download = self.client.get(status['download'], secure=True)
+        self.assertEqual(download['Content-Disposition'], 'attachment; filename="grades.csv"')
+        self.assertEqual(len(b''.join(download.streaming_content).splitlines()), 13)
+
+    def test_failed_jobs_are_retried_with_backoff(self):
+        task = mock.Mock(side_effect=[RuntimeError('flaky'), RuntimeError('flaky'), RuntimeError('flaky')])
+        with mock.patch.dict(jobs.TASKS, {'flaky': task}):
+            job = jobs.enqueue('flaky', max_attempts=2)
+            self.work()
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts), ('queued', 1))
+            self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=settings.JOB_RETRY_BACKOFF - 1))
+
+            self.work()  # not due yet
+            self.assertEqual(task.call_count, 1)
+
+            Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+            self.work()
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts), ('failed', 2))
+            self.assertIn('RuntimeError: flaky', job.error)
+
+    def test_permanent_errors_are_not_retried(self):
+        job = jobs.enqueue('command', name='flush')
+        self.work()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 1))
+
+    def test_jobs_of_dead_workers_are_queued_again(self):
+        job = jobs.enqueue('command', name='rebuild_gradebook')
+        self.assertEqual(jobs.claim('dead'), job.pk)
+        Job.objects.filter(pk=job.pk).update(leased_until=timezone.now() - timedelta(seconds=1))
+        self.assertIsNone(jobs.claim('other'))
+
+        self.work()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('done', 2))
+        self.assertIn('Rebuilt 6 gradebook rows', job.result['output'])
+
+    def test_inline_jobs_keep_their_lease(self):
+        task = mock.Mock(side_effect=lambda progress: time.sleep(0.2))
+        with mock.patch.dict(jobs.TASKS, {'slow': task}), mock.patch.object(jobs, 'renew') as renew, \
+                self.settings(JOB_LEASE=0.15):
+            job = jobs.enqueue('slow')
+            self.work()
+        renew.assert_any_call([job.pk])
+
+    def test_outcomes_need_the_lease(self):
+        def requeued(progress):
+            # what recover() does once the lease has run out
+            Job.objects.filter(pk=progress.job.pk).update(status='queued', leased_until=None)
+            return {'stale': True}
+
+        with mock.patch.dict(jobs.TASKS, {'stale': requeued}):
+            job = jobs.enqueue('stale')
+            with mock.patch.object(jobs, 'claim', side_effect=[job.pk, None]):
+                Job.objects.filter(pk=job.pk).update(status='running', worker='w', attempts=1,
+                                                     leased_until=timezone.now() + timedelta(minutes=1))
+                self.work()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result), ('queued', None))
+
+    def test_jobs_are_private(self):
+        job = jobs.enqueue('command', user=self.teacher_user, name='rebuild_gradebook')
+        self.assertEqual(self.get(self.teacher_user, 'job_status', pk=job.pk).status_code, 200)
+        self.assertEqual(self.get(self.student.user, 'job_status', pk=job.pk).status_code, 404)
+        self.assertEqual(self.get(self.admin, 'job_status', pk=job.pk).status_code, 200)
+
+
+class ReportCardTests(SchoolTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.media = tempfile.TemporaryDirectory()
+        self.enterContext(self.settings(MEDIA_ROOT=self.media.name))
+        self.addCleanup(self.media.cleanup)
+
+    def generate(self, *args, **options):
+        # inline: the test's data is only visible to this thread's connection
+        output = io.StringIO()
+        call_command('generate_report_cards', '2025-fall', *args, workers=0, stdout=output, **options)
+        return output.getvalue()
+
+    def test_department_report_cards(self):
+        output = self.generate(department=self.department.pk)
+        self.assertIn('6/6 students', output)
+
+        run = reports.ReportCards('2025-fall', department=self.department.pk)
+        with open(os.path.join(run.directory, 'manifest.json')) as manifest:
+            summary = json.load(manifest)
+        self.assertEqual((summary['students'], summary['rendered']), (6, 6))
+        self.assertEqual(len(summary['files']), 7)
+        with open(os.path.join(run.directory, 'html', f'{self.student.pk}.html')) as card:
+            self.assertIn('Physics', card.read())
+        with open(os.path.join(run.directory, summary['files'][0])) as rows:
+            self.assertEqual(len(rows.readlines()), 7)
+
+    def test_cards_are_fetched_per_batch(self):
+        ids = [student.pk for student in self.students]
+        with CaptureQueriesContext(connection) as queries:
+            cards = reports.fetch_cards(ids)
+        self.assertEqual(len(queries), 4)
+        course = cards[0]['courses'][0]
+        self.assertEqual((course['credits'], course['quiz'], course['present']), (3, 5, 1))
+        self.assertEqual((cards[0]['credits'], cards[0]['attendance_rate']), (3, 100.0))
+
+    def test_interrupted_runs_resume(self):
+        render_batch = reports.render_batch
+        calls = []
+
+        def interrupted(*args):
+            calls.append(args)
+            if len(calls) == 2:
+                raise KeyboardInterrupt
+            return render_batch(*args)
+
+        with mock.patch.object(reports, 'render_batch', interrupted), self.assertRaises(KeyboardInterrupt):
+            self.generate(batch_size=2)
+        output = self.generate(batch_size=2)
+        self.assertIn('2 students were done by an earlier run', output)
+        self.assertIn('Rendered 4 report cards', output)
+        self.assertIn('Rendered 6 report cards', self.generate(batch_size=2, restart=True))
+
+    def test_report_cards_run_as_a_job(self):
+        job = jobs.enqueue('report_cards', term='2025-fall', course=self.course.pk, formats=['csv'])
+        call_command('run_jobs', pool='inline', burst=True, stdout=io.StringIO())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.done, job.total), ('done', 6, 6))
+        self.assertEqual(job.result['files'], 1)
+
+        job = jobs.enqueue('report_cards', term='../etc')
+        call_command('run_jobs', pool='inline', burst=True, stdout=io.StringIO())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 1))
+
+
+class AutocompleteTests(SchoolTestCase):
+
+    def test_students_match_by_prefix_within_the_teachers_courses(self):
+        other = Course.objects.create(course_name='Art', course_code='ART1', department=self.department, credits=2)
+        Student.objects.create(name='Studious Stranger').courses.add(other)
+
+        response = self.get(self.teacher_user, 'autocomplete', '?q=STUD', kind='students')
+        names = [result['text'] for result in response.json()['results']]
+        self.assertEqual(names, [f'Student {i}' for i in range(6)])
+
+        response = self.get(self.teacher_user, 'autocomplete', f'?q=x&course={self.course.pk}', kind='students')
+        self.assertEqual(response.json()['results'], [])
+
+    def test_non_ascii_names_match_in_any_case(self):
+        for name in ('Élodie Martin', 'Ørsted Hansen', 'Straße Weber'):
+            Student.objects.create(name=name).courses.add(self.course)
+        Student.objects.bulk_create([Student(name='Émile Zola')])
+        Student.objects.get(name='Émile Zola').courses.add(self.course)
+
+        for query, expected in (('él', ['Élodie Martin']), ('ÉLO', ['Élodie Martin']), ('ør', ['Ørsted Hansen']),
+                                ('STRASSE', ['Straße Weber']), ('é', ['Élodie Martin', 'Émile Zola'])):
+            response = self.get(self.teacher_user, 'autocomplete', f'?q={query}', kind='students')
+            self.assertEqual([result['text'] for result in response.json()['results']], expected, query)
+
+        Student.objects.update(name_key='')
+        import_module('students.migrations.0021_student_name_key').backfill_name_keys(apps, None)
+        self.assertEqual(Student.objects.get(name='Ørsted Hansen').name_key, 'ørsted hansen')
+
+    def test_exams_carry_their_max_score(self):
+        response = self.get(self.teacher_user, 'autocomplete', '?q=mid', kind='exams')
+        self.assertEqual([(r['text'], r['max_score']) for r in response.json()['results']],
+                         [('midterm - Physics', 25)])
+
+    def test_unknown_kinds_and_students_are_refused(self):
+        self.assertEqual(self.get(self.teacher_user, 'autocomplete', kind='teachers').status_code, 404)
+        self.assertEqual(self.get(self.student.user, 'autocomplete', kind='students').status_code, 302)
+
+    def test_forms_render_only_the_selected_student(self):
+        response = self.get(self.teacher_user, 'add_grade')
+        self.assertContains(response, 'data-autocomplete="/autocomplete/students/"')
+        self.assertNotContains(response, 'Student 0')
+
+        response = self.client.post(reverse('add_grade'), {'student': self.student.pk, 'score': 'x'}, secure=True)
+        self.assertContains(response, f'<option value="{self.student.pk}" selected>Student 0</option>', html=True)
+        self.assertNotContains(response, 'Student 1')
+
+    def test_tampered_choices_rerender_as_errors(self):
+        self.client.force_login(self.teacher_user)
+        for student in ('abc', '999999'):
+            response = self.client.post(reverse('add_grade'), {'student': student, 'exam': 'x', 'score': 1},
+                                        secure=True)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.context['form'].has_error('student'))
+            self.assertNotContains(response, f'<option value="{student}"')
+
+
+class BenchmarkTests(SchoolTestCase):
+
+    def test_every_route_has_a_recipe(self):
+        self.assertEqual(set(benchmark.url_names()) - set(benchmark.ROUTES), set())
+
+    def test_sub_millisecond_queries_add_up_to_sql_time(self):
+        self.client.force_login(self.admin)
+        result = benchmark.measure(self.client, reverse('student_detail', args=[self.student.pk]), 3)
+        self.assertEqual(result['status'], 200)
+        self.assertGreater(result['queries'], 0)
+        self.assertGreater(result['sql_ms'], 0)
+        self.assertLess(result['sql_ms'], result['latency_ms'])
+
+
+class ReplicaRouterTests(SchoolTestCase):
+
+    def test_marked_views_read_from_the_replica_when_there_is_one(self):
+        router = ReplicaRouter()
+
+        @replica_reads
+        def view(request):
+            return [router.db_for_read(model) for model in (Student, CustomerUser, Permission,
+                                                            CustomerUser.groups.through)]
+
+        self.assertEqual(view(None), [None] * 4)
+        with mock.patch.dict(settings.DATABASES, {'replica': {}}):
+            self.assertEqual(view(None), ['replica', None, None, None])
+            self.assertIsNone(router.db_for_read(Student))
+        self.assertEqual(router.db_for_write(Student), 'default')
+        self.assertFalse(router.allow_migrate('replica', 'students'))
+
+    @contextmanager
+    def stale_replica(self):
+        # a real replica: a copy of the test database as it is now
+        path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), 'replica.sqlite3')
+        connection.ensure_connection()
+        # dumped, not backed up: the backup API waits for the test's open
+        # transaction, but a dump reads through it. The search index is a
+        # virtual table, which a dump cannot recreate; these pages skip it.
+        copy = sqlite3.connect(path)
+        copy.executescript('\n'.join(statement for statement in connection.connection.iterdump()
+                                     if search.TABLE not in statement))
+        copy.close()
+        replica = {**connections.settings['default'], 'NAME': path}
+        with mock.patch.dict(settings.DATABASES, {'replica': replica}), \
+                mock.patch.object(type(self), 'databases', {*self.databases, 'replica'}):
+            try:
+                yield
+            finally:
+                connections['replica'].close()
+                del connections['replica']
+
+    def test_access_checks_do_not_read_the_replica(self):
+        registrars = Group.objects.create(name='registrar')
+        registrars.permissions.add(Permission.objects.get(codename='view_student'))
+        self.teacher_user.groups.add(registrars)
+        self.assertEqual(self.get(self.teacher_user, 'student_list').status_code, 200)
+        self.assertEqual(self.get(self.teacher_user, 'grade_list').status_code, 200)
+
+        with self.stale_replica():
+            # marked views really do read the copy
+            Student.objects.create(name='After the copy')
+            self.assertEqual(replica_reads(lambda request: Student.objects.count())(None), 6)
+
+            registrars.permissions.clear()
+            self.assertEqual(self.client.get(reverse('student_list'), secure=True).status_code, 403)
+
+            self.teacher_user.is_active = False
+            self.teacher_user.save()
+            response = self.client.get(reverse('grade_list'), secure=True)
+            self.assertRedirects(response, f"{reverse('login')}?next={reverse('grade_list')}",
+                                 fetch_redirect_response=False)
+class PageWeightTests(SchoolTestCase):
+    # bytes of HTML per page for this fixture; styles belong in
+    # students/static/students/css, not inline
+    budgets = {
+        'login': 2000,
+        'signup': 3000,
+        'student_list': 5000,
+        'student_create': 2500,
+        'student_delete': 1500,
+        'student_detail': 2500,
+        'mark_attendance': 2000,
+        'teacher_dashboard': 2000,
+        'student_dashboard': 1500,
+    }
+
+    def test_pages_stay_within_their_byte_budgets(self):
+        users = {'login': None, 'signup': None, 'mark_attendance': self.teacher_user,
+                 'teacher_dashboard': self.teacher_user, 'student_dashboard': self.student.user}
+        needs_pk = {'student_delete', 'student_detail'}
+        for name, budget in self.budgets.items():
+            with self.subTest(name=name):
+                self.client.logout()
+                user = users.get(name, self.admin)
+                if user is not None:
+                    self.client.force_login(user)
+                kwargs = {'pk': self.student.pk} if name in needs_pk else None
+                response = self.client.get(reverse(name, kwargs=kwargs), secure=True)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotIn(b'<style', response.content)
+                self.assertLessEqual(len(response.content), budget)
+
+
+class StaticBundleTests(SchoolTestCase):
+
+    def test_stylesheets_are_hashed_compressed_and_cached_forever(self):
+        with tempfile.TemporaryDirectory() as root, self.settings(STATIC_ROOT=root, STORAGES={
+            **settings.STORAGES, 'staticfiles': {'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage'},
+        }):
+            call_command('collectstatic', interactive=False, verbosity=0, ignore_patterns=['admin'])
+            response = self.client.get(reverse('login'), secure=True)
+            url = re.search(rb'href="(/static/students/css/login\.[0-9a-f]{12}\.css)"', response.content)
+            self.assertIsNotNone(url)
+
+            response = self.client.get(url.group(1).decode(), HTTP_ACCEPT_ENCODING='gzip, br', secure=True)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Encoding'], 'br')
+            self.assertIn('immutable', response['Cache-Control'])
+            response.close()
+
+
+class MetricsTests(SchoolTestCase):
+
+    def test_metrics_are_staff_only(self):
+        response = self.get(self.teacher_user, 'metrics')
+        self.assertEqual(response.status_code, 302)
+
+    def test_metrics_count_requests_by_url_name(self):
+        self.get(self.student.user, 'my_grades')
+        response = self.get(self.admin, 'metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('school_http_requests_total{view="my_grades",method="GET",status="200"}', body)
+        self.assertIn('school_http_request_duration_seconds_bucket{view="my_grades",le="+Inf"}', body)
+
+    def test_snapshots_from_other_workers_are_added_up(self):
+        with tempfile.TemporaryDirectory() as directory, self.settings(METRICS_DIR=directory):
+            other = metrics.empty()
+            other['requests']['my_grades|GET|200'] = 5
+            with open(f'{directory}/metrics-other.json', 'w') as handle:
+                json.dump(other, handle)
+
+            registry = metrics.Registry()
+            registry.observe('my_grades', 'GET', 200, 0.01, 0.002, 3, 1500)
+            body = metrics.render(registry.collect())
+        self.assertIn('school_http_requests_total{view="my_grades",method="GET",status="200"} 6', body)
+
+    def test_exited_workers_are_folded_into_the_retired_totals(self):
+        exited = subprocess.Popen([sys.executable, '-c', ''])
+        exited.wait()
+        with tempfile.TemporaryDirectory() as directory, self.settings(METRICS_DIR=directory):
+            other = metrics.empty()
+            other['requests']['my_grades|GET|200'] = 5
+            with open(f'{directory}/metrics-{exited.pid}-abcd.json', 'w') as handle:
+                json.dump(other, handle)
+
+            leaving = metrics.Registry()
+            leaving.observe('my_grades', 'GET', 200, 0.01, 0.002, 3, 1500)
+            leaving.retire()
+
+            registry = metrics.Registry()
+            for _ in range(2):
+                self.assertEqual(registry.collect()['requests'], {'my_grades|GET|200': 6})
+            self.assertEqual(sorted(os.listdir(directory)), ['retired.json', 'retired.lock'])
+
+
+class IndexUsageTests(TestCase):
+    # EXPLAIN the hot view queries against a seeded school and make sure
+    # none of them scans a whole table or sorts it to page through it
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_school', students=300, days=5, stdout=io.StringIO())
+        cls.teacher = Teacher.objects.exclude(user=None).first()
+        cls.course = Course.objects.filter(teacher=cls.teacher).first()
+        cls.student = Student.objects.filter(courses=cls.course).first()
+
+    def assertUsesIndexes(self, queryset):
+        plan = queryset.explain()
+        for line in plan.splitlines():
+            detail = line.split(maxsplit=3)[-1]
+            self.assertNotRegex(detail, r'^SCAN students_\w+$', plan)
+            self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', detail, plan)
+
+    def test_attendance_queries(self):
+        today = timezone.localdate()
+        after = KeysetPaginator._after(['-date', 'id'], [today, self.student.pk])
+        for queryset in [
+            Attendance.objects.select_related('student', 'course').order_by('-date', 'id')[:51],
+            Attendance.objects.order_by('-date', 'id').filter(after)[:51],
+            Attendance.objects.filter(student=self.student).select_related('course'),
+            Attendance.objects.filter(course=self.course, date=today).values_list('student_id', 'status'),
+        ]:
+            with self.subTest(query=str(queryset.query)):
+                self.assertUsesIndexes(queryset)
+
+    def test_grade_queries(self):
+        for queryset in [
+            Grade.objects.filter(course=self.course).values_list('student_id', 'exam_id', 'score'),
+            Grade.objects.filter(student=self.student),
+            Gradebook.pivot(Grade.objects.filter(student_id__in=[self.student.pk], course_id__in=[self.course.pk])),
+            Gradebook.objects.filter(student=self.student).select_related('course'),
+            Gradebook.objects.filter(course__teacher=self.teacher)
+            .order_by('course__course_name', 'student__name', 'id')[:50],
+        ]:
+            with self.subTest(query=str(queryset.query)):
+                self.assertUsesIndexes(queryset)
+
+    def test_student_and_course_queries(self):
+        after = KeysetPaginator._after(['name', 'id'], [self.student.name, self.student.pk])
+        for queryset in [
+            Student.objects.order_by('name', 'id')[:6],
+            Student.objects.order_by('name', 'id').filter(after)[:6],
+            Course.objects.filter(teacher=self.teacher).order_by('course_name'),
+        ]:
+            with self.subTest(query=str(queryset.query)):
+                self.assertUsesIndexes(queryset)
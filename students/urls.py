@@ -21,14 +21,31 @@ urlpatterns=[
     
     #attendance
     path('mark/', views.mark_attendance, name='mark_attendance'),
+    path('mark/roster/', views.roster_attendance, name='roster_attendance'),
     path('attendance/', views.attendance_list, name='attendance_list'),
     path('my-attendance/', views.my_attendance, name='my_attendance'),
+    path('attendance/course/<int:pk>/', views.course_attendance, name='course_attendance'),
 
     #grades
     path('add-grade/', views.add_grade, name='add_grade'),
+    path('grades/grid/', views.grade_grid, name='grade_grid'),
     path('my-grades/', views.my_grades, name='my_grades'),
 
     path('grade-list/', views.grade_list, name='grade_list'),
 
+    #autocomplete
+    path('autocomplete/<str:kind>/', views.autocomplete_view, name='autocomplete'),
+
+    #exports
+    path('export/<str:kind>/', views.export_data, name='export_data'),
+
+    #background jobs
+    path('export/<str:kind>/job/', views.export_job, name='export_job'),
+    path('jobs/<int:pk>/', views.job_status, name='job_status'),
+    path('jobs/<int:pk>/download/', views.job_download, name='job_download'),
+
+    #monitoring
+    path('metrics/', views.metrics, name='metrics'),
+
 
 ]
\ No newline at end of file
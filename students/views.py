@@ -1,16 +1,28 @@
-from django.shortcuts import render, redirect, get_object_or_404
+import os
+
+from django.conf import settings
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
 from django.views.generic import ListView, CreateView, UpdateView, DeleteView, DetailView
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth import get_user_model, login
 from django.contrib.auth.models import Group
-from django.db.models import Q
-
-from .models import Student, Course,Attendance,Grade,Exam,Teacher,CustomerUser
-from .forms import StudentForm, StudentCourseForm, SignUpForm,AttendanceForm,GradeForm
+from django.core.paginator import Paginator
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.db.models import Prefetch, Q
+from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import require_POST
+
+from . import autocomplete, caching, concurrency, exports, jobs, search
+from .conditional import conditional
+from .metrics import registry as metrics_registry, render as render_metrics
+from .pagination import KeysetPaginator
+from .routers import replica_reads
+from .models import Student, Course,Attendance,Grade,Exam,Teacher,CustomerUser,Gradebook,AttendanceSummary,CourseAttendanceDay,Job
+from .forms import StudentForm, StudentCourseForm, SignUpForm,AttendanceForm,GradeForm,RosterCourseForm,RosterAttendanceForm,GradeGridForm,ExportFilterForm
 
-from collections import defaultdict
 # Always use get_user_model() for custom user
 User = get_user_model()
 
@@ -18,6 +30,7 @@ User = get_user_model()
 # -------------------------------
 # Class-Based Views for Student
 # -------------------------------
+@method_decorator(replica_reads, name='dispatch')
 class StudentsListView(LoginRequiredMixin, PermissionRequiredMixin, ListView):
     model = Student
     context_object_name = 'students'
@@ -26,8 +39,11 @@ class StudentsListView(LoginRequiredMixin, PermissionRequiredMixin, ListView):
     permission_required = 'students.view_student'
 
     def get_queryset(self):
-        queryset = super().get_queryset()
+        queryset = super().get_queryset().select_related('department').prefetch_related('courses')
         q = self.request.GET.get('q')
+        if q and search.available():
+            # ranked ids from the search index; only the shown page is loaded
+            return search.search_students(q)
         if q:
             queryset = queryset.filter(
                 Q(name__icontains=q) |
@@ -36,6 +52,29 @@ class StudentsListView(LoginRequiredMixin, PermissionRequiredMixin, ListView):
             ).distinct()
         return queryset
 
+    def paginate_queryset(self, queryset, page_size):
+        # ranked search ids are already in order; everything else pages on (name, id)
+        ordering = None if isinstance(queryset, list) else ['name', 'id']
+        paginator = KeysetPaginator(
+            queryset, page_size, ordering=ordering,
+            with_count=self.request.GET.get('count') == '1',
+        )
+        page = paginator.page(self.request.GET.get('cursor'))
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        page = context['page_obj']
+        if self.request.GET.get('q') and search.available():
+            students = (
+                Student.objects
+                .select_related('department')
+                .prefetch_related('courses')
+                .in_bulk(page.object_list)
+            )
+            page.object_list = [students[pk] for pk in page.object_list if pk in students]
+        return context
+
 
 class StudentCreateView(PermissionRequiredMixin, CreateView):
     model = Student
@@ -58,8 +97,18 @@ class StudentDeleteView(DeleteView):
     success_url = reverse_lazy("student_list")
 
 
+def student_detail_validator(request, pk):
+    updated_at = Student.objects.filter(pk=pk).values_list('updated_at', flat=True).first()
+    if updated_at is None:
+        return None
+    return [updated_at.isoformat()], updated_at
+
+
+@method_decorator(replica_reads, name='dispatch')
+@method_decorator(conditional(student_detail_validator), name='dispatch')
 class StudentDetail(DetailView):
     model = Student
+    queryset = Student.objects.select_related('department').prefetch_related('courses')
     template_name = 'students/student_detail.html'
     context_object_name = 'student'
 
@@ -123,19 +172,21 @@ def signup(request):
 # -------------------------------
 # User Role Checks
 # -------------------------------
+# roles are cached on the user row as is_teacher/is_student (kept in sync
+# with group membership in signals.py), so checking one costs no queries
 def teacher_check(user):
-    return user.groups.filter(name='teacher').exists()
+    return is_teacher(user)
 
 
 def student_check(user):
-    return user.groups.filter(name='student').exists()
+    return is_student(user)
 
 
 def is_teacher(user):
-    return user.is_teacher
+    return getattr(user, 'is_teacher', False)
 
 def is_student(user):
-    return user.is_student
+    return getattr(user, 'is_student', False)
 
 # -------------------------------
 # Dashboards
@@ -143,19 +194,70 @@ def is_student(user):
 @login_required
 @user_passes_test(teacher_check)
 
-def teacher_dashboard(request):
-    students = Student.objects.all()
-    return render(request, 'students/teacher_dashboard.html', {'students': students})
+async def teacher_dashboard(request):
+    user = await concurrency.request_user(request)
+    teacher = await aget_object_or_404(Teacher, user=user)
+    cursor = request.GET.get('cursor') or ''
+
+    def page():
+        enrolled = Student.courses.through.objects.filter(course__teacher=teacher).values('student_id')
+        students = (
+            Student.objects
+            .filter(pk__in=enrolled)
+            .select_related('department')
+            .prefetch_related(Prefetch('courses', queryset=Course.objects.filter(teacher=teacher),
+                                       to_attr='teacher_courses'))
+        )
+        return KeysetPaginator(students, 50, ordering=['name', 'id']).page(cursor or None)
+
+    async def context():
+        page_obj, = await concurrency.gather(page)
+        return {'page_obj': page_obj}
+
+    # cached per teacher and page; signals.py bumps the teacher's version
+    # whenever their roster could have changed
+    roster = await caching.afragment('teacher_dashboard', 'students/teacher_dashboard_roster.html', context,
+                                     scopes=[('teacher', teacher.pk), ('teacher', 'all')],
+                                     vary_on=[teacher.pk, cursor])
+
+    return render(request, 'students/teacher_dashboard.html', {'roster': roster})
 
 
 @login_required
 @user_passes_test(student_check)
-def student_dashboard(request):
-    student = get_object_or_404(Student, user=request.user)
-    courses = student.courses.all()
+async def student_dashboard(request):
+    user = await concurrency.request_user(request)
+    student = await aget_object_or_404(Student, user=user)
+
+    async def context():
+        # independent reads, run concurrently
+        courses, summaries = await concurrency.gather(
+            lambda: list(student.courses.all()),
+            lambda: {summary.course_id: summary for summary in AttendanceSummary.objects.filter(student=student)},
+        )
+        return {'courses': [(course, summaries.get(course.pk)) for course in courses]}
+
+    courses = await caching.afragment('student_dashboard', 'students/student_dashboard_courses.html', context,
+                                      scopes=student_scopes(student.pk), vary_on=[student.pk])
     return render(request, 'students/student_dashboard.html', {'courses': courses})
 
 
+def student_scopes(student_id):
+    # grade and attendance pages are cached per student; the rollup refreshes
+    # in models.py and the enrollment signals bump the student's version
+    return [('student', student_id), ('student', 'all')]
+
+
+def own_pages_validator(request):
+    # my_grades and my_attendance: the versions their tables are cached under
+    # already change whenever they would; updated_at covers the student row
+    row = Student.objects.filter(user=request.user).values_list('pk', 'updated_at').first()
+    if row is None:
+        return None
+    student_id, updated_at = row
+    return [updated_at.isoformat(), caching.versions(*student_scopes(student_id))], None
+
+
 # -------------------------------
 # Role-based redirect
 # -------------------------------
@@ -164,9 +266,9 @@ def role_redirect(request):
     if not request.user.is_authenticated:
         # If not logged in, send to login page
         return redirect('login')
-    if request.user.groups.filter(name='teacher').exists():
+    if is_teacher(request.user):
         return redirect('teacher_dashboard')
-    elif request.user.groups.filter(name='student').exists():
+    elif is_student(request.user):
         return redirect('student_dashboard')
     else:
         return redirect('admin:index')
@@ -180,26 +282,99 @@ def mark_attendance(request):
     teacher = get_object_or_404(Teacher, user=request.user)
 
     if request.method=='POST':
-        form=AttendanceForm(request.POST)
+        form=AttendanceForm(request.POST, teacher=teacher)
         if form.is_valid():
             form.save()
             return redirect('teacher_dashboard')
     else:
-        form=AttendanceForm()
+        form=AttendanceForm(teacher=teacher)
     return render(request,'students/attendance/mark_attendance.html',{'form':form})
 
+
 @login_required
 @user_passes_test(teacher_check)
+def roster_attendance(request):
+    teacher = get_object_or_404(Teacher, user=request.user)
+
+    course_form = RosterCourseForm(request.GET or None, teacher=teacher)
+    course = None
+    form = None
+
+    if course_form.is_valid():
+        course = course_form.cleaned_data['course']
+        students = course.student_set.order_by('name')
+        marked = dict(
+            Attendance.objects
+            .filter(course=course, date=timezone.localdate())
+            .values_list('student_id', 'status')
+        )
+
+        if request.method == 'POST':
+            form = RosterAttendanceForm(request.POST, students=students, marked=marked)
+            if form.is_valid():
+                Attendance.mark_roster(course, form.statuses())
+                return redirect('attendance_list')
+        else:
+            form = RosterAttendanceForm(students=students, marked=marked)
+
+    return render(request, 'students/attendance/roster_attendance.html', {
+        'course_form': course_form,
+        'course': course,
+        'form': form,
+    })
+
+@login_required
+@user_passes_test(teacher_check)
+@replica_reads
+async def course_attendance(request, pk):
+    user = await concurrency.request_user(request)
+    # the ownership check and both reports only need the course id, so all
+    # three run at once; the reports are dropped if the course is not theirs
+    course, summaries, days = await concurrency.gather(
+        lambda: Course.objects.filter(pk=pk, teacher__user=user).first(),
+        lambda: list(
+            AttendanceSummary.objects
+            .filter(course_id=pk)
+            .select_related('student')
+            .order_by('student__name')
+        ),
+        lambda: list(CourseAttendanceDay.objects.filter(course_id=pk)[:30]),
+    )
+    if course is None:
+        raise Http404('No course matches the given query.')
+    return render(request, 'students/attendance/course_attendance.html', {
+        'course': course,
+        'summaries': summaries,
+        'days': days,
+    })
+
+def attendance_list_validator(request):
+    return [caching.versions(('attendance', 'all'))], None
+
 
+@login_required
+@user_passes_test(teacher_check)
+@conditional(attendance_list_validator)
 def attendance_list(request):
-    attendance=Attendance.objects.all()
-    return render(request, 'students/attendance/attendance_list.html',{'attendance':attendance})
+    attendance=Attendance.objects.select_related('student','course')
+    paginator=KeysetPaginator(attendance,50,ordering=['-date','id'],
+                              with_count=request.GET.get('count')=='1')
+    page_obj=paginator.page(request.GET.get('cursor'))
+    return render(request, 'students/attendance/attendance_list.html',{'attendance':page_obj,'page_obj':page_obj})
 
 
 #view own attendance
 @login_required
-def my_attendance(request):
-    attendance=Attendance.objects.filter(student=request.user.student)
+@conditional(own_pages_validator)
+async def my_attendance(request):
+    user=await concurrency.request_user(request)
+    student=await aget_object_or_404(Student,user=user)
+
+    async def context():
+        return {'attendance':[row async for row in Attendance.objects.filter(student=student).select_related('course')]}
+
+    attendance=await caching.afragment('my_attendance','students/attendance/my_attendance_table.html',context,
+                                       scopes=student_scopes(student.pk),vary_on=[student.pk])
     return render(request, 'students/attendance/my_attendance.html',{'attendance':attendance})
 
 
@@ -220,56 +395,60 @@ def add_grade(request):
 
     return render(request, 'students/grades/add_grade.html', {'form': form})
 
-    
-
 
 @login_required
-def my_grades(request):
-
-    student = request.user.student
+def grade_grid(request):
 
-    grades = (
-        Grade.objects
-        .filter(student=student)
-        .select_related('exam', 'course')
-    )
+    teacher = get_object_or_404(Teacher, user=request.user)
 
-    courses_data = defaultdict(lambda: {
-        'quiz': None,
-        'test': None,
-        'midterm': None,
-        'final': None,
-        'sum': 0,
-        'percentage': 0
+    course_form = RosterCourseForm(request.GET or None, teacher=teacher)
+    course = None
+    form = None
+
+    if course_form.is_valid():
+        course = course_form.cleaned_data['course']
+        students = course.student_set.order_by('name')
+        exams = Exam.objects.filter(course=course).order_by('date', 'id')
+        scores = {
+            (student_id, exam_id): score
+            for student_id, exam_id, score in Grade.objects
+            .filter(course=course)
+            .values_list('student_id', 'exam_id', 'score')
+        }
+
+        if request.method == 'POST':
+            form = GradeGridForm(request.POST, request.FILES, students=students, exams=exams, scores=scores)
+            if form.is_valid():
+                Grade.save_grid(course, form.scores())
+                return redirect('grade_list')
+        else:
+            form = GradeGridForm(students=students, exams=exams, scores=scores)
+
+    return render(request, 'students/grades/grade_grid.html', {
+        'course_form': course_form,
+        'course': course,
+        'form': form,
     })
 
-    for g in grades:
-        course_name = g.course.course_name
-        exam_name = g.exam.name.lower()
+    
 
-        if exam_name == "quiz":
-            courses_data[course_name]['quiz'] = g.score
-            courses_data[course_name]['sum'] += g.score
 
-        elif exam_name == "test":
-            courses_data[course_name]['test'] = g.score
-            courses_data[course_name]['sum'] += g.score
+@login_required
+@conditional(own_pages_validator)
+async def my_grades(request):
 
-        elif exam_name == "midterm":
-            courses_data[course_name]['midterm'] = g.score
-            courses_data[course_name]['sum'] += g.score
+    user = await concurrency.request_user(request)
+    student = await aget_object_or_404(Student, user=user)
 
-        elif exam_name == "final":
-            courses_data[course_name]['final'] = g.score
-            courses_data[course_name]['sum'] += g.score
+    async def context():
+        return {'gradebook': [row async for row in Gradebook.objects.filter(student=student).select_related('course')]}
 
-    for course in courses_data:
-        total = courses_data[course]['sum']
-        courses_data[course]['percentage'] = total if total > 0 else 0
+    gradebook = await caching.afragment('my_grades', 'students/grades/my_grade_table.html', context,
+                                        scopes=student_scopes(student.pk), vary_on=[student.pk])
 
     return render(request, 'students/grades/my_grade.html', {
         'student': student,
-        'courses_data': dict(courses_data)
+        'gradebook': gradebook
     })
 
 
@@ -277,49 +456,147 @@ def my_grades(request):
 
 
 @login_required
+@replica_reads
 def grade_list(request):
     teacher = request.user.teacher
-    courses = Course.objects.filter(teacher=teacher)
-
-    grades = Grade.objects.filter(course__in=courses)\
-                           .select_related('student', 'exam')
-
-    students_data = defaultdict(lambda: {
-        'quiz': None,
-        'test': None,
-        'mid': None,
-        'final': None,
-        'sum': 0,
-        'percentage': 0
+    courses = Course.objects.filter(teacher=teacher).order_by('course_name')
+
+    gradebook = Gradebook.objects.filter(course__teacher=teacher)
+    course_id = request.GET.get('course')
+    if course_id and course_id.isdigit():
+        gradebook = gradebook.filter(course_id=course_id)
+
+    # scalar columns only, so a page costs the same however big the teacher's roster is
+    gradebook = gradebook.order_by('course__course_name', 'student__name', 'id').values(
+        'student__name', 'course__course_name',
+        'quiz', 'test', 'midterm', 'final', 'total', 'percentage',
+    )
+    page_obj = Paginator(gradebook, 50).get_page(request.GET.get('page'))
+
+    return render(request, 'students/grades/grade_list.html', {
+        'courses': courses,
+        'course_id': course_id,
+        'page_obj': page_obj,
     })
 
-    for g in grades:
-        name = g.exam.name.lower()
-        student = g.student
 
-        students_data[student]['student'] = student
 
-        if name == "quiz":
-            students_data[student]['quiz'] = g.score
-            students_data[student]['sum'] += g.score
-        elif name == "test":
-            students_data[student]['test'] = g.score
-            students_data[student]['sum'] += g.score
-        elif name == "mid":
-            students_data[student]['mid'] = g.score
-            students_data[student]['sum'] += g.score
-        elif name == "final":
-            students_data[student]['final'] = g.score
-            students_data[student]['sum'] += g.score
+# -------------------------------
+# Exports
+# -------------------------------
+@login_required
+@user_passes_test(lambda user: user.is_staff or teacher_check(user))
+@replica_reads
+def export_data(request, kind):
+    filters, error = export_filters(request, kind, request.GET)
+    if error:
+        return error
+
+    fmt = filters.pop('format')
+    rows = exports.export_queryset(kind, **filters)
+    # the rows are read while streaming, after replica_reads has returned;
+    # pin the database chosen for this view now
+    rows = rows.using(rows.db)
+    response = StreamingHttpResponse(exports.stream(kind, fmt, rows), content_type=exports.FORMATS[fmt])
+    response['Content-Disposition'] = f'attachment; filename="{kind}.{fmt}"'
+    return response
+
+
+def export_filters(request, kind, data):
+    # (export_queryset filters plus 'format', None) or (None, 400 response)
+    if kind not in exports.EXPORTS:
+        raise Http404('Unknown export')
+
+    form = ExportFilterForm(data)
+    if not form.is_valid():
+        return None, HttpResponseBadRequest(form.errors.as_text())
+
+    # staff export everything; teachers only their own courses
+    teacher = None
+    if not request.user.is_staff:
+        teacher = get_object_or_404(Teacher, user=request.user)
+    return {**form.cleaned_data, 'format': form.cleaned_data['format'] or 'csv', 'teacher': teacher}, None
 
-    for data in students_data.values():
-        data['percentage'] = data['sum']   # since total is already out of 100
 
-    return render(request, 'students/grades/grade_list.html', {
-        'students_data': students_data.values()
-    })
+# -------------------------------
+# Background jobs
+# -------------------------------
+@login_required
+@user_passes_test(lambda user: user.is_staff or teacher_check(user))
+@require_POST
+def export_job(request, kind):
+    # the same export as export_data, written to a file by a worker
+    filters, error = export_filters(request, kind, request.POST)
+    if error:
+        return error
+    teacher = filters.pop('teacher')
+    for name in ('start', 'end'):
+        filters[name] = filters[name] and filters[name].isoformat()
+    job = jobs.enqueue('export', user=request.user, kind=kind, teacher=teacher and teacher.pk, **filters)
+    return job_response(job, status=202)
+
+
+def own_jobs(user):
+    return Job.objects.all() if user.is_staff else Job.objects.filter(user=user)
+
+
+def job_response(job, status=200):
+    payload = jobs.describe(job)
+    if job.status == 'done' and (job.result or {}).get('file'):
+        payload['download'] = reverse('job_download', args=[job.pk])
+    response = JsonResponse(payload, status=status)
+    response['Location'] = reverse('job_status', args=[job.pk])
+    return response
 
 
+@login_required
+def job_status(request, pk):
+    # polled for progress: done, total, percent and message
+    return job_response(get_object_or_404(own_jobs(request.user), pk=pk))
+
+
+@login_required
+def job_download(request, pk):
+    job = get_object_or_404(own_jobs(request.user), pk=pk, status='done')
+    filename = (job.result or {}).get('file')
+    if not filename:
+        raise Http404('This job has no file.')
+    try:
+        output = open(os.path.join(settings.JOB_OUTPUT_DIR, filename), 'rb')
+    except FileNotFoundError:
+        raise Http404('The file is gone.')
+    # stored as <job id>-<name>
+    return FileResponse(output, as_attachment=True, filename=filename.split('-', 1)[1])
+
+
+# -------------------------------
+# Autocomplete
+# -------------------------------
+@login_required
+@user_passes_test(teacher_check)
+def autocomplete_view(request, kind):
+    if kind not in autocomplete.SOURCES:
+        raise Http404('Unknown autocomplete')
+    teacher = get_object_or_404(Teacher, user=request.user)
+
+    course = request.GET.get('course') or None
+    if course is not None and not course.isdigit():
+        return HttpResponseBadRequest('course must be an id')
+    results = autocomplete.SOURCES[kind](teacher, request.GET.get('q', ''), course=course)
+    return JsonResponse({'results': results})
+
+
+# -------------------------------
+# Metrics
+# -------------------------------
+@login_required
+@user_passes_test(lambda user: user.is_staff)
+def metrics(request):
+    return HttpResponse(
+        render_metrics(metrics_registry.collect()),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
+
 
 
 